@@ -0,0 +1,137 @@
+from typing import Dict, Iterator, List, NoReturn
+
+import os
+import numpy as np
+
+from TorchJAEKWON.DataProcess.Util.UtilManifest import UtilManifest
+
+class BucketBatchSampler:
+    def __init__(
+        self,
+        args_dict: dict
+    ):
+        r"""Batch sampler for DataSet which groups examples of similar length to reduce padding.
+        Every epoch the examples are shuffled, split into pools of pool_size, sorted by length in each pool
+        and cut into batches. The order of batches is shuffled.
+        Lengths are feature lengths of the subset manifests (UtilManifest) written at preprocessing.
+        Args (config):
+            length_feature_name: str, feature whose length is used, default the longest feature of each example
+            max_total_samples: int, default None. If set, a batch is filled while batch_num * longest_length <= max_total_samples,
+                (padded size of the batch) instead of the fixed batch_size.
+            max_batch_size: int, default None, maximum number of examples of a batch with max_total_samples
+            pool_size: int, default 100 * batch_size (10000 with max_total_samples)
+            drop_last: bool, default False, drop the last smaller batch of each pool (fixed batch_size only)
+            random_seed: int, default 0
+        """
+        self.h_params = args_dict["h_params"]
+        self.config = args_dict["config"]
+        self.subset = args_dict["subset"]
+        data_set = args_dict["data_set"]
+
+        self.max_total_samples:int = self.config.get("max_total_samples",None)
+        self.max_batch_size:int = self.config.get("max_batch_size",None)
+        self.batch_size:int = None if self.max_total_samples is not None else self.h_params.pytorch_data.dataloader[self.subset]["batch_size"]
+        self.pool_size:int = self.config.get("pool_size",10000 if self.batch_size is None else 100 * self.batch_size)
+        self.drop_last:bool = self.config.get("drop_last",False)
+        self.length_feature_name:str = self.config.get("length_feature_name",None)
+        self.random_state = np.random.RandomState(self.config.get("random_seed",0))
+
+        self.util_manifest = UtilManifest()
+        self.length_array:np.ndarray = self.get_length_array(data_set.data_path_array)
+        if self.max_total_samples is not None and np.any(self.length_array > self.max_total_samples):
+            print(f"Warning: {int(np.sum(self.length_array > self.max_total_samples))} examples are longer than max_total_samples. They are batched alone.")
+
+        self.skip_batch_num:int = 0
+        self.make_batch_list()
+
+    def get_length_array(self, data_path_array:np.ndarray) -> np.ndarray:
+        entry_dict_of_subset_path:dict = dict()
+        length_list:list = list()
+        for data_path in data_path_array:
+            subset_path, name = os.path.split(str(data_path))
+            if subset_path not in entry_dict_of_subset_path:
+                entry_dict_of_subset_path[subset_path] = self.util_manifest.get_entry_dict(os.path.dirname(subset_path),os.path.basename(subset_path))
+            entry:dict = entry_dict_of_subset_path[subset_path].get(name,dict())
+            feature_length_dict:dict = entry.get("feature_length_dict",None)
+            if feature_length_dict is None:
+                #manifest made without feature length
+                feature_length_dict = self.util_manifest.get_feature_length_dict(str(data_path))
+            if self.length_feature_name is not None:
+                length_list.append(feature_length_dict[self.length_feature_name])
+            else:
+                length_list.append(max(feature_length_dict.values()) if len(feature_length_dict) > 0 else 0)
+        return np.array(length_list,dtype=np.int64)
+
+    def make_batch_list(self) -> None:
+        self.batch_list_random_state = self.random_state.get_state()
+        index_array:np.ndarray = self.random_state.permutation(len(self.length_array))
+        batch_list:List[List[int]] = list()
+        for pool_begin in range(0,len(index_array),self.pool_size):
+            pool_index_array:np.ndarray = index_array[pool_begin:pool_begin + self.pool_size]
+            pool_index_array = pool_index_array[np.argsort(self.length_array[pool_index_array],kind="stable")]
+            batch_list += self.split_pool(pool_index_array)
+        self.random_state.shuffle(batch_list)
+        self.batch_list:List[List[int]] = batch_list
+        #set when the last batch is yielded. DataLoader workers get there while the consumer still has batches of this epoch to take,
+        #so the next epoch's batches are made at start_epoch / the next __iter__ and __len__ stays the length of this epoch
+        self.is_batch_list_consumed:bool = False
+
+    def split_pool(self, sorted_index_array:np.ndarray) -> List[List[int]]:
+        if self.batch_size is not None:
+            batch_list:list = [sorted_index_array[begin:begin + self.batch_size].tolist() for begin in range(0,len(sorted_index_array),self.batch_size)]
+            if self.drop_last and len(batch_list) > 0 and len(batch_list[-1]) < self.batch_size:
+                batch_list.pop()
+            return batch_list
+
+        batch_list = list()
+        batch:list = list()
+        #lengths are ascending, so the last added example is the longest one of the batch
+        for index in sorted_index_array.tolist():
+            full:bool = (len(batch) + 1) * self.length_array[index] > self.max_total_samples or (self.max_batch_size is not None and len(batch) >= self.max_batch_size)
+            if len(batch) > 0 and full:
+                batch_list.append(batch)
+                batch = list()
+            batch.append(index)
+        if len(batch) > 0:
+            batch_list.append(batch)
+        return batch_list
+
+    def start_epoch(self) -> None:
+        '''
+        called by Trainer before len(dataloader) of every epoch, so __len__ is the length of the epoch about to be iterated
+        '''
+        if self.is_batch_list_consumed or self.skip_batch_num >= len(self.batch_list):
+            self.make_batch_list()
+            self.skip_batch_num = 0
+
+    def __iter__(self) -> Iterator[List[int]]:
+        self.start_epoch()
+        self.iteration_random_state = self.batch_list_random_state
+        self.iteration_begin:int = self.skip_batch_num
+        self.skip_batch_num = 0
+        batch_list:list = self.batch_list
+
+        for batch in batch_list[self.iteration_begin:]:
+            yield batch
+        self.is_batch_list_consumed = True
+
+    def __len__(self) -> int:
+        return len(self.batch_list)
+
+    def state_dict(self, consumed_batch_num:int = None) -> Dict:
+        '''
+        batches are remade from the saved random state, so only the state of the epoch and the position are saved
+        '''
+        if consumed_batch_num is None and self.is_batch_list_consumed:
+            random_state, batch_num = self.random_state.get_state(), 0
+        elif consumed_batch_num is None or not hasattr(self,"iteration_random_state"):
+            random_state, batch_num = self.batch_list_random_state, self.skip_batch_num
+        else:
+            random_state, batch_num = self.iteration_random_state, self.iteration_begin + consumed_batch_num
+        return {'random_state': (random_state[0], random_state[1].astype(np.int64).tolist(), *random_state[2:]), 'consumed_batch_num': batch_num}
+
+    def load_state_dict(self, state) -> NoReturn:
+        random_state = state['random_state']
+        self.random_state.set_state((random_state[0], np.asarray(random_state[1],dtype=np.uint32), *random_state[2:]))
+        self.make_batch_list()
+        self.skip_batch_num = state['consumed_batch_num']
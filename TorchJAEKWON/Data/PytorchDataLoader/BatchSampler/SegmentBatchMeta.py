@@ -0,0 +1,47 @@
+from typing import Dict, Iterator
+
+import numpy as np
+
+class SegmentBatchMeta:
+    r"""Compact batch descriptor yielded by SegmentSampler.
+    column_dict: {
+        source_type: {
+            'name': str array (batch_size, mix_data_augmentation_num),
+            'data_path': str array (batch_size, mix_data_augmentation_num),
+            'begin_sample': int64 array (batch_size, mix_data_augmentation_num),
+            'end_sample': int64 array (batch_size, mix_data_augmentation_num)
+        }
+    }
+    It is sent to DataLoader workers as a few arrays instead of a list of dicts.
+    Datasets which define __getitems__ (e.g. DataSetSegment) use the arrays directly.
+    Otherwise DataLoader iterates it, which yields the per-example dicts of the list format:
+        {'vocals': [{'name':.., 'data_path':.., 'feature_type': 'vocals', 'begin_sample':.., 'end_sample':..}, ...], ...}
+    """
+
+    def __init__(self, column_dict:Dict[str,Dict[str,np.ndarray]]) -> None:
+        self.column_dict:Dict[str,Dict[str,np.ndarray]] = column_dict
+
+    def __len__(self) -> int:
+        for source_type in self.column_dict:
+            return len(self.column_dict[source_type]["begin_sample"])
+        return 0
+
+    def get_example_meta(self, example_index:int) -> dict:
+        example_meta_dict:dict = dict()
+        for source_type in self.column_dict:
+            column:dict = self.column_dict[source_type]
+            example_meta_dict[source_type] = [
+                {
+                    "name": str(column["name"][example_index][i]),
+                    "data_path": str(column["data_path"][example_index][i]),
+                    "feature_type": source_type,
+                    "begin_sample": int(column["begin_sample"][example_index][i]),
+                    "end_sample": int(column["end_sample"][example_index][i])
+                }
+                for i in range(len(column["begin_sample"][example_index]))
+            ]
+        return example_meta_dict
+
+    def __iter__(self) -> Iterator[dict]:
+        for example_index in range(len(self)):
+            yield self.get_example_meta(example_index)
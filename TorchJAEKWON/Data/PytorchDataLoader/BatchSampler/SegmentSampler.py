@@ -1,7 +1,14 @@
-import pickle
-from typing import Dict, List, NoReturn
+from typing import Dict, Iterator, NoReturn
+
+import threading
+from collections import deque
 
 import numpy as np
+import torch
+import torch.distributed as dist
+
+from TorchJAEKWON.DataProcess.Util.UtilSegmentIndex import UtilSegmentIndex
+from TorchJAEKWON.Data.PytorchDataLoader.BatchSampler.SegmentBatchMeta import SegmentBatchMeta
 
 class SegmentSampler:
     def __init__(
@@ -10,7 +17,9 @@ class SegmentSampler:
     ):
         r"""Sample training indexes of sources.
         Args:
-            indexes_path: str, path of indexes dict
+            indexes_dict_path: str, columnar index dir {root_path}/{result_file_name without ext} of MakeMetaDataSegmentIndexByFeatureType
+                ({subset} under it is used), or the legacy {root_path}/{result_file_name}.pkl.
+                For the .pkl, the columnar dir next to it is read if it is newer (see UtilSegmentIndex.load).
             input_source_types: list of str, e.g., ['vocals', 'accompaniment']
             target_source_types: list of str, e.g., ['vocals']
             segment_samplers: int
@@ -19,8 +28,17 @@ class SegmentSampler:
             batch_size: int
             steps_per_epoch: int, #steps_per_epoch is called an `epoch`
             random_seed: int
+            rank: int, default torch.distributed rank (0 if not initialized)
+            world_size: int, default torch.distributed world size (1 if not initialized)
+            state_history_num: int, default 1024, number of recent batches whose sampler state is kept
+                so state_dict() can return the position of the last batch consumed by the trainer
+                even though DataLoader workers already prefetched later batches
+        Every rank shuffles the same full permutation with the same seed and uses
+        permutation[rank::world_size], so ranks get disjoint segments and reshuffle at the same time.
         """
         self.h_params = args_dict["h_params"]
+        #DataPrefetcher iterates the sampler on its thread while Trainer.save_checkpoint calls state_dict()
+        self.state_lock = threading.Lock()
         self.config = args_dict["config"]
         self.subset = args_dict["subset"]
 
@@ -30,25 +48,30 @@ class SegmentSampler:
         self.steps_per_epoch = self.config["steps_per_epoch"]
         self.source_list:list = self.h_params.make_meta_data.make_meta_data_dict["MakeMetaDataSegmentIndexByFeatureType"]["feature_list"]
 
-        self.meta_dict = pickle.load(open(self.config["indexes_dict_path"], "rb"))
-        # E.g., {
-        #     'vocals': [
-        #         {'hdf5_path': 'songA.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 0, 'end_sample': 132300}，
-        #         {'hdf5_path': 'songB.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 4410, 'end_sample': 445410},
-        #         ... (e.g., 225752 dicts)
-        #     ],
-        #     'accompaniment': [
-        #         {'hdf5_path': 'songA.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 0, 'end_sample': 132300}，
-        #         {'hdf5_path': 'songB.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 4410, 'end_sample': 445410},
-        #         ... (e.g., 225752 dicts)
-        #     ]
+        distributed:bool = dist.is_available() and dist.is_initialized()
+        self.rank:int = self.config.get("rank",dist.get_rank() if distributed else 0)
+        self.world_size:int = self.config.get("world_size",dist.get_world_size() if distributed else 1)
+        assert 0 <= self.rank < self.world_size, f"rank {self.rank} should be in [0, {self.world_size})"
+
+        self.util_segment_index = UtilSegmentIndex()
+        self.segment_index_dict:dict = self.util_segment_index.load(self.config["indexes_dict_path"],self.source_list,self.subset)
+        # Columnar index (see UtilSegmentIndex), E.g., {
+        #     'path_table': ['songA/vocals.pkl', 'songB/vocals.pkl', ..., 'songA/accompaniment.pkl', ...],
+        #     'feature_dict': {
+        #         'vocals': {
+        #             'path_index': [0, 1, ...], 'begin_sample': [0, 4410, ...], 'end_sample': [132300, 136710, ...]
+        #             ... (e.g., 225752 segments)
+        #         },
+        #         'accompaniment': {...}
+        #     }
         # }
+        # A legacy pickled {source_type: [dict, ...]} index is converted to this form on load.
 
         self.pointers_dict = {source_type: 0 for source_type in self.source_list}
         # E.g., {'vocals': 0, 'accompaniment': 0}
 
         self.indexes_dict = {
-            source_type: np.arange(len(self.meta_dict[source_type]))
+            source_type: np.arange(self.util_segment_index.get_segment_num(self.segment_index_dict,source_type))
             for source_type in self.source_list
         }
         # E.g. {
@@ -58,6 +81,8 @@ class SegmentSampler:
 
         random_state_for_source_random_seed = np.random.RandomState(self.config["random_seed"])
         self.random_state_dict = {}
+        self.random_state_snapshot_dict = {}
+        # RNG state of each source right after its last shuffle (RNGs are used only when shuffling)
 
         for source_type in self.source_list:
 
@@ -75,116 +100,158 @@ class SegmentSampler:
 
             self.random_state_dict[source_type].shuffle(self.indexes_dict[source_type])
             # E.g., [198036, 196736, ..., 103408]
+            self.random_state_snapshot_dict[source_type] = self.random_state_dict[source_type].get_state()
+
+            print("{}: {} (rank {}: {})".format(source_type, len(self.indexes_dict[source_type]), self.rank, len(self.get_rank_indexes(source_type))))
 
-            print("{}: {}".format(source_type, len(self.indexes_dict[source_type])))
+        self.check_rank_segment_num()
+
+    def check_rank_segment_num(self) -> None:
+        r"""take_segment_indexes needs mix_audios_num distinct segments in the shard of each rank, otherwise it reshuffles forever."""
+        for source_type in self.source_list:
+            mix_audios_num:int = self.mix_data_augmentation_num.get(source_type,1)
+            rank_segment_num:int = len(self.get_rank_indexes(source_type))
+            if rank_segment_num < mix_audios_num:
+                raise ValueError(f"{source_type}: {len(self.indexes_dict[source_type])} segments over {self.world_size} ranks give {rank_segment_num} per rank, "
+                                 f"less than mix_data_augmentation_num {mix_audios_num}. Use more data, fewer ranks or a smaller mix_data_augmentation_num.")
 
-    def __iter__(self) -> List[Dict]:
+    def __iter__(self) -> Iterator[SegmentBatchMeta]:
         r"""Yield a batch of meta info.
         Returns:
-            batch_meta_list: (batch_size,) e.g., when mix-audio is 2, looks like [
+            batch_meta: SegmentBatchMeta, e.g., when mix-audio is 2, its column_dict looks like {
+                'vocals': {
+                    'data_path': [['songA/vocals.pkl', 'songB/vocals.pkl'], ... (batch_size)],
+                    'begin_sample': [[13406400, 4440870], ... (batch_size)],
+                    'end_sample': [[13538700, 4573170], ... (batch_size)],
+                    'name': [['songA', 'songB'], ... (batch_size)]
+                },
+                'accompaniment': {...}
+            }
+            Iterating batch_meta yields the same per-example dicts as the previous list format: [
                 {'vocals': [
-                    {'hdf5_path': 'songA.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 13406400, 'end_sample': 13538700},
-                    {'hdf5_path': 'songB.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 4440870, 'end_sample': 4573170}]
-                'accompaniment': [
-                    {'hdf5_path': 'songE.h5', 'key_in_hdf5': 'accompaniment', 'begin_sample': 14579460, 'end_sample': 14711760},
-                    {'hdf5_path': 'songF.h5', 'key_in_hdf5': 'accompaniment', 'begin_sample': 3995460, 'end_sample': 4127760}]
+                    {'name': 'songA', 'data_path': 'songA/vocals.pkl', 'feature_type': 'vocals', 'begin_sample': 13406400, 'end_sample': 13538700},
+                    {'name': 'songB', 'data_path': 'songB/vocals.pkl', 'feature_type': 'vocals', 'begin_sample': 4440870, 'end_sample': 4573170}]
+                'accompaniment': [...]
                 },
                 ...
             ]
         """
-        batch_size = self.batch_size
+        with self.state_lock:
+            self.state_history = deque(maxlen=self.config.get("state_history_num",1024))
+            self.state_history.append((0,self.get_state()))
+        yielded_batch_num:int = 0
 
         while True:
-            batch_meta_dict = {source_type: [] for source_type in self.source_list}
-
-            for source_type in self.source_list:
-                # E.g., ['vocals', 'accompaniment']
-
-                # Loop until get a mini-batch.
-                while len(batch_meta_dict[source_type]) != batch_size:
+            with self.state_lock:
+                batch_meta = self.get_batch_meta()
+                yielded_batch_num += 1
+                self.state_history.append((yielded_batch_num,self.get_state()))
+            yield batch_meta
 
-                    if source_type in self.mix_data_augmentation_num.keys():
-                        mix_audios_num = self.mix_data_augmentation_num[source_type]
+    def get_batch_meta(self) -> SegmentBatchMeta:
+        column_dict:dict = dict()
 
-                    else:
-                        mix_audios_num = 1
-
-                    largest_index = len(self.indexes_dict[source_type]) - mix_audios_num
-                    # E.g., 225750 = 225752 - 2
+        for source_type in self.source_list:
+            # E.g., ['vocals', 'accompaniment']
 
-                    if self.pointers_dict[source_type] > largest_index:
+            if source_type in self.mix_data_augmentation_num.keys():
+                mix_audios_num = self.mix_data_augmentation_num[source_type]
 
-                        # Reset pointer, and shuffle indexes.
-                        self.pointers_dict[source_type] = 0
-                        self.random_state_dict[source_type].shuffle(
-                            self.indexes_dict[source_type]
-                        )
+            else:
+                mix_audios_num = 1
 
-                    source_metas = []
+            segment_indexes = self.take_segment_indexes(source_type, self.batch_size, mix_audios_num).reshape(self.batch_size, mix_audios_num)
+            # E.g., [[12231, 3041], [198036, 77], ... (batch_size)]
 
-                    for _ in range(mix_audios_num):
+            segment_column_dict:dict = self.segment_index_dict["feature_dict"][source_type]
+            path_indexes = segment_column_dict["path_index"][segment_indexes]
+            column_dict[source_type] = {
+                "name": self.segment_index_dict["name_table"][path_indexes],
+                "data_path": self.segment_index_dict["path_table"][path_indexes],
+                "begin_sample": segment_column_dict["begin_sample"][segment_indexes],
+                "end_sample": segment_column_dict["end_sample"][segment_indexes]
+            }
 
-                        pointer = self.pointers_dict[source_type]
-                        # E.g., 1
+        return SegmentBatchMeta(column_dict)
 
-                        index = self.indexes_dict[source_type][pointer]
-                        # E.g., 12231
+    def get_rank_indexes(self, source_type:str) -> np.ndarray:
+        r"""Shard of this rank in the full shuffled indexes (a strided view).
+        Every rank gets the same number of indexes, so all ranks reshuffle at the same step.
+        """
+        shard_length:int = len(self.indexes_dict[source_type]) // self.world_size
+        return self.indexes_dict[source_type][self.rank::self.world_size][:shard_length]
 
-                        self.pointers_dict[source_type] += 1
+    def take_segment_indexes(self, source_type:str, example_num:int, mix_audios_num:int) -> np.ndarray:
+        r"""Slice example_num * mix_audios_num segment indexes out of the shuffled indexes.
+        Indexes are reshuffled when less than mix_audios_num indexes of this rank are left for an example.
+        """
+        segment_indexes_list:list = list()
 
-                        source_meta = self.meta_dict[source_type][index]
-                        # E.g., {
-                        #     'hdf5_path': 'xx/song_A.h5',
-                        #     'key_in_hdf5': 'vocals',
-                        #     'begin_sample': 13406400,
-                        # }
+        while example_num > 0:
+            pointer = self.pointers_dict[source_type]
+            rank_indexes = self.get_rank_indexes(source_type)
+            available_example_num = (len(rank_indexes) - pointer) // mix_audios_num
 
-                        source_metas.append(source_meta)
+            if available_example_num <= 0:
 
-                    batch_meta_dict[source_type].append(source_metas)
+                # Reset pointer, and shuffle indexes.
+                self.pointers_dict[source_type] = 0
+                self.indexes_dict[source_type] = self.random_state_dict[source_type].permutation(
+                    self.indexes_dict[source_type]
+                )
+                self.random_state_snapshot_dict[source_type] = self.random_state_dict[source_type].get_state()
+                continue
 
-            # When mix-audio is 2, batch_meta_dict looks like: {
-            #     'vocals': [
-            #         [{'hdf5_path': 'songA.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 13406400, 'end_sample': 13538700},
-            #          {'hdf5_path': 'songB.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 4440870, 'end_sample': 4573170}
-            #         ],
-            #         ... (batch_size)
-            #     ]
-            #     'accompaniment': [
-            #         [{'hdf5_path': 'songG.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 24232950, 'end_sample': 24365250},
-            #          {'hdf5_path': 'songH.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 1569960, 'end_sample': 1702260}
-            #         ],
-            #         ... (batch_size)
-            #     ]
-            # }
+            take_example_num = min(available_example_num, example_num)
+            segment_indexes_list.append(rank_indexes[pointer:pointer + take_example_num * mix_audios_num])
+            self.pointers_dict[source_type] += take_example_num * mix_audios_num
+            example_num -= take_example_num
 
-            batch_meta_list = [
-                {
-                    source_type: batch_meta_dict[source_type][i]
-                    for source_type in self.source_list
-                }
-                for i in range(batch_size)
-            ]
-            # When mix-audio is 2, batch_meta_list looks like: [
-            #     {'vocals': [
-            #         {'hdf5_path': 'songA.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 13406400, 'end_sample': 13538700},
-            #         {'hdf5_path': 'songB.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 4440870, 'end_sample': 4573170}]
-            #      'accompaniment': [
-            #         {'hdf5_path': 'songE.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 14579460, 'end_sample': 14711760},
-            #         {'hdf5_path': 'songF.h5', 'key_in_hdf5': 'vocals', 'begin_sample': 3995460, 'end_sample': 4127760}]
-            #     }
-            #     ... (batch_size)
-            # ]
-
-            yield batch_meta_list
+        return np.concatenate(segment_indexes_list)
 
     def __len__(self) -> int:
         return self.steps_per_epoch
 
-    def state_dict(self) -> Dict:
-        state = {'pointers_dict': self.pointers_dict, 'indexes_dict': self.indexes_dict}
-        return state
+    def get_state(self) -> Dict:
+        # indexes arrays are replaced (not modified) when reshuffled, so keeping references is enough
+        return {
+            'pointers_dict': dict(self.pointers_dict),
+            'indexes_dict': dict(self.indexes_dict),
+            'random_state_dict': dict(self.random_state_snapshot_dict)
+        }
+
+    def state_dict(self, consumed_batch_num:int = None) -> Dict:
+        r"""
+        consumed_batch_num: number of batches the trainer consumed from the current iterator.
+            If given, the state right after that batch is returned instead of the state after the
+            last batch prefetched by DataLoader.
+        numpy arrays are stored as tensors so the state can be saved with torch.save.
+        """
+        with self.state_lock:
+            state = self.get_state()
+            state_history:list = list(getattr(self,"state_history",[]))
+        if consumed_batch_num is not None and len(state_history) > 0:
+            history_state_list = [history_state for batch_num, history_state in state_history if batch_num == consumed_batch_num]
+            if len(history_state_list) > 0:
+                state = history_state_list[0]
+            else:
+                #never the prefetched position: the oldest kept state is the nearest one to the consumed batch
+                oldest_batch_num, state = state_history[0]
+                print(f"Warning: sampler state after {consumed_batch_num} batches is not kept (increase state_history_num). Save state after {oldest_batch_num} batches.")
+
+        return {
+            'pointers_dict': state['pointers_dict'],
+            'indexes_dict': {source_type: torch.from_numpy(np.array(state['indexes_dict'][source_type],dtype=np.int64)) for source_type in state['indexes_dict']},
+            'random_state_dict': {
+                source_type: (random_state[0], torch.from_numpy(random_state[1].astype(np.int64)), *random_state[2:])
+                for source_type, random_state in state['random_state_dict'].items()
+            }
+        }
 
     def load_state_dict(self, state) -> NoReturn:
-        self.pointers_dict = state['pointers_dict']
-        self.indexes_dict = state['indexes_dict']
\ No newline at end of file
+        self.pointers_dict = dict(state['pointers_dict'])
+        self.indexes_dict = {source_type: np.asarray(state['indexes_dict'][source_type],dtype=np.int64) for source_type in state['indexes_dict']}
+        for source_type, random_state in state.get('random_state_dict',dict()).items():
+            random_state = (random_state[0], np.asarray(random_state[1],dtype=np.uint32), *random_state[2:])
+            self.random_state_dict[source_type].set_state(random_state)
+            self.random_state_snapshot_dict[source_type] = random_state
@@ -0,0 +1,80 @@
+from typing import Dict, Iterator, List, NoReturn
+
+import os
+import threading
+from collections import deque
+import numpy as np
+
+from TorchJAEKWON.DataProcess.Util.UtilAliasSampler import UtilAliasSampler
+
+class WeightedBatchSampler:
+    def __init__(
+        self,
+        args_dict: dict
+    ):
+        r"""Batch sampler for DataSet which draws examples with replacement by dataset weights.
+        Datasets concatenated by PytorchDataLoader.get_data_path_dict are rebalanced without duplicating files.
+        Args (config):
+            dataset_weight_dict: dict, probability mass of each dataset, default 1.0 per dataset.
+            steps_per_epoch: int, default len(data_set) // batch_size
+            random_seed: int, default 0
+            state_history_num: int, default 1024, see SegmentSampler
+        """
+        self.h_params = args_dict["h_params"]
+        #DataPrefetcher iterates the sampler on its thread while Trainer.save_checkpoint calls state_dict()
+        self.state_lock = threading.Lock()
+        self.config = args_dict["config"]
+        self.subset = args_dict["subset"]
+        data_set = args_dict["data_set"]
+
+        self.batch_size:int = self.h_params.pytorch_data.dataloader[self.subset]["batch_size"]
+        self.steps_per_epoch:int = self.config.get("steps_per_epoch",max(len(data_set) // self.batch_size,1))
+        self.dataset_weight_dict:dict = self.config.get("dataset_weight_dict",dict())
+        self.random_state = np.random.RandomState(self.config.get("random_seed",0))
+
+        # data path: {root_path}/{data_name}/{subset}/{file_name}
+        data_name_list:list = list()
+        data_name_index_list:list = list()
+        for data_path in data_set.data_path_array:
+            data_name:str = os.path.relpath(str(data_path),self.h_params.data.root_path).split(os.sep)[0]
+            if data_name not in data_name_list:
+                data_name_list.append(data_name)
+            data_name_index_list.append(data_name_list.index(data_name))
+
+        weight_list:list = [float(self.dataset_weight_dict.get(data_name,1.0)) for data_name in data_name_list]
+        self.alias_sampler = UtilAliasSampler(weight_list,np.array(data_name_index_list,dtype=np.int64))
+        print("{} weights: {}".format(self.subset, dict(zip(data_name_list,weight_list))))
+
+    def __iter__(self) -> Iterator[List[int]]:
+        with self.state_lock:
+            self.state_history = deque(maxlen=self.config.get("state_history_num",1024))
+            self.state_history.append((0,self.random_state.get_state()))
+        yielded_batch_num:int = 0
+
+        while True:
+            with self.state_lock:
+                batch_index_list = self.alias_sampler.sample(self.random_state,self.batch_size).tolist()
+                yielded_batch_num += 1
+                self.state_history.append((yielded_batch_num,self.random_state.get_state()))
+            yield batch_index_list
+
+    def __len__(self) -> int:
+        return self.steps_per_epoch
+
+    def state_dict(self, consumed_batch_num:int = None) -> Dict:
+        with self.state_lock:
+            random_state = self.random_state.get_state()
+            state_history:list = list(getattr(self,"state_history",[]))
+        if consumed_batch_num is not None and len(state_history) > 0:
+            history_state_list = [history_state for batch_num, history_state in state_history if batch_num == consumed_batch_num]
+            if len(history_state_list) > 0:
+                random_state = history_state_list[0]
+            else:
+                #never the prefetched position: the oldest kept state is the nearest one to the consumed batch
+                oldest_batch_num, random_state = state_history[0]
+                print(f"Warning: sampler state after {consumed_batch_num} batches is not kept (increase state_history_num). Save state after {oldest_batch_num} batches.")
+        return {'random_state': (random_state[0], random_state[1].astype(np.int64).tolist(), *random_state[2:])}
+
+    def load_state_dict(self, state) -> NoReturn:
+        random_state = state['random_state']
+        self.random_state.set_state((random_state[0], np.asarray(random_state[1],dtype=np.uint32), *random_state[2:]))
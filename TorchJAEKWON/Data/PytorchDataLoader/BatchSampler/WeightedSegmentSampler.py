@@ -0,0 +1,51 @@
+import numpy as np
+
+from TorchJAEKWON.DataProcess.Util.UtilAliasSampler import UtilAliasSampler
+from TorchJAEKWON.Data.PytorchDataLoader.BatchSampler.SegmentSampler import SegmentSampler
+
+class WeightedSegmentSampler(SegmentSampler):
+    def __init__(
+        self,
+        args_dict: dict
+    ):
+        r"""SegmentSampler drawing segments with replacement by dataset weights instead of walking a permutation.
+        Args (config), in addition to SegmentSampler:
+            dataset_weight_dict: dict, probability mass of each dataset, default 1.0 per dataset.
+                e.g., {'musdb18': 1.0, 'small_corpus': 1.0} draws equally from both regardless of their sizes
+            source_weight_dict: dict, per source type override of dataset_weight_dict,
+                e.g., {'vocals': {'small_corpus': 3.0}}
+        A dataset is drawn in O(1) with an alias table, then a segment is drawn uniformly inside the dataset.
+        """
+        super().__init__(args_dict)
+        self.dataset_weight_dict:dict = self.config.get("dataset_weight_dict",dict())
+        self.source_weight_dict:dict = self.config.get("source_weight_dict",dict())
+        data_name_list:list = [str(data_name) for data_name in self.segment_index_dict["data_name_table"]]
+
+        self.alias_sampler_dict:dict = dict()
+        for source_type in self.source_list:
+            path_data_name_index = np.asarray(self.segment_index_dict["path_data_name_index"])
+            segment_data_name_index = path_data_name_index[np.asarray(self.segment_index_dict["feature_dict"][source_type]["path_index"])]
+            weight_list:list = [self.get_weight(source_type,data_name) for data_name in data_name_list]
+            self.alias_sampler_dict[source_type] = UtilAliasSampler(weight_list,segment_data_name_index)
+            print("{} weights: {}".format(source_type, dict(zip(data_name_list,weight_list))))
+
+        if self.world_size > 1:
+            # Draws are with replacement, so each rank just uses its own random stream.
+            for source_type in self.source_list:
+                rank_random_seed = self.random_state_dict[source_type].randint(low=0, high=2**31 - self.world_size) + self.rank
+                self.random_state_dict[source_type] = np.random.RandomState(rank_random_seed)
+                self.random_state_snapshot_dict[source_type] = self.random_state_dict[source_type].get_state()
+
+    def check_rank_segment_num(self) -> None:
+        #segments are drawn with replacement, so ranks don't need mix_audios_num distinct segments each
+        for source_type in self.source_list:
+            if len(self.indexes_dict[source_type]) == 0:
+                raise ValueError(f"{source_type}: no segment to sample")
+
+    def get_weight(self, source_type:str, data_name:str) -> float:
+        return float(self.source_weight_dict.get(source_type,dict()).get(data_name,self.dataset_weight_dict.get(data_name,1.0)))
+
+    def take_segment_indexes(self, source_type:str, example_num:int, mix_audios_num:int) -> np.ndarray:
+        segment_indexes = self.alias_sampler_dict[source_type].sample(self.random_state_dict[source_type], example_num * mix_audios_num)
+        self.random_state_snapshot_dict[source_type] = self.random_state_dict[source_type].get_state()
+        return segment_indexes
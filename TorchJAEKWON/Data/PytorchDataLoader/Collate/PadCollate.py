@@ -0,0 +1,73 @@
+from typing import List, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+from torch.utils.data import default_collate
+
+class PadCollate:
+    def __init__(
+        self,
+        args_dict: dict
+    ):
+        r"""collate_fn for examples whose features have different lengths, e.g. batches of BucketBatchSampler.
+        Array features of (nested) dict examples are padded to the longest one of the batch along pad_axis,
+        their lengths are added as {feature_name}{length_key_suffix}, and the batch is made by default_collate
+        (which already stacks into shared memory in DataLoader workers).
+        Args (config):
+            pad_value: float, default 0.0. None for no padding (default_collate only).
+            pad_axis: int, default -1
+            length_key_suffix: str, default '_length'
+        """
+        self.h_params = args_dict["h_params"]
+        self.config = args_dict["config"]
+        self.subset = args_dict["subset"]
+
+        self.pad_value:float = self.config.get("pad_value",0.0)
+        self.pad_axis:int = self.config.get("pad_axis",-1)
+        self.length_key_suffix:str = self.config.get("length_key_suffix","_length")
+
+    def is_paddable(self, value) -> bool:
+        return isinstance(value, (np.ndarray, Tensor)) and value.ndim > 0 and not (isinstance(value, np.ndarray) and value.dtype == object)
+
+    def pad_array_list(self, value_list:List[Union[np.ndarray,Tensor]]) -> tuple:
+        '''
+        return (list of Tensor padded to the longest one, lengths along pad_axis)
+        '''
+        tensor_list:List[Tensor] = [torch.as_tensor(value) for value in value_list]
+        pad_axis:int = self.pad_axis % tensor_list[0].ndim
+        length_list:list = [tensor.shape[pad_axis] for tensor in tensor_list]
+        max_length:int = max(length_list)
+        for example_index, tensor in enumerate(tensor_list):
+            if length_list[example_index] == max_length:
+                continue
+            shape:list = list(tensor.shape)
+            shape[pad_axis] = max_length
+            padded_tensor:Tensor = tensor.new_full(shape,self.pad_value)
+            padded_tensor.narrow(pad_axis,0,length_list[example_index]).copy_(tensor)
+            tensor_list[example_index] = padded_tensor
+        return tensor_list, length_list
+
+    def pad_example_list(self, example_list:list) -> list:
+        example = example_list[0]
+        if isinstance(example, dict):
+            padded_example_list:list = [dict(example) for example in example_list]
+            for key in example:
+                value_list:list = [example[key] for example in example_list]
+                if self.is_paddable(example[key]):
+                    value_list, length_list = self.pad_array_list(value_list)
+                    for padded_example, value, length in zip(padded_example_list,value_list,length_list):
+                        padded_example[key] = value
+                        padded_example[f"{key}{self.length_key_suffix}"] = length
+                elif isinstance(example[key], dict):
+                    for padded_example, value in zip(padded_example_list,self.pad_example_list(value_list)):
+                        padded_example[key] = value
+            return padded_example_list
+        if self.is_paddable(example):
+            return self.pad_array_list(example_list)[0]
+        return example_list
+
+    def __call__(self, example_list:list):
+        if self.pad_value is not None:
+            example_list = self.pad_example_list(example_list)
+        return default_collate(example_list)
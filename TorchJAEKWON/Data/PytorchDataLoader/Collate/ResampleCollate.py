@@ -0,0 +1,44 @@
+from typing import List
+
+import torch
+from torch import Tensor
+
+from TorchJAEKWON.DataProcess.Util.UtilAudioResample import UtilAudioResample
+from TorchJAEKWON.Data.PytorchDataLoader.Collate.PadCollate import PadCollate
+
+class ResampleCollate(PadCollate):
+    def __init__(
+        self,
+        args_dict: dict
+    ):
+        r"""PadCollate which first resamples audio of mixed sample rates to one target rate in the DataLoader worker,
+        so source material can be kept at its own rate instead of storing a copy per target rate.
+        Examples are dicts with audio features [..., time] and their sample rate under sample_rate_key.
+        Examples of the same rate are resampled as one conv1d batch with cached kernels (UtilAudioResample.resample_torch_list).
+        Args (config), in addition to PadCollate:
+            feature_list: list of audio feature names to resample
+            sample_rate_key: str, default 'sample_rate'
+            target_sample_rate: int, default h_params.preprocess.sample_rate
+            quality: 'fast', 'default' or 'best', default 'default'
+        Resampled lengths which differ in a batch are padded (pad_value of PadCollate).
+        """
+        super().__init__(args_dict)
+        self.feature_list:list = self.config["feature_list"]
+        self.sample_rate_key:str = self.config.get("sample_rate_key","sample_rate")
+        self.target_sample_rate:int = self.config.get("target_sample_rate",None) or self.h_params.preprocess.sample_rate
+        self.quality:str = self.config.get("quality","default")
+
+    def __call__(self, example_list:list):
+        #examples without sample rate are collated as they are
+        if not (isinstance(example_list[0], dict) and self.sample_rate_key in example_list[0]):
+            return super().__call__(example_list)
+        origin_sr_list:List[int] = [int(example[self.sample_rate_key]) for example in example_list]
+        example_list = [dict(example) for example in example_list]
+        for feature_name in self.feature_list:
+            audio_list:List[Tensor] = [torch.as_tensor(example[feature_name]) for example in example_list]
+            audio_list = UtilAudioResample.resample_torch_list(audio_list,origin_sr_list,self.target_sample_rate,self.quality)
+            for example, audio in zip(example_list,audio_list):
+                example[feature_name] = audio
+        for example in example_list:
+            example[self.sample_rate_key] = self.target_sample_rate
+        return super().__call__(example_list)
@@ -0,0 +1,62 @@
+from typing import Dict, List, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+
+class SegmentMixCollate:
+    def __init__(
+        self,
+        args_dict: dict
+    ):
+        r"""collate_fn for DataSetSegment batches of SegmentSampler.
+        All segments of the batch are put in one (batch_size, mix_data_augmentation_num, channels, samples) buffer per source,
+        then random gains, mix augmentation (sum over mix axis) and the mixture (sum over sources) are batched tensor ops.
+        Input is either a list of {source_type: ndarray (mix_data_augmentation_num, channels, samples)} (DataSetSegment.__getitem__)
+        or {source_type: ndarray (batch_size, mix_data_augmentation_num, channels, samples)} (DataSetSegment with batch_buffer: True).
+        Args (config):
+            gain_db_range: [min_db, max_db], default None (no gain). uniform random gain of each segment.
+            mixture_name: str, default 'mixture'
+            mixture_source_list: list of source types summed to the mixture, default all sources. [] for no mixture.
+        return {source_type: Tensor (batch_size, channels, samples), mixture_name: Tensor (batch_size, channels, samples)}
+        """
+        self.h_params = args_dict["h_params"]
+        self.config = args_dict["config"]
+        self.subset = args_dict["subset"]
+
+        self.gain_db_range:list = self.config.get("gain_db_range",None)
+        self.mixture_name:str = self.config.get("mixture_name","mixture")
+        self.mixture_source_list:list = self.config.get("mixture_source_list",None)
+
+    def get_batch_buffer_dict(self, example_list:Union[List[dict],Dict[str,np.ndarray]]) -> Dict[str,Tensor]:
+        if isinstance(example_list, dict):
+            return {source_type: torch.from_numpy(np.asarray(example_list[source_type],dtype=np.float32)) for source_type in example_list}
+
+        batch_buffer_dict:Dict[str,Tensor] = dict()
+        for source_type in example_list[0]:
+            segment_shape:tuple = example_list[0][source_type].shape
+            batch_buffer:Tensor = torch.empty((len(example_list),) + tuple(segment_shape),dtype=torch.float32)
+            for example_index, example in enumerate(example_list):
+                batch_buffer[example_index].copy_(torch.as_tensor(example[source_type]))
+            batch_buffer_dict[source_type] = batch_buffer
+        return batch_buffer_dict
+
+    def __call__(self, example_list:Union[List[dict],Dict[str,np.ndarray]]) -> Dict[str,Tensor]:
+        batch_buffer_dict:Dict[str,Tensor] = self.get_batch_buffer_dict(example_list)
+
+        batch_dict:Dict[str,Tensor] = dict()
+        for source_type in batch_buffer_dict:
+            batch_buffer:Tensor = batch_buffer_dict[source_type]
+            if self.gain_db_range is not None:
+                gain_db:Tensor = torch.empty(batch_buffer.shape[:2]).uniform_(self.gain_db_range[0],self.gain_db_range[1])
+                gain:Tensor = torch.pow(10.0, gain_db / 20.0).view(batch_buffer.shape[:2] + (1,) * (batch_buffer.dim() - 2))
+                batch_buffer.mul_(gain)
+            batch_dict[source_type] = batch_buffer.sum(dim=1)
+
+        mixture_source_list:list = list(batch_dict.keys()) if self.mixture_source_list is None else self.mixture_source_list
+        if len(mixture_source_list) > 0:
+            mixture:Tensor = batch_dict[mixture_source_list[0]].clone()
+            for source_type in mixture_source_list[1:]:
+                mixture.add_(batch_dict[source_type])
+            batch_dict[self.mixture_name] = mixture
+        return batch_dict
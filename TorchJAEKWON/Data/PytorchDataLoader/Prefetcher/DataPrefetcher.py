@@ -0,0 +1,135 @@
+from typing import Callable, Iterator
+
+import queue
+import threading
+import torch
+from torch.utils.data import DataLoader
+
+class DataPrefetcher:
+    STOP_POLL_SECONDS:float = 0.1
+    END_OF_DATA:str = "end_of_data"
+
+    def __init__(
+        self,
+        args_dict: dict
+    ):
+        r"""Wraps a DataLoader and keeps prefetch_num batches staged ahead on a background thread.
+        Batches are collated by the DataLoader, pinned and copied to the device on a side CUDA stream, then processed by batch_process_fn.
+        On CPU the batches are only staged, so it is safe to keep the config on CPU-only runs.
+        len() and batch_sampler are forwarded to the DataLoader, so Trainer uses it like a DataLoader.
+        Args (config):
+            prefetch_num: int, default 2
+            device: str, default h_params.resource.device
+            pin_memory: bool, default True. pin tensors which aren't pinned by the DataLoader before copying to cuda.
+            non_blocking: bool, default True
+        """
+        self.h_params = args_dict["h_params"]
+        self.config = args_dict["config"]
+        self.subset = args_dict["subset"]
+        self.data_loader:DataLoader = args_dict["data_loader"]
+
+        self.prefetch_num:int = self.config.get("prefetch_num",2)
+        self.device = torch.device(self.config.get("device",self.h_params.resource.device))
+        self.use_cuda:bool = self.device.type == "cuda" and torch.cuda.is_available()
+        self.pin_memory:bool = self.config.get("pin_memory",True) and self.use_cuda
+        self.non_blocking:bool = self.config.get("non_blocking",True)
+        self.batch_process_fn:Callable = None
+
+    def set_batch_process_fn(self, batch_process_fn:Callable) -> None:
+        '''
+        batch_process_fn(data) -> data, run on the prefetch thread after the device copy (e.g. feature extraction).
+        '''
+        self.batch_process_fn = batch_process_fn
+
+    def __len__(self) -> int:
+        return len(self.data_loader)
+
+    def __getattr__(self, name:str):
+        #batch_sampler, dataset, ... of the wrapped DataLoader
+        if name == "data_loader":
+            raise AttributeError(name)
+        return getattr(self.data_loader, name)
+
+    def to_device(self, data):
+        if isinstance(data, torch.Tensor):
+            if self.pin_memory and data.device.type == "cpu" and not data.is_pinned():
+                data = data.pin_memory()
+            return data.to(self.device, non_blocking=self.non_blocking)
+        if isinstance(data, dict):
+            return {key: self.to_device(data[key]) for key in data}
+        if isinstance(data, list):
+            return [self.to_device(value) for value in data]
+        if isinstance(data, tuple):
+            return type(data)(*[self.to_device(value) for value in data]) if hasattr(data,"_fields") else tuple(self.to_device(value) for value in data)
+        return data
+
+    def record_stream(self, data, stream) -> None:
+        #tell the caching allocator the tensors are used on the compute stream too
+        if isinstance(data, torch.Tensor):
+            if data.device.type == "cuda":
+                data.record_stream(stream)
+        elif isinstance(data, dict):
+            for key in data:
+                self.record_stream(data[key], stream)
+        elif isinstance(data, (list, tuple)):
+            for value in data:
+                self.record_stream(value, stream)
+
+    def put(self, batch_queue:queue.Queue, item, stop_event:threading.Event) -> bool:
+        while not stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=self.STOP_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def prefetch_loop(self, batch_queue:queue.Queue, stop_event:threading.Event, device_index:int) -> None:
+        try:
+            stream = None
+            if self.use_cuda:
+                torch.cuda.set_device(device_index)
+                stream = torch.cuda.Stream()
+            for data in self.data_loader:
+                if stop_event.is_set():
+                    return
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        data = self.to_device(data)
+                        if self.batch_process_fn is not None:
+                            data = self.batch_process_fn(data)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    data = self.to_device(data)
+                    if self.batch_process_fn is not None:
+                        data = self.batch_process_fn(data)
+                if not self.put(batch_queue, (data, event, None), stop_event):
+                    return
+            self.put(batch_queue, (self.END_OF_DATA, None, None), stop_event)
+        except Exception as exception:
+            self.put(batch_queue, (None, None, exception), stop_event)
+
+    def __iter__(self) -> Iterator:
+        batch_queue:queue.Queue = queue.Queue(maxsize=max(self.prefetch_num,1))
+        stop_event = threading.Event()
+        device_index:int = (self.device.index if self.device.index is not None else torch.cuda.current_device()) if self.use_cuda else -1
+        thread = threading.Thread(target=self.prefetch_loop, args=(batch_queue, stop_event, device_index), daemon=True)
+        thread.start()
+        try:
+            while True:
+                data, event, exception = batch_queue.get()
+                if exception is not None:
+                    raise exception
+                if isinstance(data, str) and data == self.END_OF_DATA:
+                    break
+                if event is not None:
+                    current_stream = torch.cuda.current_stream(self.device)
+                    current_stream.wait_event(event)
+                    self.record_stream(data, current_stream)
+                yield data
+        finally:
+            #Trainer breaks out of the loop at len(dataloader) with an infinite sampler
+            stop_event.set()
+            thread.join()
@@ -1,15 +1,39 @@
 import os
+import yaml
 from torch.utils.data import DataLoader
 
 from HParams import HParams
 from TorchJAEKWON.GetModule import GetModule
+from TorchJAEKWON.DataProcess.Util.UtilManifest import UtilManifest
 
 class PytorchDataLoader:
     def __init__(self):
         self.h_params = HParams()
         self.data_loader_config:dict = self.h_params.pytorch_data.dataloader
         self.get_module = GetModule()
-        self.module_name_list_of_data_loader_args:list = ["batch_sampler"]
+        self.util_manifest = UtilManifest()
+        self.module_name_list_of_data_loader_args:list = ["batch_sampler","collate_fn"]
+        self.merge_tuned_config()
+
+    def get_tuned_config_path(self) -> str:
+        tuned_config_path:str = getattr(self.h_params.pytorch_data,"tuned_config_path",None)
+        if tuned_config_path is None and self.h_params.mode.config_path is not None:
+            tuned_config_path = os.path.splitext(self.h_params.mode.config_path)[0] + "_dataloader_tuned.yaml"
+        return tuned_config_path
+
+    def merge_tuned_config(self) -> None:
+        '''
+        merge the overlay written by PytorchDataLoaderTuner (num_workers, prefetch_factor, persistent_workers, pin_memory per subset)
+        '''
+        tuned_config_path:str = self.get_tuned_config_path()
+        if tuned_config_path is None or not os.path.isfile(tuned_config_path):
+            return
+        with open(tuned_config_path, 'r') as yaml_file:
+            tuned_config_dict:dict = yaml.safe_load(yaml_file)["pytorch_data"]["dataloader"]
+        for subset in tuned_config_dict:
+            if subset in self.data_loader_config:
+                self.data_loader_config[subset].update(tuned_config_dict[subset])
+                print(f"{subset} data loader uses tuned config {tuned_config_dict[subset]}")
     
     def get_pytorch_data_loaders(self) -> dict:
         data_path_dict:dict = self.get_data_path_dict()
@@ -24,7 +48,7 @@ class PytorchDataLoader:
             if self.h_params.data.data_config_per_dataset_dict[data_name]["load_to_pytorch_dataset"]:
                 data_path:str = f"{self.h_params.data.root_path}/{data_name}"
                 for subset in data_path_dict:
-                    data_path_dict[subset] += [f"{data_path}/{subset}/{fname}" for fname in os.listdir(f"{data_path}/{subset}")]
+                    data_path_dict[subset] += self.util_manifest.get_path_list(data_path,subset)
         
         if self.h_params.mode.debug_mode:
             print("use small data because of debug mode")
@@ -38,7 +62,8 @@ class PytorchDataLoader:
         for subset in self.data_loader_config:
             config_for_dataset = {
                 "data_path_list": data_path_dict[subset],
-                "subset": subset
+                "subset": subset,
+                "data_set_config": self.data_loader_config[subset]["dataset"]
             }
             pytorch_dataset_dict[subset] = self.get_module.get_module("pytorch_dataset",self.data_loader_config[subset]["dataset"]["class_name"],config_for_dataset)
         return pytorch_dataset_dict
@@ -54,7 +79,7 @@ class PytorchDataLoader:
                 if arg_name in args_exception_list:
                     continue
                 if arg_name in self.module_name_list_of_data_loader_args:
-                    arguments_for_args_class = {"h_params":self.h_params,"config":self.data_loader_config[subset][arg_name],"subset":subset}
+                    arguments_for_args_class = {"h_params":self.h_params,"config":self.data_loader_config[subset][arg_name],"subset":subset,"data_set":pytorch_dataset[subset]}
                     pytorch_data_loader_config_dict[subset][arg_name] = self.get_module.get_module( arg_name, 
                                                                                                     self.data_loader_config[subset][arg_name]["class_name"],
                                                                                                     arguments_for_args_class)
@@ -64,7 +89,7 @@ class PytorchDataLoader:
         return pytorch_data_loader_config_dict
     
     def get_exception_list_of_dataloader_args_config(self,subset):
-        args_exception_list = ["dataset"]
+        args_exception_list = ["dataset", "prefetcher"]
         if "batch_sampler" in self.data_loader_config[subset]:
             args_exception_list += ["batch_size", "shuffle", "sampler", "drop_last"]
         return args_exception_list
@@ -73,6 +98,10 @@ class PytorchDataLoader:
         pytorch_data_loader_dict = dict()
         for subset in dataloader_config:
             pytorch_data_loader_dict[subset] = DataLoader(**dataloader_config[subset])
+            if self.data_loader_config.get(subset,dict()).get("prefetcher",None) is not None:
+                prefetcher_config:dict = self.data_loader_config[subset]["prefetcher"]
+                arguments_for_prefetcher = {"h_params":self.h_params,"config":prefetcher_config,"subset":subset,"data_loader":pytorch_data_loader_dict[subset]}
+                pytorch_data_loader_dict[subset] = self.get_module.get_module("prefetcher",prefetcher_config["class_name"],arguments_for_prefetcher)
         return pytorch_data_loader_dict
 
 
@@ -0,0 +1,110 @@
+import os
+import time
+import yaml
+import torch
+from torch.utils.data import DataLoader
+
+from TorchJAEKWON.Data.PytorchDataLoader.PytorchDataLoader import PytorchDataLoader
+
+class PytorchDataLoaderTuner(PytorchDataLoader):
+    '''
+    Measures DataLoader throughput of the configured dataset/sampler and writes the fastest
+    num_workers, prefetch_factor, persistent_workers and pin_memory as a config overlay (pytorch_data.tuned_config_path),
+    which PytorchDataLoader merges on the next run (default path: {config_path without .yaml}_dataloader_tuned.yaml).
+    One argument is swept at a time with the others fixed to the best so far.
+    pytorch_data.tune_config:
+        subset_list: default ['train']
+        num_workers_list: default [0, 2, 4, 8, 16, 24, 32] up to cpu count
+        prefetch_factor_list: default [2, 4, 8]
+        warmup_batch_num: default 10, not timed (worker start up)
+        measure_batch_num: default 50
+        epoch_num: default 2, DataLoader is re-iterated this many times, so persistent_workers is measured with its real benefit
+    '''
+    def __init__(self):
+        super().__init__()
+        self.tune_config:dict = getattr(self.h_params.pytorch_data,"tune_config",dict())
+        self.tuned_config_path:str = self.get_tuned_config_path()
+
+        cpu_num:int = os.cpu_count() or 1
+        self.num_workers_list:list = self.tune_config.get("num_workers_list",[num_workers for num_workers in [0, 2, 4, 8, 16, 24, 32] if num_workers <= cpu_num])
+        self.prefetch_factor_list:list = self.tune_config.get("prefetch_factor_list",[2, 4, 8])
+        self.warmup_batch_num:int = self.tune_config.get("warmup_batch_num",10)
+        self.measure_batch_num:int = self.tune_config.get("measure_batch_num",50)
+        self.epoch_num:int = self.tune_config.get("epoch_num",2)
+
+    def tune(self) -> dict:
+        subset_list:list = self.tune_config.get("subset_list",["train"])
+        data_path_dict:dict = self.get_data_path_dict()
+        pytorch_dataset_dict:dict = self.get_pytorch_data_set_dict(data_path_dict)
+        pytorch_data_loader_config_dict:dict = self.get_pytorch_data_loader_config(pytorch_dataset_dict)
+
+        tuned_config_dict:dict = dict()
+        for subset in subset_list:
+            tuned_config_dict[subset] = self.tune_subset(subset, pytorch_data_loader_config_dict[subset])
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.tuned_config_path)),exist_ok=True)
+        with open(self.tuned_config_path,'w') as yaml_file:
+            yaml.safe_dump({"pytorch_data":{"dataloader":tuned_config_dict}},yaml_file,default_flow_style=False)
+        print(f"tuned data loader config is saved to {self.tuned_config_path}")
+        return tuned_config_dict
+
+    def tune_subset(self, subset:str, data_loader_config:dict) -> dict:
+        best_args_dict:dict = {
+            "num_workers": data_loader_config.get("num_workers",0),
+            "prefetch_factor": data_loader_config.get("prefetch_factor",2),
+            "persistent_workers": data_loader_config.get("persistent_workers",False),
+            "pin_memory": data_loader_config.get("pin_memory",False) and torch.cuda.is_available()
+        }
+        candidate_dict:dict = {
+            "num_workers": self.num_workers_list,
+            "prefetch_factor": self.prefetch_factor_list,
+            "persistent_workers": [False, True],
+            "pin_memory": [False, True] if torch.cuda.is_available() else [False]
+        }
+        best_throughput:float = self.measure(data_loader_config, best_args_dict)
+        print(f"[{subset}] {best_args_dict}: {best_throughput:.2f} batch/s")
+
+        for arg_name in candidate_dict:
+            for arg_value in candidate_dict[arg_name]:
+                args_dict:dict = {**best_args_dict, arg_name: arg_value}
+                if args_dict == best_args_dict or (args_dict["num_workers"] == 0 and arg_name in ["prefetch_factor","persistent_workers"]):
+                    continue
+                throughput:float = self.measure(data_loader_config, args_dict)
+                print(f"[{subset}] {args_dict}: {throughput:.2f} batch/s")
+                if throughput > best_throughput:
+                    best_throughput = throughput
+                    best_args_dict = args_dict
+
+        print(f"[{subset}] best {best_args_dict}: {best_throughput:.2f} batch/s")
+        if best_args_dict["num_workers"] == 0:
+            best_args_dict["prefetch_factor"] = None
+            best_args_dict["persistent_workers"] = False
+        return best_args_dict
+
+    def get_data_loader(self, data_loader_config:dict, args_dict:dict) -> DataLoader:
+        data_loader_config = {**data_loader_config, **args_dict}
+        if data_loader_config["num_workers"] == 0:
+            data_loader_config["prefetch_factor"] = None
+            data_loader_config["persistent_workers"] = False
+        return DataLoader(**data_loader_config)
+
+    def measure(self, data_loader_config:dict, args_dict:dict) -> float:
+        '''
+        return: batches per second over measure_batch_num batches of every epoch, including the iterator start up after the first epoch
+        '''
+        data_loader:DataLoader = self.get_data_loader(data_loader_config, args_dict)
+        measured_batch_num:int = 0
+        measured_time:float = 0.0
+        for epoch in range(self.epoch_num):
+            start_time:float = time.perf_counter()
+            batch_num:int = 0
+            for _ in data_loader:
+                batch_num += 1
+                if epoch == 0 and batch_num == self.warmup_batch_num:
+                    start_time = time.perf_counter()
+                if batch_num >= self.measure_batch_num + (self.warmup_batch_num if epoch == 0 else 0):
+                    break
+            measured_time += time.perf_counter() - start_time
+            measured_batch_num += batch_num - (min(batch_num,self.warmup_batch_num) if epoch == 0 else 0)
+        del data_loader
+        return measured_batch_num / measured_time if measured_time > 0 else 0.0
@@ -1,22 +1,135 @@
 import torch.utils.data.dataset as dataset
+import os
 import pickle
+import numpy as np
+from collections import OrderedDict
+
+from TorchJAEKWON.DataProcess.Util.UtilData import UtilData
+from TorchJAEKWON.DataProcess.Util.UtilSharedMemoryCache import UtilSharedMemoryCache
+from TorchJAEKWON.DataProcess.Util.UtilSpectralFeatureStore import UtilSpectralFeatureStore
 
 class DataSet(dataset.Dataset):
 
     def __init__(self, config: dict):
+        '''
+        data_set_config (pytorch_data.dataloader[subset]["dataset"])
+            dataset_load_on_memory: bool, default True.
+                If False, features are stored as memory-mapped .npy files ({data_root}/memmap/{subset}/{name}/{feature_name}.npy)
+                and opened lazily once per DataLoader worker. They are written outside the subset dir, so its manifest stays valid.
+            memmap_cache_num: int, maximum number of data kept opened per worker in lazy mode.
+            cache_size_mb: int, default 0 (no cache). In lazy mode, recently read data are kept in
+                a LRU cache in shared memory which all DataLoader workers use.
+            load_spectral_feature: bool, default False. If True, features precomputed by MakeMetaDataSpectralFeature
+                for the current stft / mel config are added to each data, e.g. {feature_name}_mel (see ProcessMelSpectrogramPrecomputed).
+        Features stored as int16/float16 (storage_dtype.yaml of the dataset, see Preprocessor.save_data) are upcast to float32 when read.
+        '''
         data_path_list = config["data_path_list"]
         self.data_set_type = config["subset"]
-        self.files = []
-        for fname in data_path_list:
-            self.files.append(self.read_data(fname))
-    
+        self.data_set_config:dict = config.get("data_set_config",dict())
+        self.load_on_memory:bool = self.data_set_config.get("dataset_load_on_memory",True)
+        self.util_data = UtilData()
+        #numpy string array instead of list of str, so forked workers don't copy pages by touching refcount of each path
+        self.data_path_array:np.ndarray = np.array(data_path_list)
+        #{data_root_path: {feature_name: storage_dtype}}
+        self.storage_dtype_dict_of_root:dict = dict()
+        self.spectral_feature_store:UtilSpectralFeatureStore = None
+        if self.data_set_config.get("load_spectral_feature",False):
+            self.spectral_feature_store = UtilSpectralFeatureStore()
+
+        if self.load_on_memory:
+            self.files = []
+            for fname in data_path_list:
+                self.files.append(self.read_data(fname))
+            if self.spectral_feature_store is not None:
+                self.spectral_feature_list:list = [self.spectral_feature_store.load(fname) for fname in data_path_list]
+        else:
+            self.memmap_cache_num:int = self.data_set_config.get("memmap_cache_num",4096)
+            self.memmap_dict:OrderedDict = OrderedDict()
+            self.memmap_pid:int = None
+            cache_size_mb:float = self.data_set_config.get("cache_size_mb",0)
+            self.cache:UtilSharedMemoryCache = UtilSharedMemoryCache(int(cache_size_mb * 2**20)) if cache_size_mb > 0 else None
+
     def read_data(self, data_path):
         with open(data_path, 'rb') as pickle_file:
             file_data_dict = pickle.load(pickle_file)
         return file_data_dict
-    
+
+    def add_spectral_feature(self, index:int, data_dict):
+        if self.spectral_feature_store is None or not isinstance(data_dict,dict):
+            return data_dict
+        if self.load_on_memory:
+            spectral_feature_dict:dict = self.spectral_feature_list[index]
+        else:
+            spectral_feature_dict:dict = self.spectral_feature_store.load(str(self.data_path_array[index]))
+        if spectral_feature_dict is None:
+            return data_dict
+        return {**data_dict, **spectral_feature_dict}
+
+    def get_memmap_dir_path(self, data_path:str) -> str:
+        if os.path.isdir(data_path):
+            return data_path
+        #data_path: {root_path}/{data_name}/{subset}/{file_name}
+        subset_path, file_name = os.path.split(os.path.normpath(data_path))
+        data_root_path, subset = os.path.split(subset_path)
+        return os.path.join(data_root_path,"memmap",subset,os.path.splitext(file_name)[0])
+
+    def make_memmap_data(self, data_path:str, memmap_dir_path:str) -> None:
+        #write to temporary dir and rename, so workers converting the same data at the same time don't conflict
+        temp_dir_path:str = f"{memmap_dir_path}_tmp{os.getpid()}"
+        self.util_data.npy_dict_save(temp_dir_path,self.read_data(data_path))
+        try:
+            os.rename(temp_dir_path,memmap_dir_path)
+        except OSError:
+            for file_name in os.listdir(temp_dir_path):
+                os.remove(os.path.join(temp_dir_path,file_name))
+            os.rmdir(temp_dir_path)
+
+    def read_data_memmap(self, index:int) -> dict:
+        if self.memmap_pid != os.getpid():
+            #opened memmaps are not shared with forked workers
+            self.memmap_dict = OrderedDict()
+            self.memmap_pid = os.getpid()
+
+        if index in self.memmap_dict:
+            self.memmap_dict.move_to_end(index)
+        else:
+            data_path:str = str(self.data_path_array[index])
+            memmap_dir_path:str = self.get_memmap_dir_path(data_path)
+            if not os.path.isdir(memmap_dir_path):
+                self.make_memmap_data(data_path,memmap_dir_path)
+            self.memmap_dict[index] = self.util_data.npy_dict_load(memmap_dir_path)
+            if len(self.memmap_dict) > self.memmap_cache_num:
+                self.memmap_dict.popitem(last=False)
+
+        memmap_data_dict:dict = self.memmap_dict[index]
+        return {key: np.array(memmap_data_dict[key]) if isinstance(memmap_data_dict[key],np.memmap) else memmap_data_dict[key] for key in memmap_data_dict}
+
     def __len__(self):
-        return len(self.files)
-    
+        if self.load_on_memory:
+            return len(self.files)
+        return len(self.data_path_array)
+
+    def get_storage_dtype_dict(self, data_path:str) -> dict:
+        #data_path: {root_path}/{data_name}/{subset}/{file_name}
+        data_root_path:str = os.path.dirname(os.path.dirname(data_path))
+        if data_root_path not in self.storage_dtype_dict_of_root:
+            self.storage_dtype_dict_of_root[data_root_path] = self.util_data.load_storage_dtype_dict(data_root_path)
+        return self.storage_dtype_dict_of_root[data_root_path]
+
+    def decode(self, index:int, data_dict):
+        if not isinstance(data_dict,dict):
+            return data_dict
+        return self.util_data.decode_feature_dict(data_dict,self.get_storage_dtype_dict(str(self.data_path_array[index])))
+
     def __getitem__(self, index):
-        return self.files[index]
\ No newline at end of file
+        if self.load_on_memory:
+            return self.add_spectral_feature(index,self.decode(index,self.files[index]))
+        if self.cache is None:
+            return self.add_spectral_feature(index,self.decode(index,self.read_data_memmap(index)))
+
+        data_path:str = str(self.data_path_array[index])
+        data_dict:dict = self.cache.get(data_path)
+        if data_dict is None:
+            data_dict = self.read_data_memmap(index)
+            self.cache.put(data_path,data_dict)
+        return self.add_spectral_feature(index,self.decode(index,data_dict))
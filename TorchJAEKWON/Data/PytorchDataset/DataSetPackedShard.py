@@ -0,0 +1,42 @@
+import torch.utils.data.dataset as dataset
+import os
+
+from HParams import HParams
+from TorchJAEKWON.DataProcess.Util.UtilData import UtilData
+from TorchJAEKWON.DataProcess.Util.UtilPackedShard import UtilPackedShard
+
+class DataSetPackedShard(dataset.Dataset):
+
+    def __init__(self, config: dict):
+        '''
+        Read examples packed by MakeMetaDataPackedShard. data_path_list is not used.
+        data_set_config (pytorch_data.dataloader[subset]["dataset"])
+            shard_dir_path: str, default {root_path}/packed_shard/{subset}
+            feature_name_list: list of str, features to read. default all features of the example
+        int16/float16 features (storage_dtype.yaml of the dataset) are upcast to float32.
+        '''
+        self.h_params = HParams()
+        self.data_set_type = config["subset"]
+        self.data_set_config:dict = config.get("data_set_config",dict())
+        shard_dir_path:str = self.data_set_config.get("shard_dir_path",os.path.join(self.h_params.data.root_path,"packed_shard",self.data_set_type))
+        self.feature_name_list:list = self.data_set_config.get("feature_name_list",None)
+        self.packed_shard = UtilPackedShard(shard_dir_path)
+        self.packed_shard.load_index()
+        self.util_data = UtilData()
+        self.storage_dtype_dict_of_data_name:dict = dict()
+
+    def get_storage_dtype_dict(self, index:int) -> dict:
+        #example name: {data_name}/{name}
+        data_name:str = self.packed_shard.get_name(index).split("/")[0]
+        if data_name not in self.storage_dtype_dict_of_data_name:
+            self.storage_dtype_dict_of_data_name[data_name] = self.util_data.load_storage_dtype_dict(os.path.join(self.h_params.data.root_path,data_name))
+        return self.storage_dtype_dict_of_data_name[data_name]
+
+    def read_feature(self, index:int, feature_name:str):
+        return self.util_data.decode_feature(self.packed_shard.read_feature(index,feature_name),self.get_storage_dtype_dict(index).get(feature_name,None))
+
+    def __len__(self):
+        return self.packed_shard.get_example_num()
+
+    def __getitem__(self, index):
+        return self.util_data.decode_feature_dict(self.packed_shard.read_example(index,self.feature_name_list),self.get_storage_dtype_dict(index))
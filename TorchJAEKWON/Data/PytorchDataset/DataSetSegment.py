@@ -0,0 +1,152 @@
+import torch.utils.data.dataset as dataset
+import os
+import numpy as np
+from numpy import ndarray
+from collections import OrderedDict
+
+from HParams import HParams
+from TorchJAEKWON.DataProcess.Util.UtilData import UtilData
+from TorchJAEKWON.DataProcess.Util.UtilPackedShard import UtilPackedShard
+from TorchJAEKWON.DataProcess.Util.UtilSharedMemoryCache import UtilSharedMemoryCache
+from TorchJAEKWON.Data.PytorchDataLoader.BatchSampler.SegmentBatchMeta import SegmentBatchMeta
+
+class DataSetSegment(dataset.Dataset):
+
+    def __init__(self, config: dict):
+        '''
+        Dataset for the batch of SegmentSampler. Only [..., begin_sample:end_sample] of each feature is read from disk.
+        index (segment meta dict) looks like: {
+            'vocals': [{'name':.., 'data_path': '{data_root}/{subset}/{name}/vocals.pkl', 'begin_sample':.., 'end_sample':..}, ...(mix_data_augmentation_num)],
+            'accompaniment': [...]
+        }
+        data_set_config (pytorch_data.dataloader[subset]["dataset"])
+            storage: 'npy' or 'packed_shard', default 'npy'.
+                npy: memory-mapped {data_path without ext}.npy (written from the pickle on first access if not exist)
+                packed_shard: shard of MakeMetaDataPackedShard
+            shard_dir_path: str, default {root_path}/packed_shard/{subset}
+            memmap_cache_num: int, maximum number of npy files kept opened per worker
+            cache_size_mb: int, default 0 (no cache). If set, whole features are read once and kept in
+                a LRU cache in shared memory which all DataLoader workers use. Overlapping segments of
+                the same feature are then sliced from the cache.
+            batch_buffer: bool, default False. If True, a SegmentBatchMeta batch is read into
+                {source_type: ndarray (batch_size, mix_data_augmentation_num, ..., segment_samples)} buffers
+                instead of a list of examples, for collate_fn like SegmentMixCollate.
+        Features stored as int16/float16 (storage_dtype.yaml of the dataset) stay compact on disk and in the cache,
+        and each segment is upcast to float32 after it is read.
+        '''
+        self.h_params = HParams()
+        self.util_data = UtilData()
+        self.data_set_type = config["subset"]
+        self.data_set_config:dict = config.get("data_set_config",dict())
+        self.storage:str = self.data_set_config.get("storage","npy")
+        assert self.storage in ["npy","packed_shard"], f"storage should be 'npy' or 'packed_shard', not {self.storage}"
+
+        self.memmap_cache_num:int = self.data_set_config.get("memmap_cache_num",4096)
+        self.memmap_dict:OrderedDict = OrderedDict()
+        self.memmap_pid:int = None
+        self.storage_dtype_dict_of_root:dict = dict()
+        self.batch_buffer:bool = self.data_set_config.get("batch_buffer",False)
+        cache_size_mb:float = self.data_set_config.get("cache_size_mb",0)
+        self.cache:UtilSharedMemoryCache = UtilSharedMemoryCache(int(cache_size_mb * 2**20)) if cache_size_mb > 0 else None
+
+        if self.storage == "packed_shard":
+            shard_dir_path:str = self.data_set_config.get("shard_dir_path",os.path.join(self.h_params.data.root_path,"packed_shard",self.data_set_type))
+            self.packed_shard = UtilPackedShard(shard_dir_path)
+            self.example_index_dict:dict = self.packed_shard.get_example_index_dict()
+
+    def get_npy_path(self, data_path:str) -> str:
+        return os.path.splitext(data_path)[0] + ".npy"
+
+    def make_npy(self, data_path:str, npy_path:str) -> None:
+        temp_path:str = f"{npy_path}.tmp{os.getpid()}.npy"
+        np.save(temp_path,self.util_data.pickle_load(data_path))
+        os.replace(temp_path,npy_path)
+
+    def get_memmap(self, data_path:str) -> ndarray:
+        if self.memmap_pid != os.getpid():
+            #opened memmaps are not shared with forked workers
+            self.memmap_dict = OrderedDict()
+            self.memmap_pid = os.getpid()
+
+        if data_path in self.memmap_dict:
+            self.memmap_dict.move_to_end(data_path)
+            return self.memmap_dict[data_path]
+
+        npy_path:str = self.get_npy_path(data_path)
+        if not os.path.isfile(npy_path):
+            self.make_npy(data_path,npy_path)
+        self.memmap_dict[data_path] = np.load(npy_path,mmap_mode='r')
+        if len(self.memmap_dict) > self.memmap_cache_num:
+            self.memmap_dict.popitem(last=False)
+        return self.memmap_dict[data_path]
+
+    def read_feature(self, data_path:str, begin_sample:int = None, end_sample:int = None) -> ndarray:
+        if self.storage == "packed_shard":
+            #data_path: {root_path}/{data_name}/{subset}/{name}/{feature_name}.pkl
+            path_split:list = os.path.splitext(data_path)[0].replace(os.sep,"/").split("/")
+            example_name:str = f"{path_split[-4]}/{path_split[-2]}"
+            return self.packed_shard.read_feature(self.example_index_dict[example_name],path_split[-1],begin_sample,end_sample)
+        return np.array(self.get_memmap(data_path)[...,begin_sample:end_sample])
+
+    def get_storage_dtype(self, data_path:str) -> str:
+        #data_path: {root_path}/{data_name}/{subset}/{name}/{feature_name}.pkl
+        path_split:list = os.path.splitext(data_path)[0].replace(os.sep,"/").split("/")
+        data_root_path:str = "/".join(path_split[:-3])
+        if data_root_path not in self.storage_dtype_dict_of_root:
+            self.storage_dtype_dict_of_root[data_root_path] = self.util_data.load_storage_dtype_dict(data_root_path)
+        return self.storage_dtype_dict_of_root[data_root_path].get(path_split[-1],None)
+
+    def read_segment(self, data_path:str, begin_sample:int, end_sample:int) -> ndarray:
+        if self.cache is None:
+            segment:ndarray = self.read_feature(data_path,begin_sample,end_sample)
+        else:
+            segment = self.cache.get(data_path,begin_sample,end_sample)
+            if segment is None:
+                feature:ndarray = self.read_feature(data_path)
+                self.cache.put(data_path,feature)
+                segment = feature[...,begin_sample:end_sample]
+        return self.util_data.decode_feature(segment,self.get_storage_dtype(data_path))
+
+    def __getitem__(self, segment_meta_dict:dict) -> dict:
+        '''
+        return {source_type: ndarray (mix_data_augmentation_num, ..., segment_samples)}
+        '''
+        segment_dict:dict = dict()
+        for source_type in segment_meta_dict:
+            segment_dict[source_type] = np.stack([self.read_segment(meta["data_path"],meta["begin_sample"],meta["end_sample"]) for meta in segment_meta_dict[source_type]])
+        return segment_dict
+
+    def __getitems__(self, batch_meta:SegmentBatchMeta) -> list:
+        '''
+        called by DataLoader with the whole batch of SegmentSampler
+        '''
+        if not isinstance(batch_meta,SegmentBatchMeta):
+            return [self[segment_meta_dict] for segment_meta_dict in batch_meta]
+        if self.batch_buffer:
+            return self.read_batch_buffer(batch_meta)
+
+        example_list:list = [dict() for _ in range(len(batch_meta))]
+        for source_type in batch_meta.column_dict:
+            column:dict = batch_meta.column_dict[source_type]
+            for example_index in range(len(batch_meta)):
+                example_list[example_index][source_type] = np.stack([
+                    self.read_segment(str(data_path),int(begin_sample),int(end_sample))
+                    for data_path, begin_sample, end_sample in zip(column["data_path"][example_index],column["begin_sample"][example_index],column["end_sample"][example_index])
+                ])
+        return example_list
+
+    def read_batch_buffer(self, batch_meta:SegmentBatchMeta) -> dict:
+        '''
+        return {source_type: float32 ndarray (batch_size, mix_data_augmentation_num, ..., segment_samples)}
+        '''
+        batch_buffer_dict:dict = dict()
+        for source_type in batch_meta.column_dict:
+            column:dict = batch_meta.column_dict[source_type]
+            batch_buffer:ndarray = None
+            for example_index, mix_index in np.ndindex(column["begin_sample"].shape):
+                segment:ndarray = self.read_segment(str(column["data_path"][example_index][mix_index]),int(column["begin_sample"][example_index][mix_index]),int(column["end_sample"][example_index][mix_index]))
+                if batch_buffer is None:
+                    batch_buffer = np.empty(column["begin_sample"].shape + segment.shape,dtype=np.float32)
+                batch_buffer[example_index,mix_index] = segment
+            batch_buffer_dict[source_type] = batch_buffer
+        return batch_buffer_dict
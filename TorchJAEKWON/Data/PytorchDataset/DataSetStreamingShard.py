@@ -0,0 +1,136 @@
+from typing import Iterator, List, Tuple
+
+import os
+import itertools
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.utils.data.dataset as dataset
+from torch.utils.data import get_worker_info
+
+from HParams import HParams
+from TorchJAEKWON.DataProcess.Util.UtilData import UtilData
+from TorchJAEKWON.DataProcess.Util.UtilTarShard import UtilTarShard
+
+class DataSetStreamingShard(dataset.IterableDataset):
+
+    def __init__(self, config: dict):
+        '''
+        Stream examples from tar shards of MakeMetaDataTarShard. data_path_list is not used.
+        Shards are shuffled every epoch (same order on every rank), split across ranks then DataLoader workers,
+        and read front to back. Examples pass through a shuffle buffer.
+        Every rank yields the same number of examples in an epoch (the smallest rank total of that epoch's shard order),
+        so DDP ranks run the same number of steps. The examples over it are cut from the end of the rank's shard list.
+        Don't set shuffle, sampler or batch_sampler of the DataLoader.
+        data_set_config (pytorch_data.dataloader[subset]["dataset"])
+            shard_dir_path: str, default {root_path}/tar_shard/{subset}
+            feature_name_list: list of str, features to read. default all features of the example
+            shuffle: bool, default True for train
+            shuffle_buffer_size: int, default 1000
+            random_seed: int, default 0
+            rank: int, default torch.distributed rank (0 if not initialized)
+            world_size: int, default torch.distributed world size (1 if not initialized)
+        example: {feature_name: feature, ..., 'name': '{data_name}/{name}'}
+        int16/float16 features (storage_dtype.yaml of the dataset) are upcast to float32.
+        '''
+        self.h_params = HParams()
+        self.data_set_type = config["subset"]
+        self.data_set_config:dict = config.get("data_set_config",dict())
+        shard_dir_path:str = self.data_set_config.get("shard_dir_path",os.path.join(self.h_params.data.root_path,"tar_shard",self.data_set_type))
+        self.feature_name_list:list = self.data_set_config.get("feature_name_list",None)
+        self.shuffle:bool = self.data_set_config.get("shuffle",self.data_set_type == "train")
+        self.shuffle_buffer_size:int = self.data_set_config.get("shuffle_buffer_size",1000)
+        self.random_seed:int = self.data_set_config.get("random_seed",0)
+
+        distributed:bool = dist.is_available() and dist.is_initialized()
+        self.rank:int = self.data_set_config.get("rank",dist.get_rank() if distributed else 0)
+        self.world_size:int = self.data_set_config.get("world_size",dist.get_world_size() if distributed else 1)
+
+        self.tar_shard = UtilTarShard(shard_dir_path)
+        self.tar_shard.load_index()
+        self.util_data = UtilData()
+        self.storage_dtype_dict_of_data_name:dict = dict()
+        assert self.tar_shard.get_shard_num() >= self.world_size, f"{self.tar_shard.get_shard_num()} shards can't be split to {self.world_size} ranks"
+        self.epoch:int = 0
+        #__iter__ calls since set_epoch. persistent DataLoader workers keep their copy and don't see set_epoch of the main process
+        self.iteration_num:int = 0
+
+    def set_epoch(self, epoch:int) -> None:
+        '''
+        called by Trainer before every epoch, so every worker of every rank agrees on the shard order
+        '''
+        self.epoch = epoch
+        self.iteration_num = 0
+
+    def get_shard_index_array(self, epoch:int) -> np.ndarray:
+        shard_index_array:np.ndarray = np.arange(self.tar_shard.get_shard_num())
+        if self.shuffle:
+            shard_index_array = np.random.RandomState(self.random_seed + epoch).permutation(shard_index_array)
+        return shard_index_array
+
+    def get_rank_example_num(self, epoch:int) -> int:
+        '''
+        examples every rank yields in the epoch: the smallest total of the shards of a rank
+        '''
+        example_num_array:np.ndarray = np.asarray(self.tar_shard.load_index()["example_num_list"])[self.get_shard_index_array(epoch)]
+        return int(min(example_num_array[rank::self.world_size].sum() for rank in range(self.world_size)))
+
+    def get_rank_shard_list(self, epoch:int) -> List[Tuple[int,int]]:
+        '''
+        [(shard_index, number of examples to read from the shard)] of this rank, cut at get_rank_example_num
+        '''
+        example_num_list:list = self.tar_shard.load_index()["example_num_list"]
+        remain_example_num:int = self.get_rank_example_num(epoch)
+        rank_shard_list:list = list()
+        for shard_index in self.get_shard_index_array(epoch)[self.rank::self.world_size].tolist():
+            example_num:int = min(example_num_list[shard_index],remain_example_num)
+            remain_example_num -= example_num
+            rank_shard_list.append((shard_index,example_num))
+        return rank_shard_list
+
+    def __len__(self) -> int:
+        '''
+        examples of this rank in the current epoch. Iterating in DataLoader workers, set_epoch has to be called before every epoch
+        (Trainer does) so the main process knows the epoch.
+        '''
+        return self.get_rank_example_num(self.epoch + max(self.iteration_num - 1,0))
+
+    def get_storage_dtype_dict(self, name:str) -> dict:
+        #example name: {data_name}/{name}
+        data_name:str = name.split("/")[0]
+        if data_name not in self.storage_dtype_dict_of_data_name:
+            self.storage_dtype_dict_of_data_name[data_name] = self.util_data.load_storage_dtype_dict(os.path.join(self.h_params.data.root_path,data_name))
+        return self.storage_dtype_dict_of_data_name[data_name]
+
+    def iterate_examples(self, shard_list:List[Tuple[int,int]]) -> Iterator[dict]:
+        for shard_index, example_num in shard_list:
+            if example_num == 0:
+                continue
+            for name, feature_dict in itertools.islice(self.tar_shard.read_shard(shard_index,self.feature_name_list),example_num):
+                feature_dict = self.util_data.decode_feature_dict(feature_dict,self.get_storage_dtype_dict(name))
+                feature_dict["name"] = name
+                yield feature_dict
+
+    def __iter__(self) -> Iterator[dict]:
+        epoch:int = self.epoch + self.iteration_num
+        self.iteration_num += 1
+        worker_info = get_worker_info()
+        worker_id:int = 0 if worker_info is None else worker_info.id
+        worker_num:int = 1 if worker_info is None else worker_info.num_workers
+        shard_list:List[Tuple[int,int]] = self.get_rank_shard_list(epoch)[worker_id::worker_num]
+
+        if not self.shuffle or self.shuffle_buffer_size <= 1:
+            yield from self.iterate_examples(shard_list)
+            return
+
+        random_state = np.random.RandomState((self.random_seed + epoch) * 1000003 + self.rank * 1009 + worker_id)
+        shuffle_buffer:list = list()
+        for example in self.iterate_examples(shard_list):
+            if len(shuffle_buffer) < self.shuffle_buffer_size:
+                shuffle_buffer.append(example)
+                continue
+            buffer_index:int = random_state.randint(len(shuffle_buffer))
+            yield shuffle_buffer[buffer_index]
+            shuffle_buffer[buffer_index] = example
+        random_state.shuffle(shuffle_buffer)
+        yield from shuffle_buffer
@@ -0,0 +1,64 @@
+import os
+
+from TorchJAEKWON.DataProcess.MakeMetaData.MakeMetaData import MakeMetaData
+from TorchJAEKWON.DataProcess.Util.UtilData import UtilData
+from TorchJAEKWON.DataProcess.Util.UtilManifest import UtilManifest
+from TorchJAEKWON.DataProcess.Util.UtilPackedShard import UtilPackedShard
+
+class MakeMetaDataPackedShard(MakeMetaData):
+    r"""Pack preprocessed features into large shard files with an offset index.
+    Both layouts of preprocessed data are supported:
+        {data_root}/{subset}/{name}/{feature}.pkl (one pickle per feature)
+        {data_root}/{subset}/{name}.pkl (one pickled dict of features)
+    Result is written to {root_path}/{result_dir_name}/{subset} and read by DataSetPackedShard.
+    Examples are named '{data_name}/{name}'.
+    make_meta_data_config:
+        result_dir_name: str, default 'packed_shard'
+        shard_size_mb: int, default 1024
+    """
+
+    def __init__(self, make_meta_data_config:dict) -> None:
+        super().__init__(make_meta_data_config)
+        self.util_data = UtilData()
+        self.util_manifest = UtilManifest()
+        self.result_dir_name:str = self.make_meta_data_config.get("result_dir_name","packed_shard")
+        self.shard_size_bytes:int = int(self.make_meta_data_config.get("shard_size_mb",1024) * 2**20)
+        self.file_ext = ".pkl"
+
+    def make_meta_data(self):
+        subset_list:list = list()
+        for data_name in self.data_name_list:
+            for subset in self.h_params.data.data_config_per_dataset_dict[data_name]["subset_list"]:
+                if subset not in subset_list:
+                    subset_list.append(subset)
+
+        for subset in subset_list:
+            shard_dir_path:str = os.path.join(self.h_params.data.root_path,self.result_dir_name,subset)
+            packed_shard = self.get_shard(shard_dir_path)
+            packed_shard.open_writer(self.shard_size_bytes)
+
+            for data_name, data_root_path in zip(self.data_name_list,self.data_root_path_list):
+                data_path:str = os.path.join(data_root_path,subset)
+                entry_dict:dict = self.util_manifest.get_entry_dict(data_root_path,subset)
+                for i, file_name in enumerate(entry_dict):
+                    print(f"{subset} {data_name} {file_name} ({i+1} / {len(entry_dict)})")
+                    file_path:str = os.path.join(data_path,file_name)
+                    packed_shard.write_example(f"{data_name}/{os.path.splitext(file_name)[0]}",self.read_feature_dict(file_path,entry_dict[file_name]["file_name_list"]))
+
+            packed_shard.close_writer()
+            print(f"Write {packed_shard.get_example_num()} examples to {shard_dir_path}")
+
+    def get_shard(self, shard_dir_path:str) -> UtilPackedShard:
+        return UtilPackedShard(shard_dir_path)
+
+    def read_feature_dict(self, file_path:str, feature_file_name_list:list = None) -> dict:
+        if not os.path.isdir(file_path):
+            return self.util_data.pickle_load(file_path)
+        if feature_file_name_list is None:
+            feature_file_name_list = sorted(os.listdir(file_path))
+        feature_dict:dict = dict()
+        for feature_file_name in feature_file_name_list:
+            feature_name, ext = os.path.splitext(feature_file_name)
+            if ext == self.file_ext:
+                feature_dict[feature_name] = self.util_data.pickle_load(os.path.join(file_path,feature_file_name))
+        return feature_dict
@@ -1,8 +1,11 @@
 import os
 import pickle
+import numpy as np
 
 from HParams import HParams
 from DataProcess.MakeMetaData.MakeMetaData import MakeMetaData
+from TorchJAEKWON.DataProcess.Util.UtilSegmentIndex import UtilSegmentIndex
+from TorchJAEKWON.DataProcess.Util.UtilManifest import UtilManifest
 
 class MakeMetaDataSegmentIndexByFeatureType(MakeMetaData):
     r"""Create and write out training indexes into disk. The indexes may contain
@@ -18,10 +21,17 @@ class MakeMetaDataSegmentIndexByFeatureType(MakeMetaData):
             ...
         ]
     }
+    By default (index_format: 'columnar') the index is written as UtilSegmentIndex columns to
+    {root_path}/{result_file_name without ext}/{subset} instead of a pickled list of dicts (index_format: 'pickle').
+    Point SegmentSampler indexes_dict_path at {root_path}/{result_file_name without ext}. A config still pointing at the
+    old {root_path}/{result_file_name} reads the columnar index next to it when that is newer.
+    If save_npy is True in config, each feature is also written to {data_path without ext}.npy
+    so DataSetSegment can read only the segment range from disk.
+    Data are listed by the subset manifest (UtilManifest). Features whose length is in the manifest aren't loaded unless save_npy.
     """
 
-    def __init__(self, h_params:HParams, make_meta_data_config:dict) -> None:
-        super().__init__(h_params,make_meta_data_config)
+    def __init__(self, make_meta_data_config:dict) -> None:
+        super().__init__(make_meta_data_config)
         config:dict = make_meta_data_config
 
         self.feature_list = config["feature_list"]
@@ -31,10 +41,14 @@ class MakeMetaDataSegmentIndexByFeatureType(MakeMetaData):
         self.file_ext = ".pkl"
 
         self.result_file_name = config["result_file_name"]
+        self.save_npy:bool = config.get("save_npy",False)
+        self.index_format:str = config.get("index_format","columnar")
+        self.util_segment_index = UtilSegmentIndex()
+        self.util_manifest = UtilManifest()
         
     def make_meta_data(self):
         for subset in self.config_of_subset_dict:
-            segment_index_dict:dict = {feature_type: [] for feature_type in self.feature_list}
+            index_dict:dict = {"path_table":[], "name_table":[], "path_data_name_index":[], "data_name_table":self.data_name_list, "feature_dict":dict()}
             segment_samples_length = int(self.h_params.make_meta_data.segment_seconds * self.sample_rate)
             
             if "hopsize" in self.config_of_subset_dict[subset]:
@@ -42,34 +56,49 @@ class MakeMetaDataSegmentIndexByFeatureType(MakeMetaData):
             else:
                 segment_samples_hop_size = int(self.config_of_subset_dict[subset]["hop_seconds"] * self.sample_rate)
 
-            for feature_type in segment_index_dict:
+            for feature_type in self.feature_list:
                 print("--- {} ---".format(feature_type))
-                segment_data_num = 0
+                path_index_list:list = list()
+                begin_sample_list:list = list()
 
-                for data_root_path in self.data_root_path_list:
+                for data_name_index, data_root_path in enumerate(self.data_root_path_list):
                     data_path = os.path.join(data_root_path,subset)
-                    data_name_list = sorted(os.listdir(data_path))
+                    entry_dict:dict = self.util_manifest.get_entry_dict(data_root_path,subset)
+                    segment_data_num = 0
 
-                    for i, data_name in enumerate(data_name_list):
-                        print(f"{feature_type} of {data_name} ({i+1} / {len(data_name_list)})")
+                    for i, data_name in enumerate(entry_dict):
+                        print(f"{feature_type} of {data_name} ({i+1} / {len(entry_dict)})")
                         file_path = os.path.join(os.path.join(data_path,data_name),feature_type) + self.file_ext
-                        with open(file_path, 'rb') as pickle_file:
-                            feature = pickle.load(pickle_file)
+                        feature_length:int = (entry_dict[data_name]["feature_length_dict"] or dict()).get(feature_type,None)
+                        if feature_length is None or self.save_npy:
+                            with open(file_path, 'rb') as pickle_file:
+                                feature = pickle.load(pickle_file)
+                            feature_length = feature.shape[-1]
+                            if self.save_npy:
+                                np.save(os.path.splitext(file_path)[0] + ".npy",feature)
                         
-                        begin_sample = 0
-                        while begin_sample + segment_samples_length < feature.shape[-1]:
-                            segment_index_dict[feature_type].append(
-                                {
-                                    "name": data_name,
-                                    "data_path": file_path,
-                                    "feature_type": feature_type,
-                                    "begin_sample":begin_sample,
-                                    "end_sample": begin_sample + segment_samples_length
-                                })
-                            begin_sample += segment_samples_hop_size
-                            segment_data_num += 1
-                    print("{} indexes: {}".format(data_root_path, segment_data_num))   
-                print( "Total indexes for {}: {}".format(feature_type, len(segment_index_dict[feature_type])))
-            
-            pickle.dump(segment_index_dict, open(os.path.join(self.h_params.data.root_path,self.result_file_name), "wb"))
-            print("Write index dict to {}".format(os.path.join(self.h_params.data.root_path,self.result_file_name)))
\ No newline at end of file
+                        begin_sample_array:np.ndarray = np.arange(0,feature_length - segment_samples_length,segment_samples_hop_size,dtype=np.int64)
+                        path_index_list.append(np.full(len(begin_sample_array),len(index_dict["path_table"]),dtype=np.int32))
+                        begin_sample_list.append(begin_sample_array)
+                        index_dict["path_table"].append(file_path)
+                        index_dict["name_table"].append(data_name)
+                        index_dict["path_data_name_index"].append(data_name_index)
+                        segment_data_num += len(begin_sample_array)
+                    print("{} indexes: {}".format(data_root_path, segment_data_num))
+
+                begin_sample_array:np.ndarray = np.concatenate(begin_sample_list) if len(begin_sample_list) > 0 else np.zeros(0,dtype=np.int64)
+                index_dict["feature_dict"][feature_type] = {
+                    "path_index": np.concatenate(path_index_list) if len(path_index_list) > 0 else np.zeros(0,dtype=np.int32),
+                    "begin_sample": begin_sample_array,
+                    "end_sample": begin_sample_array + segment_samples_length
+                }
+                print( "Total indexes for {}: {}".format(feature_type, len(begin_sample_array)))
+
+            if self.index_format == "pickle":
+                result_path:str = os.path.join(self.h_params.data.root_path,self.result_file_name)
+                segment_index_dict:dict = {feature_type: [self.util_segment_index.get_segment_meta(index_dict,feature_type,i) for i in range(len(index_dict["feature_dict"][feature_type]["begin_sample"]))] for feature_type in self.feature_list}
+                pickle.dump(segment_index_dict, open(result_path, "wb"))
+            else:
+                result_path:str = os.path.join(self.h_params.data.root_path,os.path.splitext(self.result_file_name)[0],subset)
+                self.util_segment_index.save(result_path,index_dict)
+            print("Write index dict to {}".format(result_path))
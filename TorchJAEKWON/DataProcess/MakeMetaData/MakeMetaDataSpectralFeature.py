@@ -0,0 +1,55 @@
+import os
+import numpy as np
+
+from TorchJAEKWON.DataProcess.MakeMetaData.MakeMetaData import MakeMetaData
+from TorchJAEKWON.DataProcess.Util.UtilData import UtilData
+from TorchJAEKWON.DataProcess.Util.UtilManifest import UtilManifest
+from TorchJAEKWON.DataProcess.Util.UtilAudioMelSpec import UtilAudioMelSpec
+from TorchJAEKWON.DataProcess.Util.UtilSpectralFeatureStore import UtilSpectralFeatureStore
+
+class MakeMetaDataSpectralFeature(MakeMetaData):
+    r"""Compute STFT magnitude / mel of preprocessed audio once, so training reads them instead of recomputing every step.
+    Features are written to UtilSpectralFeatureStore keyed by the hash of the stft / mel config of h_params.preprocess,
+    read by DataSet (dataset_config load_spectral_feature: True) and used by ProcessMelSpectrogramPrecomputed.
+    Only data {root}/{data_name}/{subset}/{name}.pkl (pickled dict of features) are supported,
+    and the features match what the model sees only if DataSet returns whole data (no random crop).
+    make_meta_data_config:
+        feature_list: list of audio feature names, e.g. ['mixture', 'vocals']
+        feature_type_list: list of 'mag' and/or 'mel', default ['mel']
+        overwrite: bool, default False. If False, data already in the store are skipped.
+    """
+
+    def __init__(self, make_meta_data_config:dict) -> None:
+        super().__init__(make_meta_data_config)
+        self.util_data = UtilData()
+        self.util_manifest = UtilManifest()
+        self.util_mel = UtilAudioMelSpec()
+        self.feature_list:list = self.make_meta_data_config["feature_list"]
+        self.feature_type_list:list = self.make_meta_data_config.get("feature_type_list",["mel"])
+        self.overwrite:bool = self.make_meta_data_config.get("overwrite",False)
+        self.feature_store = UtilSpectralFeatureStore()
+
+    def make_meta_data(self):
+        print(f"spectral feature config {self.feature_store.config_dict} hash {self.feature_store.config_hash}")
+        for data_name, data_root_path in zip(self.data_name_list,self.data_root_path_list):
+            self.feature_store.save_config(data_root_path)
+            storage_dtype_dict:dict = self.util_data.load_storage_dtype_dict(data_root_path)
+            for subset in self.h_params.data.data_config_per_dataset_dict[data_name]["subset_list"]:
+                name_list:list = [name for name in self.util_manifest.get_name_list(data_root_path,subset) if os.path.splitext(name)[1] == ".pkl"]
+                for i, name in enumerate(name_list):
+                    data_path:str = os.path.join(data_root_path,subset,name)
+                    if not self.overwrite and os.path.isfile(self.feature_store.get_feature_path(data_path)):
+                        continue
+                    print(f"{subset} {data_name} {name} ({i+1} / {len(name_list)})")
+                    data_dict:dict = self.util_data.decode_feature_dict(self.util_data.pickle_load(data_path),storage_dtype_dict)
+                    self.feature_store.save(data_path,self.get_spectral_feature_dict(data_dict))
+
+    def get_spectral_feature_dict(self, data_dict:dict) -> dict:
+        spectral_feature_dict:dict = dict()
+        for feature_name in self.feature_list:
+            mag = self.util_mel.stft_torch(np.asarray(data_dict[feature_name],dtype=np.float32))["mag"]
+            if "mag" in self.feature_type_list:
+                spectral_feature_dict[self.feature_store.get_feature_name(feature_name,"mag")] = mag.numpy()
+            if "mel" in self.feature_type_list:
+                spectral_feature_dict[self.feature_store.get_feature_name(feature_name,"mel")] = self.util_mel.spec_to_mel_spec(mag).numpy()
+        return spectral_feature_dict
@@ -0,0 +1,17 @@
+from TorchJAEKWON.DataProcess.MakeMetaData.MakeMetaDataPackedShard import MakeMetaDataPackedShard
+from TorchJAEKWON.DataProcess.Util.UtilTarShard import UtilTarShard
+
+class MakeMetaDataTarShard(MakeMetaDataPackedShard):
+    r"""Write preprocessed features into sequential tar shards (UtilTarShard) read by DataSetStreamingShard.
+    Same layouts of preprocessed data and result path as MakeMetaDataPackedShard.
+    make_meta_data_config:
+        result_dir_name: str, default 'tar_shard'
+        shard_size_mb: int, default 1024
+    """
+
+    def __init__(self, make_meta_data_config:dict) -> None:
+        super().__init__(make_meta_data_config)
+        self.result_dir_name:str = self.make_meta_data_config.get("result_dir_name","tar_shard")
+
+    def get_shard(self, shard_dir_path:str) -> UtilTarShard:
+        return UtilTarShard(shard_dir_path)
@@ -1,12 +1,16 @@
 from typing import List
 
 from abc import ABC, abstractmethod
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import os
+import json
 import time
-from tkinter.messagebox import NO
+import traceback
 
 from HParams import HParams
+from TorchJAEKWON.DataProcess.Util.UtilManifest import UtilManifest
+from TorchJAEKWON.DataProcess.Util.UtilData import UtilData
+from TorchJAEKWON.DataProcess.Util.UtilSharedFileWorkQueue import UtilSharedFileWorkQueue
 
 class Preprocessor(ABC):
     def __init__(self, data_config_dict:dict = None) -> None:
@@ -14,26 +18,323 @@ class Preprocessor(ABC):
         self.data_name:str = self.get_dataset_name()
         self.preprocessed_data_path = os.path.join(self.h_params.data.root_path,self.data_name)
         self.data_config_dict:dict = data_config_dict
+        self.util_data = UtilData()
+        self.incremental:bool = getattr(self.h_params.preprocess,"incremental",False)
+        #{feature_name: 'int16' or 'float16'}, features are stored compactly by save_data and upcast to float32 by the datasets
+        self.storage_dtype_dict:dict = (data_config_dict or dict()).get("storage_dtype_dict",getattr(self.h_params.preprocess,"storage_dtype_dict",dict())) or dict()
     
     def write_message(self,message_type:str,message:str) -> None:
         with open(f"{self.preprocessed_data_path}/{message_type}.txt",'a') as file_writer:
             file_writer.write(message+'\n')
     
+    def save_data(self, save_path:str, data) -> None:
+        '''
+        pickle_save with storage_dtype_dict applied. data is a dict of features or the feature named by the file name of save_path.
+        '''
+        if isinstance(data,dict):
+            data = {feature_name: self.util_data.encode_feature(data[feature_name],self.storage_dtype_dict.get(feature_name,None)) for feature_name in data}
+        else:
+            data = self.util_data.encode_feature(data,self.storage_dtype_dict.get(self.util_data.get_file_name_from_path(save_path),None))
+        self.util_data.pickle_save(save_path,data)
+
     def preprocess_data(self) -> None:
-        meta_param_list:list = self.get_meta_data_param()
+        '''
+        Items of get_meta_data_param() are run largest first (get_meta_param_cost) in chunks on a process pool.
+        Failed items are retried h_params.preprocess.retry_num times, then written to {preprocessed_data_path}/failed_meta_param_list.pkl
+        (with tracebacks in failed.txt). With h_params.preprocess.only_failed, only the items of that list are run.
+        With h_params.preprocess.incremental, items whose source files and preprocess config are unchanged since they succeeded
+        (preprocess_manifest.jsonl) are skipped, so an interrupted run resumes and new data are processed alone.
+        It is off by default: edits of preprocess_one_data are not in the hash, so turn it off (or remove the manifest) after changing the code.
+        With h_params.preprocess.distributed_queue_dir, every host running preprocess on the same config and data shares the chunks
+        through UtilSharedFileWorkQueue ({distributed_queue_dir}/{data_name}/{get_distributed_run_id()}). After all chunks are done, one host retries failed items and makes the manifests.
+        '''
         start_time:float = time.time()
+        self.util_data.save_storage_dtype_dict(self.preprocessed_data_path,self.storage_dtype_dict)
+        if self.incremental:
+            self.preprocess_config_hash:str = self.get_preprocess_config_hash()
 
-        if self.h_params.preprocess.multi_processing:
-            with ProcessPoolExecutor(max_workers=self.h_params.preprocess.max_workers) as pool:
-                pool.map(self.preprocess_one_data, meta_param_list)
+        if getattr(self.h_params.preprocess,"distributed_queue_dir",None) is not None:
+            failed_list:list = self.run_distributed()
+            if failed_list is None:
+                print("Finish preprocess of this node. {:.3f} s".format(time.time() - start_time))
+                return
         else:
-            for i,meta_param in enumerate(meta_param_list):
-                print(f"{i+1}/{len(meta_param_list)}")
-                self.preprocess_one_data(meta_param)
+            failed_list = self.run_meta_param_list(self.get_meta_param_list_to_run())
+
+        for retry_index in range(getattr(self.h_params.preprocess,"retry_num",1)):
+            if len(failed_list) == 0:
+                break
+            print(f"retry {len(failed_list)} failed data ({retry_index + 1})")
+            failed_list = self.run_meta_param_list([meta_param for meta_param, _ in failed_list])
+        self.save_failed_list(failed_list)
 
+        if getattr(self.h_params.preprocess,"make_manifest",True):
+            self.make_manifest()
 
         print("Finish preprocess. {:.3f} s".format(time.time() - start_time))
 
+    def get_meta_param_list(self) -> list:
+        if getattr(self.h_params.preprocess,"only_failed",False):
+            return self.util_data.pickle_load(self.get_failed_meta_param_list_path())
+        return self.get_meta_data_param()
+
+    def get_meta_param_list_to_run(self) -> list:
+        meta_param_list:list = self.get_meta_param_list()
+        if self.incremental:
+            meta_param_list = self.get_changed_meta_param_list(meta_param_list)
+        return meta_param_list
+
+    def get_worker_num(self) -> int:
+        return (self.h_params.preprocess.max_workers or os.cpu_count() or 1) if self.h_params.preprocess.multi_processing else 1
+
+    def run_distributed(self) -> List[tuple]:
+        '''
+        run chunks leased from the shared queue on the local process pool until every chunk is done by any node.
+        return failed list on the finalizing node, None on the others
+        '''
+        work_queue = UtilSharedFileWorkQueue(os.path.join(self.h_params.preprocess.distributed_queue_dir,self.data_name,self.get_distributed_run_id()),
+                                             lease_seconds=getattr(self.h_params.preprocess,"distributed_lease_seconds",300))
+        worker_num:int = self.get_worker_num()
+        #only the first node lists (and hashes) the data, so every node runs the same chunks
+        chunk_list:List[list] = work_queue.init_task_list(lambda: self.get_chunk_list(self.get_meta_param_list_to_run(),worker_num))
+        if chunk_list is None:
+            print(f"node {work_queue.node_id}: {work_queue.queue_dir} is already finished by the other nodes of this run")
+            return None
+        print(f"node {work_queue.node_id}: {len(chunk_list)} chunks in {work_queue.queue_dir}")
+
+        future_dict:dict = dict()
+        last_print_time:float = 0.0
+        with ProcessPoolExecutor(max_workers=worker_num) as pool:
+            while True:
+                while len(future_dict) < worker_num * 2:
+                    task_id:int = work_queue.claim()
+                    if task_id is None:
+                        break
+                    future_dict[pool.submit(self.preprocess_chunk,chunk_list[task_id])] = task_id
+                if len(future_dict) == 0:
+                    if work_queue.is_all_done():
+                        break
+                    #the other nodes are running the rest, wait for them or for their expired leases
+                    time.sleep(work_queue.poll_seconds)
+                    continue
+                done_future_set, _ = wait(future_dict,timeout=work_queue.poll_seconds,return_when=FIRST_COMPLETED)
+                for future in done_future_set:
+                    task_id = future_dict.pop(future)
+                    try:
+                        result_list:list = future.result()
+                    except Exception:
+                        result_list = [(traceback.format_exc(), None)] * len(chunk_list[task_id])
+                    work_queue.complete(task_id,result_list)
+                if time.time() - last_print_time >= getattr(self.h_params.preprocess,"progress_interval_seconds",10):
+                    last_print_time = time.time()
+                    print(f"{len(work_queue.get_done_task_id_set())}/{len(chunk_list)} chunks done")
+        work_queue.stop_heartbeat()
+        work_queue.wait_all_done()
+
+        if not work_queue.try_finalize():
+            return None
+        progress_dict:dict = {"done": 0, "total": sum(len(chunk) for chunk in chunk_list), "start_time": time.time(), "print_time": 0.0}
+        failed_list:list = list()
+        for task_id, chunk in enumerate(chunk_list):
+            failed_list += self.collect_chunk_result(chunk,work_queue.get_result(task_id),progress_dict)
+        work_queue.finish()
+        return failed_list
+
+    def get_distributed_run_id(self) -> str:
+        '''
+        queue subdirectory of this run: h_params.preprocess.distributed_run_id, default hash of the preprocess config,
+        the meta params and the size / mtime of their source files. The nodes of one run agree on it,
+        and a later run with added or changed data (or another config) gets a new queue.
+        '''
+        run_id:str = getattr(self.h_params.preprocess,"distributed_run_id",None)
+        if run_id is not None:
+            return str(run_id)
+        meta_param_record_list:list = list()
+        for meta_param in self.get_meta_param_list():
+            stat_list:list = [os.stat(source_path) for source_path in self.get_meta_param_source_path_list(meta_param)]
+            meta_param_record_list.append([meta_param, [[stat.st_size, stat.st_mtime_ns] for stat in stat_list]])
+        return self.util_data.get_config_hash({"preprocess_config": self.get_preprocess_config_hash(), "meta_param_list": meta_param_record_list})
+
+    def get_meta_param_source_path_list(self, meta_param) -> List[str]:
+        '''
+        source files of a meta param. default: str elements of the param which are existing files
+        '''
+        param_list:list = list(meta_param) if isinstance(meta_param,(tuple,list)) else [meta_param]
+        return [param for param in param_list if isinstance(param,str) and os.path.isfile(param)]
+
+    def get_meta_param_cost(self, meta_param) -> float:
+        '''
+        relative cost of a meta param for the scheduling. default: size of the source files
+        '''
+        return float(sum(os.path.getsize(source_path) for source_path in self.get_meta_param_source_path_list(meta_param)))
+
+    def get_chunk_list(self, meta_param_list:list, worker_num:int) -> List[list]:
+        '''
+        chunks of meta params, largest first. The pool runs them in order, so small items fill the tail.
+        '''
+        if getattr(self.h_params.preprocess,"largest_first",True):
+            cost_list:list = [self.get_meta_param_cost(meta_param) for meta_param in meta_param_list]
+            meta_param_list = [meta_param_list[i] for i in sorted(range(len(meta_param_list)),key=lambda i: -cost_list[i])]
+        chunksize:int = getattr(self.h_params.preprocess,"chunksize",None) or max(1,min(64,len(meta_param_list) // (worker_num * 16)))
+        return [meta_param_list[i:i+chunksize] for i in range(0,len(meta_param_list),chunksize)]
+
+    def preprocess_chunk(self, meta_param_list:list) -> List[tuple]:
+        '''
+        return (error message (traceback) or None if succeeded, source record list or None) of each meta param
+        '''
+        result_list:list = list()
+        for meta_param in meta_param_list:
+            try:
+                self.preprocess_one_data(meta_param)
+                result_list.append((None, self.get_source_record_list(meta_param) if self.incremental else None))
+            except Exception:
+                result_list.append((traceback.format_exc(), None))
+        return result_list
+
+    def run_meta_param_list(self, meta_param_list:list) -> List[tuple]:
+        '''
+        return [(meta_param, error message), ...] of failed meta params
+        '''
+        worker_num:int = self.get_worker_num()
+        chunk_list:List[list] = self.get_chunk_list(meta_param_list,worker_num)
+        progress_dict:dict = {"done": 0, "total": len(meta_param_list), "start_time": time.time(), "print_time": 0.0}
+        failed_list:list = list()
+
+        if not self.h_params.preprocess.multi_processing:
+            for chunk in chunk_list:
+                failed_list += self.collect_chunk_result(chunk,self.preprocess_chunk(chunk),progress_dict)
+            return failed_list
+
+        with ProcessPoolExecutor(max_workers=worker_num) as pool:
+            future_dict:dict = {pool.submit(self.preprocess_chunk,chunk): chunk for chunk in chunk_list}
+            for future in as_completed(future_dict):
+                chunk:list = future_dict[future]
+                try:
+                    result_list:list = future.result()
+                except Exception:
+                    #the worker died (e.g. killed by OOM), every item of the chunk is failed
+                    result_list = [(traceback.format_exc(), None)] * len(chunk)
+                failed_list += self.collect_chunk_result(chunk,result_list,progress_dict)
+        return failed_list
+
+    def collect_chunk_result(self, chunk:list, result_list:list, progress_dict:dict) -> List[tuple]:
+        failed_list:list = [(meta_param, error) for meta_param, (error, _) in zip(chunk,result_list) if error is not None]
+        if self.incremental:
+            self.append_preprocess_manifest([(meta_param, source_record_list) for meta_param, (error, source_record_list) in zip(chunk,result_list) if error is None])
+        for meta_param, error in failed_list:
+            print(f"failed: {meta_param}\n{error}")
+        progress_dict["done"] += len(chunk)
+        current_time:float = time.time()
+        if current_time - progress_dict["print_time"] >= getattr(self.h_params.preprocess,"progress_interval_seconds",10) or progress_dict["done"] == progress_dict["total"]:
+            progress_dict["print_time"] = current_time
+            elapsed_time:float = current_time - progress_dict["start_time"]
+            eta:float = elapsed_time / progress_dict["done"] * (progress_dict["total"] - progress_dict["done"])
+            print("{}/{} ({:.1f}%) elapsed {:.0f} s, eta {:.0f} s".format(progress_dict["done"],progress_dict["total"],100 * progress_dict["done"] / max(progress_dict["total"],1),elapsed_time,eta))
+        return failed_list
+
+    def get_preprocess_config_hash(self) -> str:
+        '''
+        hash of the preprocessor class, data config and h_params.preprocess except options which don't change the results
+        '''
+        run_option_list:list = ["multi_processing","max_workers","chunksize","largest_first","retry_num","only_failed","progress_interval_seconds","make_manifest","manifest_feature_length","incremental","distributed_queue_dir","distributed_lease_seconds","distributed_run_id"]
+        preprocess_config:dict = {name: getattr(self.h_params.preprocess,name) for name in dir(self.h_params.preprocess) if not name.startswith("_") and name not in run_option_list and not callable(getattr(self.h_params.preprocess,name))}
+        return self.util_data.get_config_hash({"class_name": type(self).__name__, "data_config": self.data_config_dict, "preprocess": preprocess_config})
+
+    def get_preprocess_manifest_path(self) -> str:
+        return os.path.join(self.preprocessed_data_path,"preprocess_manifest.jsonl")
+
+    def get_source_record_list(self, meta_param, stat_record_dict:dict = None) -> List[list]:
+        '''
+        [[source path, size, mtime_ns, content hash], ...]. The hash in stat_record_dict is reused if size and mtime are unchanged.
+        '''
+        source_record_list:list = list()
+        for source_path in self.get_meta_param_source_path_list(meta_param):
+            stat = os.stat(source_path)
+            prev_record:list = (stat_record_dict or dict()).get(source_path,None)
+            if prev_record is not None and prev_record[1] == stat.st_size and prev_record[2] == stat.st_mtime_ns:
+                source_hash:str = prev_record[3]
+            else:
+                source_hash = self.util_data.get_file_hash(source_path)
+            source_record_list.append([source_path, stat.st_size, stat.st_mtime_ns, source_hash])
+        return source_record_list
+
+    def load_preprocess_manifest(self) -> dict:
+        '''
+        {repr(meta_param): latest record}. A broken last line of an interrupted run is ignored.
+        '''
+        record_dict:dict = dict()
+        if not os.path.isfile(self.get_preprocess_manifest_path()):
+            return record_dict
+        with open(self.get_preprocess_manifest_path(),'r') as file_reader:
+            for line in file_reader:
+                try:
+                    record:dict = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                record_dict[record["key"]] = record
+        return record_dict
+
+    def append_preprocess_manifest(self, succeeded_list:list) -> None:
+        if len(succeeded_list) == 0:
+            return
+        os.makedirs(self.preprocessed_data_path,exist_ok=True)
+        with open(self.get_preprocess_manifest_path(),'a') as file_writer:
+            for meta_param, source_record_list in succeeded_list:
+                file_writer.write(json.dumps({"key": repr(meta_param), "config_hash": self.preprocess_config_hash, "source_list": source_record_list, "time": time.time()}) + "\n")
+            file_writer.flush()
+            os.fsync(file_writer.fileno())
+
+    def get_changed_meta_param_list(self, meta_param_list:list) -> list:
+        '''
+        meta params which are new, failed, or whose source files or preprocess config changed.
+        Meta params without source files (get_meta_param_source_path_list) can't be checked and are always run.
+        '''
+        record_dict:dict = self.load_preprocess_manifest()
+        changed_meta_param_list:list = list()
+        unchanged_list:list = list()
+        for meta_param in meta_param_list:
+            record:dict = record_dict.get(repr(meta_param),None)
+            if record is None or record["config_hash"] != self.preprocess_config_hash or len(record["source_list"]) == 0:
+                changed_meta_param_list.append(meta_param)
+                continue
+            stat_record_dict:dict = {source_record[0]: source_record for source_record in record["source_list"]}
+            source_record_list:list = self.get_source_record_list(meta_param,stat_record_dict)
+            if [source_record[3] for source_record in source_record_list] != [source_record[3] for source_record in record["source_list"]]:
+                changed_meta_param_list.append(meta_param)
+            elif source_record_list != record["source_list"]:
+                #touched but same content
+                unchanged_list.append((meta_param, source_record_list))
+        self.append_preprocess_manifest(unchanged_list)
+        print(f"incremental preprocess: {len(changed_meta_param_list)} of {len(meta_param_list)} data to process")
+        return changed_meta_param_list
+
+    def get_failed_meta_param_list_path(self) -> str:
+        return os.path.join(self.preprocessed_data_path,"failed_meta_param_list.pkl")
+
+    def save_failed_list(self, failed_list:list) -> None:
+        failed_meta_param_list_path:str = self.get_failed_meta_param_list_path()
+        if len(failed_list) == 0:
+            if os.path.isfile(failed_meta_param_list_path):
+                os.remove(failed_meta_param_list_path)
+            return
+        self.util_data.pickle_save(failed_meta_param_list_path,[meta_param for meta_param, _ in failed_list])
+        for meta_param, error in failed_list:
+            self.write_message("failed",f"{meta_param}\n{error}")
+        print(f"{len(failed_list)} data failed. Run again with preprocess.only_failed to retry them: {failed_meta_param_list_path}")
+
+    def make_manifest(self) -> None:
+        '''
+        write {preprocessed_data_path}/{subset}_manifest.pkl for every subset dir, which PytorchDataLoader and MakeMetaData list data with.
+        Only new or changed data are loaded to measure feature lengths (see UtilManifest).
+        '''
+        util_manifest = UtilManifest()
+        with_feature_length:bool = getattr(self.h_params.preprocess,"manifest_feature_length",True)
+        max_workers:int = (self.h_params.preprocess.max_workers or os.cpu_count()) if self.h_params.preprocess.multi_processing else None
+        for subset in sorted(os.listdir(self.preprocessed_data_path)):
+            if os.path.isdir(os.path.join(self.preprocessed_data_path,subset)) and subset not in UtilManifest.NOT_SUBSET_DIR_LIST:
+                manifest:dict = util_manifest.make(self.preprocessed_data_path,subset,with_feature_length=with_feature_length,max_workers=max_workers)
+                print(f"manifest of {subset}: {len(manifest['entry_list'])} data")
+
     @abstractmethod
     def get_dataset_name(self) -> str:
         raise NotImplementedError
@@ -38,6 +38,11 @@ class ProcessMelSpectrogram(Process):
         processed_feature_dict:dict[str,Tensor] = dict()
         processed_feature_dict[input_name] = self.util.stft_torch(data_dict[input_name])["mag"]
         processed_feature_dict[output_name] = self.util.stft_torch(data_dict[output_name])["mag"]
+        return self.spec_to_spec_training_data(processed_feature_dict,additional_dict)
+
+    def spec_to_spec_training_data(self,processed_feature_dict,additional_dict=None) -> dict:
+        input_name:str = additional_dict["input_name"]
+        output_name:str = additional_dict["target_name"]
 
         if len(processed_feature_dict[input_name].shape) == 3:
             processed_feature_dict[input_name] = processed_feature_dict[input_name].unsqueeze(1)
@@ -0,0 +1,45 @@
+from typing import Dict, Optional
+from torch import Tensor
+
+import torch
+
+from HParams import HParams
+from DataProcess.Process.ProcessMelSpectrogram import ProcessMelSpectrogram
+from DataProcess.Util.UtilSpectralFeatureStore import UtilSpectralFeatureStore
+
+
+class ProcessMelSpectrogramPrecomputed(ProcessMelSpectrogram):
+    '''
+    ProcessMelSpectrogram which uses the features MakeMetaDataSpectralFeature stored
+    (DataSet load_spectral_feature: True) instead of computing stft / mel every step.
+        {name}_mel of input and target: used as they are if neither limiter_target_by_input nor vocal_presence is set.
+        {name}_mag of input and target: stft is skipped, the rest is the same as ProcessMelSpectrogram.
+    Otherwise it falls back to computing from audio.
+    '''
+    def __init__(self,h_params:HParams) -> None:
+        super(ProcessMelSpectrogramPrecomputed,self).__init__(h_params)
+        self.feature_store = UtilSpectralFeatureStore()
+
+    def get_stored_feature(self,data_dict,name:str,feature_type:str) -> Optional[Tensor]:
+        feature_name:str = self.feature_store.get_feature_name(name,feature_type)
+        if feature_name not in data_dict:
+            return None
+        return torch.as_tensor(data_dict[feature_name])
+
+    def audio_to_spec_training_data(self,data_dict,additional_dict=None) -> dict:
+        name_list:list = [additional_dict["input_name"],additional_dict["target_name"]]
+        mag_list:list = [self.get_stored_feature(data_dict,name,"mag") for name in name_list]
+        if any(mag is None for mag in mag_list):
+            return super().audio_to_spec_training_data(data_dict,additional_dict)
+        return self.spec_to_spec_training_data(dict(zip(name_list,mag_list)),additional_dict)
+
+    def preprocess_training_data(self,data_dict,additional_dict=None)->Dict[str,Tensor]:
+        name_list:list = [additional_dict["input_name"],additional_dict["target_name"]]
+        mel_list:list = [self.get_stored_feature(data_dict,name,"mel") for name in name_list]
+        if any(mel is None for mel in mel_list) or self.h_params.pytorch_data.limiter_target_by_input or self.get_vocal_presence:
+            return super().preprocess_training_data(data_dict,additional_dict)
+
+        processed_feature_dict:dict[str,Tensor] = dict()
+        for name, mel in zip(name_list,mel_list):
+            processed_feature_dict[name] = mel.unsqueeze(1) if len(mel.shape) == 3 else mel
+        return processed_feature_dict
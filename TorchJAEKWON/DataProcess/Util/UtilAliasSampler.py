@@ -0,0 +1,50 @@
+from numpy import ndarray
+
+import numpy as np
+
+class UtilAliasSampler:
+    '''
+    Weighted sampling with replacement by Walker's alias method (Vose). Each draw is O(1) and vectorized.
+    If group_index_array is given, weight_array is the probability mass of each group and
+    an element is drawn uniformly inside the drawn group, e.g. segments grouped by dataset.
+    '''
+    def __init__(self, weight_array:ndarray, group_index_array:ndarray = None) -> None:
+        weight_array = np.asarray(weight_array,dtype=np.float64)
+        if group_index_array is None:
+            group_index_array = np.arange(len(weight_array))
+        group_index_array = np.asarray(group_index_array,dtype=np.int64)
+
+        self.element_order_array:ndarray = np.argsort(group_index_array,kind="stable")
+        self.group_count_array:ndarray = np.bincount(group_index_array,minlength=len(weight_array))
+        self.group_begin_array:ndarray = np.concatenate([[0],np.cumsum(self.group_count_array)[:-1]]).astype(np.int64)
+
+        weight_array = np.where(self.group_count_array > 0,weight_array,0.0)
+        assert len(weight_array) > 0 and np.all(weight_array >= 0) and weight_array.sum() > 0, "weights should be non-negative and not all zero"
+        self.set_alias_table(weight_array)
+
+    def set_alias_table(self, weight_array:ndarray) -> None:
+        self.length:int = len(weight_array)
+        scaled_probability_array:ndarray = weight_array * (self.length / weight_array.sum())
+        self.probability_array:ndarray = np.ones(self.length,dtype=np.float64)
+        self.alias_array:ndarray = np.arange(self.length,dtype=np.int64)
+
+        small_list:list = list(np.flatnonzero(scaled_probability_array < 1.0))
+        large_list:list = list(np.flatnonzero(scaled_probability_array >= 1.0))
+        while small_list and large_list:
+            small:int = small_list.pop()
+            large:int = large_list.pop()
+            self.probability_array[small] = scaled_probability_array[small]
+            self.alias_array[small] = large
+            scaled_probability_array[large] = scaled_probability_array[large] + scaled_probability_array[small] - 1.0
+            if scaled_probability_array[large] < 1.0:
+                small_list.append(large)
+            else:
+                large_list.append(large)
+        #left over entries have probability 1 (up to float error)
+
+    def sample(self, random_state:np.random.RandomState, num:int) -> ndarray:
+        column_array:ndarray = random_state.randint(0,self.length,size=num)
+        accept_array:ndarray = random_state.random_sample(num) < self.probability_array[column_array]
+        group_array:ndarray = np.where(accept_array,column_array,self.alias_array[column_array])
+        offset_array:ndarray = (random_state.random_sample(num) * self.group_count_array[group_array]).astype(np.int64)
+        return self.element_order_array[self.group_begin_array[group_array] + offset_array]
@@ -1,8 +1,13 @@
+from typing import List
+
 import numpy as np
 import soundfile as sf
+from concurrent.futures import ThreadPoolExecutor
 import librosa
+import torch
 
 from HParams import HParams
+from TorchJAEKWON.DataProcess.Util.UtilAudioResample import UtilAudioResample
 
 class UtilAudio:
     def float32_to_int16(self, x: np.float32) -> np.int16:
@@ -13,24 +18,105 @@ class UtilAudio:
         return (x / 32767.0).astype(np.float32)
     
     def resample_audio(self,audio,origin_sr,target_sr,resample_type = "kaiser_fast"):
+        '''
+        resample_type "stream_{fast|default|best}": block-wise UtilAudioResample instead of librosa
+        resample_type "torch_{fast|default|best}": UtilAudioResample.resample_torch, audio [..., time] (ndarray or Tensor)
+        '''
         print(f"resample audio {origin_sr} to {target_sr}")
+        if resample_type.startswith("torch"):
+            if isinstance(audio, np.ndarray):
+                return UtilAudioResample.resample_torch(torch.from_numpy(audio),origin_sr,target_sr,self.get_stream_quality(resample_type)).numpy()
+            return UtilAudioResample.resample_torch(audio,origin_sr,target_sr,self.get_stream_quality(resample_type))
+        if resample_type.startswith("stream"):
+            return UtilAudioResample(origin_sr,target_sr,self.get_stream_quality(resample_type)).resample(audio)
         return librosa.core.resample(audio, orig_sr=origin_sr, target_sr=target_sr, res_type=resample_type)
+
+    def get_stream_quality(self, resample_type:str) -> str:
+        return resample_type.split("_",1)[1] if "_" in resample_type else "default"
+
+    def resample_audio_file(self,input_path:str,output_path:str,target_sr:int,quality:str = "default",block_length:int = 2**16):
+        '''
+        resample a file to a file with constant memory, for recordings too long to load at once.
+        '''
+        origin_sr:int = sf.info(input_path).samplerate
+        print(f"resample audio file {origin_sr} to {target_sr}")
+        UtilAudioResample(origin_sr,target_sr,quality).resample_file(input_path,output_path,block_length=block_length)
+
+    def read_audio_resample_stream(self,audio_path:str,sample_rate:int,quality:str = "default",block_length:int = 2**16):
+        '''
+        the file is decoded block by block, so only the resampled output is kept in memory.
+        '''
+        resampler = UtilAudioResample(sf.info(audio_path).samplerate,sample_rate,quality)
+        output_list:list = [resampler.process(audio_block) for audio_block in sf.blocks(audio_path,blocksize=block_length,dtype='float32')]
+        output_list.append(resampler.flush())
+        return np.concatenate(output_list,axis=0)
     
-    def read_audio_fix_channels_of_mono_stereo(self,audio_path,sample_rate=None, mono=False,read_type="librosa"):
+    def get_native_dtype(self, audio_path:str) -> str:
+        '''
+        dtype soundfile decodes to without conversion of sample values
+        '''
+        subtype:str = sf.info(audio_path).subtype
+        if subtype in ["PCM_S8","PCM_U8","PCM_16"]:
+            return 'int16'
+        if subtype in ["PCM_24","PCM_32"]:
+            return 'int32'
+        if subtype == "DOUBLE":
+            return 'float64'
+        return 'float32'
+
+    def fix_channels_of_mono_stereo(self, audio_data:np.ndarray, mono:bool = False) -> np.ndarray:
+        '''
+        audio_data: [time] or [time, channel]. mono to stereo is a read-only broadcast view, not a copy.
+        The downmix to mono keeps the dtype of audio_data (integer samples are rounded), so native dtype reads stay native.
+        '''
+        if mono and audio_data.ndim == 2:
+            if audio_data.shape[1] == 1:
+                return audio_data[:,0]
+            mono_data:np.ndarray = audio_data.mean(axis=1)
+            if np.issubdtype(audio_data.dtype,np.integer):
+                mono_data = np.round(mono_data)
+            return mono_data.astype(audio_data.dtype,copy=False)
+        if not mono and audio_data.ndim == 1:
+            return np.broadcast_to(audio_data[:,None],(len(audio_data),2))
+        if not mono and audio_data.shape[1] == 1:
+            return np.broadcast_to(audio_data,(len(audio_data),2))
+        return audio_data
+
+    def read_audio(self, audio_path:str, start:int = 0, stop:int = None, mono:bool = False, dtype:str = None) -> tuple:
+        '''
+        Decodes only frames [start, stop) with soundfile.
+        dtype: None for the native dtype of the file (e.g. int16 for PCM_16, see get_native_dtype), or a soundfile dtype.
+        return (audio_data [time] if mono else [time, 2], sample_rate)
+        '''
+        audio_data, sample_rate = sf.read(audio_path,start=start,stop=stop,dtype=dtype or self.get_native_dtype(audio_path),always_2d=True)
+        return self.fix_channels_of_mono_stereo(audio_data,mono), sample_rate
+
+    def read_audio_list(self, audio_path_list:List[str], start_list:List[int] = None, stop_list:List[int] = None, mono:bool = False, dtype:str = None, max_workers:int = 8) -> List[tuple]:
+        '''
+        read_audio for each file in a thread pool. libsndfile decodes without the GIL.
+        '''
+        start_list = start_list or [0] * len(audio_path_list)
+        stop_list = stop_list or [None] * len(audio_path_list)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda args: self.read_audio(*args,mono=mono,dtype=dtype),zip(audio_path_list,start_list,stop_list)))
+
+    def read_audio_fix_channels_of_mono_stereo(self,audio_path,sample_rate=None, mono=False,read_type="librosa",resample_type="kaiser_fast"):
+        '''
+        resample_type (read_type "soundfile"): see resample_audio. "stream_*" resamples while decoding (float32 output).
+        '''
         if read_type == "soundfile":
-            audio_data, original_samplerate = sf.read(audio_path)
-
-            if sample_rate is not None:
-                print(f"resample audio {original_samplerate} to {sample_rate}")
-                audio_data = self.resample_audio(audio_data,original_samplerate,sample_rate)
-
-            if mono and audio_data.shape[1] == 2:
-                audio_data = np.mean(audio_data,axis=1)
-            elif not mono and len(audio_data.shape) == 1:
-                stereo_audio = np.zeros((len(audio_data),2))
-                stereo_audio[...,0] = audio_data
-                stereo_audio[...,1] = audio_data
-                audio_data = stereo_audio
+            if sample_rate is not None and resample_type.startswith("stream"):
+                print(f"resample audio {sf.info(audio_path).samplerate} to {sample_rate}")
+                audio_data = self.read_audio_resample_stream(audio_path,sample_rate,self.get_stream_quality(resample_type))
+            else:
+                audio_data, original_samplerate = sf.read(audio_path)
+                if sample_rate is not None and resample_type.startswith("torch"):
+                    #soundfile layout is [time, channel], resample_torch resamples the last axis
+                    audio_data = self.resample_audio(audio_data.T,original_samplerate,sample_rate,resample_type).T
+                elif sample_rate is not None:
+                    audio_data = self.resample_audio(audio_data,original_samplerate,sample_rate,resample_type)
+            #writable array as before, read_audio returns the broadcast view
+            audio_data = np.array(self.fix_channels_of_mono_stereo(audio_data,mono))
         elif read_type == "librosa":
             print(f"read audio sr: {sample_rate}")
             audio_data, _ = librosa.core.load( audio_path, sr=sample_rate, mono=mono)
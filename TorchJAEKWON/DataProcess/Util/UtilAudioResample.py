@@ -0,0 +1,175 @@
+from typing import List
+from numpy import ndarray
+from torch import Tensor
+
+import math
+import numpy as np
+import soundfile as sf
+import torch
+import torch.nn.functional as F
+
+class UtilAudioResample:
+    '''
+    Windowed-sinc (kaiser) polyphase resampler which takes audio block by block.
+    The last input samples the filter still needs are kept between blocks, so
+    feeding a signal in any block sizes gives the same output as feeding it at once,
+    and memory depends on the block size only, not on the length of the audio.
+    audio shape: [time] or [time, channel] (soundfile layout)
+    resample_torch / resample_torch_list run the same kernels on batched tensors [..., time] with conv1d,
+    e.g. in Preprocessor or on the fly in DataLoader workers (see ResampleCollate).
+    '''
+    QUALITY_DICT:dict = {
+        "fast": {"lowpass_filter_width": 8, "rolloff": 0.85, "beta": 8.555},
+        "default": {"lowpass_filter_width": 16, "rolloff": 0.94, "beta": 12.0},
+        "best": {"lowpass_filter_width": 64, "rolloff": 0.9475937167399596, "beta": 14.769656459379492},
+    }
+    #{(orig_sr, target_sr, quality): (kernel, width, orig_step, target_step)}
+    kernel_cache_dict:dict = dict()
+    #{(orig_sr, target_sr, quality, device, dtype): Tensor [target_step, 1, taps]}
+    torch_kernel_cache_dict:dict = dict()
+
+    def __init__(self, origin_sr:int, target_sr:int, quality:str = "default") -> None:
+        self.origin_sr:int = int(origin_sr)
+        self.target_sr:int = int(target_sr)
+        self.quality:str = quality
+        self.kernel, self.width, self.orig_step, self.target_step = self.get_kernel(self.origin_sr,self.target_sr,quality)
+        self.kernel_float32:ndarray = self.kernel.astype(np.float32)
+        self.reset()
+
+    @classmethod
+    def get_kernel(cls, origin_sr:int, target_sr:int, quality:str = "default") -> tuple:
+        '''
+        kernel[phase, tap] gives output sample (frame * target_step + phase)
+        from input samples [frame * orig_step - width, (frame + 1) * orig_step + width)
+        '''
+        key:tuple = (int(origin_sr),int(target_sr),quality)
+        if key in cls.kernel_cache_dict:
+            return cls.kernel_cache_dict[key]
+        assert quality in cls.QUALITY_DICT, f"quality should be one of {list(cls.QUALITY_DICT)}"
+        quality_dict:dict = cls.QUALITY_DICT[quality]
+        lowpass_filter_width:int = quality_dict["lowpass_filter_width"]
+
+        gcd:int = math.gcd(int(origin_sr),int(target_sr))
+        orig_step:int = int(origin_sr) // gcd
+        target_step:int = int(target_sr) // gcd
+        base_freq:float = min(orig_step,target_step) * quality_dict["rolloff"]
+        width:int = math.ceil(lowpass_filter_width * orig_step / base_freq)
+
+        time:ndarray = np.arange(-width,width + orig_step,dtype=np.float64)[None,:] / orig_step - np.arange(target_step,dtype=np.float64)[:,None] / target_step
+        time = np.clip(time * base_freq,-lowpass_filter_width,lowpass_filter_width)
+        window:ndarray = np.i0(quality_dict["beta"] * np.sqrt(1 - (time / lowpass_filter_width) ** 2)) / np.i0(quality_dict["beta"])
+        kernel:ndarray = np.sinc(time) * window * (base_freq / orig_step)
+
+        cls.kernel_cache_dict[key] = (kernel, width, orig_step, target_step)
+        return cls.kernel_cache_dict[key]
+
+    @classmethod
+    def get_torch_kernel(cls, origin_sr:int, target_sr:int, quality:str, device:torch.device, dtype:torch.dtype) -> Tensor:
+        key:tuple = (int(origin_sr),int(target_sr),quality,str(device),dtype)
+        if key not in cls.torch_kernel_cache_dict:
+            kernel = cls.get_kernel(origin_sr,target_sr,quality)[0]
+            cls.torch_kernel_cache_dict[key] = torch.from_numpy(kernel).to(device=device,dtype=dtype).unsqueeze(1)
+        return cls.torch_kernel_cache_dict[key]
+
+    @classmethod
+    def resample_torch(cls, audio:Tensor, origin_sr:int, target_sr:int, quality:str = "default") -> Tensor:
+        '''
+        audio: Tensor [..., time]. All leading dims are one conv1d batch.
+        '''
+        if int(origin_sr) == int(target_sr):
+            return audio
+        _, width, orig_step, target_step = cls.get_kernel(origin_sr,target_sr,quality)
+        dtype:torch.dtype = audio.dtype if audio.is_floating_point() else torch.float32
+        kernel:Tensor = cls.get_torch_kernel(origin_sr,target_sr,quality,audio.device,dtype)
+
+        shape:tuple = audio.shape
+        input_length:int = shape[-1]
+        audio = audio.to(dtype).reshape(-1,1,input_length)
+        audio = F.pad(audio,(width,width + orig_step))
+        output:Tensor = F.conv1d(audio,kernel,stride=orig_step)
+        output = output.transpose(1,2).reshape(audio.shape[0],-1)
+        output_length:int = math.ceil(target_step * input_length / orig_step)
+        return output[...,:output_length].reshape(*shape[:-1],output_length)
+
+    @classmethod
+    def resample_torch_list(cls, audio_list:List[Tensor], origin_sr_list:List[int], target_sr:int, quality:str = "default") -> List[Tensor]:
+        '''
+        audio of mixed sample rates and lengths, [..., time] each with the same leading shape.
+        Audio of the same sample rate is zero padded to the longest one and resampled as one batch.
+        '''
+        output_list:list = [None] * len(audio_list)
+        for origin_sr in set(origin_sr_list):
+            index_list:list = [index for index, sr in enumerate(origin_sr_list) if sr == origin_sr]
+            length_list:list = [audio_list[index].shape[-1] for index in index_list]
+            batch:Tensor = torch.stack([F.pad(audio_list[index],(0,max(length_list) - length)) for index, length in zip(index_list,length_list)])
+            batch = cls.resample_torch(batch,origin_sr,target_sr,quality)
+            for batch_index, (index, length) in enumerate(zip(index_list,length_list)):
+                output_length:int = length if int(origin_sr) == int(target_sr) else math.ceil(int(target_sr) * length / int(origin_sr))
+                output_list[index] = batch[batch_index,...,:output_length]
+        return output_list
+
+    def get_output_length(self, input_length:int) -> int:
+        return math.ceil(self.target_step * input_length / self.orig_step)
+
+    def reset(self) -> None:
+        #[channel, time]. starts with the zero padding before the first sample
+        self.buffer:ndarray = None
+        self.input_length:int = 0
+        self.output_length:int = 0
+
+    def process(self, audio_block:ndarray) -> ndarray:
+        '''
+        returns the output samples which are fully determined by the input so far.
+        '''
+        is_mono:bool = audio_block.ndim == 1
+        audio_block = np.asarray(audio_block,dtype=np.float32).reshape(len(audio_block),-1).T
+        if self.buffer is None:
+            self.is_mono = is_mono
+            self.buffer = np.zeros((audio_block.shape[0],self.width),dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer,audio_block],axis=1)
+        self.input_length += audio_block.shape[1]
+        return self.convolve_buffer()
+
+    def flush(self) -> ndarray:
+        '''
+        pads the end with zeros, returns the rest of output and resets the state.
+        '''
+        if self.buffer is None:
+            return np.zeros(0,dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer,np.zeros((self.buffer.shape[0],self.width + self.orig_step),dtype=np.float32)],axis=1)
+        output:ndarray = self.convolve_buffer(max_output_length = self.get_output_length(self.input_length))
+        self.reset()
+        return output
+
+    def convolve_buffer(self, max_output_length:int = None) -> ndarray:
+        tap_num:int = self.kernel.shape[1]
+        frame_num:int = max((self.buffer.shape[1] - tap_num) // self.orig_step + 1,0)
+        if frame_num > 0:
+            frame_array:ndarray = np.lib.stride_tricks.sliding_window_view(self.buffer,tap_num,axis=1)[:,::self.orig_step][:,:frame_num]
+            output:ndarray = np.einsum("cft,pt->cfp",frame_array,self.kernel_float32,optimize=True).reshape(self.buffer.shape[0],-1)
+            #keep what the next frame needs
+            self.buffer = self.buffer[:,frame_num * self.orig_step:].copy()
+        else:
+            output = np.zeros((self.buffer.shape[0],0),dtype=np.float32)
+
+        if max_output_length is not None:
+            output = output[:,:max(max_output_length - self.output_length,0)]
+        self.output_length += output.shape[1]
+        return output[0] if self.is_mono else output.T
+
+    def resample(self, audio:ndarray, block_length:int = 2**16) -> ndarray:
+        output_list:list = [self.process(audio[start:start + block_length]) for start in range(0,len(audio),block_length)]
+        output_list.append(self.flush())
+        return np.concatenate(output_list,axis=0)
+
+    def resample_file(self, input_path:str, output_path:str, block_length:int = 2**16, subtype:str = None) -> None:
+        '''
+        reads, resamples and writes block by block. Only one block is in memory at a time.
+        '''
+        info = sf.info(input_path)
+        assert info.samplerate == self.origin_sr, f"{input_path} sample rate {info.samplerate} is not {self.origin_sr}"
+        self.reset()
+        with sf.SoundFile(output_path,'w',samplerate=self.target_sr,channels=info.channels,subtype=subtype or info.subtype) as output_file:
+            for audio_block in sf.blocks(input_path,blocksize=block_length,dtype='float32'):
+                output_file.write(self.process(audio_block))
+            output_file.write(self.flush())
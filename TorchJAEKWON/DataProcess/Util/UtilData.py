@@ -3,13 +3,18 @@ from numpy import ndarray
 from torch import Tensor
 
 import os
+import json
+import hashlib
 import torch
 import pickle
+import numpy as np
 import yaml
 import csv
 from pathlib import Path
 
 class UtilData:
+    STORAGE_DTYPE_FILE_NAME:str = "storage_dtype.yaml"
+    STORAGE_DTYPE_LIST:list = ["int16","float16"]
 
     def get_file_name_from_path(self,path:str,with_ext:bool = False)->str:
         if path is None:
@@ -34,6 +39,88 @@ class UtilData:
             data:Union[ndarray,Tensor] = pickle.load(pickle_file)
         return data
     
+    def npy_dict_save(self,save_dir_path:str, data_dict:dict) -> None:
+        '''
+        save each ndarray of data_dict to {save_dir_path}/{key}.npy so it can be memory-mapped.
+        values which are not ndarray are pickled together to {save_dir_path}/non_array_data.pkl
+        '''
+        os.makedirs(save_dir_path,exist_ok=True)
+        non_array_data_dict:dict = dict()
+        for key in data_dict:
+            if isinstance(data_dict[key],ndarray):
+                np.save(os.path.join(save_dir_path,f"{key}.npy"),data_dict[key])
+            else:
+                non_array_data_dict[key] = data_dict[key]
+        if len(non_array_data_dict) > 0:
+            self.pickle_save(os.path.join(save_dir_path,"non_array_data.pkl"),non_array_data_dict)
+    
+    def npy_dict_load(self,data_dir_path:str, mmap_mode:str = 'r') -> dict:
+        data_dict:dict = dict()
+        for file_name in os.listdir(data_dir_path):
+            name, ext = os.path.splitext(file_name)
+            if ext == ".npy":
+                data_dict[name] = np.load(os.path.join(data_dir_path,file_name),mmap_mode=mmap_mode)
+        non_array_data_path:str = os.path.join(data_dir_path,"non_array_data.pkl")
+        if os.path.isfile(non_array_data_path):
+            data_dict.update(self.pickle_load(non_array_data_path))
+        return data_dict
+    
+    def encode_feature(self, feature:ndarray, storage_dtype:str = None) -> ndarray:
+        '''
+        storage_dtype: 'int16' (PCM, same scale as UtilAudio.float32_to_int16), 'float16' or None (as it is)
+        '''
+        if storage_dtype is None or not isinstance(feature,ndarray) or not np.issubdtype(feature.dtype,np.floating):
+            return feature
+        assert storage_dtype in self.STORAGE_DTYPE_LIST, f"storage dtype should be one of {self.STORAGE_DTYPE_LIST}"
+        if storage_dtype == "int16":
+            return (np.clip(feature,-1,1) * 32767.0).astype(np.int16)
+        return feature.astype(np.float16)
+
+    def decode_feature(self, feature:ndarray, storage_dtype:str = None) -> ndarray:
+        '''
+        upcast a feature encoded by encode_feature to float32. features not stored in storage_dtype are returned as they are.
+        '''
+        if storage_dtype is None or not isinstance(feature,ndarray) or feature.dtype != np.dtype(storage_dtype):
+            return feature
+        if storage_dtype == "int16":
+            return feature.astype(np.float32) * np.float32(1.0 / 32767.0)
+        return feature.astype(np.float32)
+
+    def decode_feature_dict(self, feature_dict:dict, storage_dtype_dict:dict) -> dict:
+        if len(storage_dtype_dict) == 0:
+            return feature_dict
+        return {feature_name: self.decode_feature(feature_dict[feature_name],storage_dtype_dict.get(feature_name,None)) for feature_name in feature_dict}
+
+    def save_storage_dtype_dict(self, data_root_path:str, storage_dtype_dict:dict) -> None:
+        '''
+        {data_root_path}/storage_dtype.yaml: {feature_name: storage_dtype}, read by the datasets to decode features
+        '''
+        os.makedirs(data_root_path,exist_ok=True)
+        self.yaml_save(os.path.join(data_root_path,self.STORAGE_DTYPE_FILE_NAME),dict(storage_dtype_dict))
+
+    def load_storage_dtype_dict(self, data_root_path:str) -> dict:
+        storage_dtype_path:str = os.path.join(data_root_path,self.STORAGE_DTYPE_FILE_NAME)
+        if not os.path.isfile(storage_dtype_path):
+            return dict()
+        return self.yaml_load(storage_dtype_path) or dict()
+
+    def get_file_hash(self, file_path:str, chunk_size:int = 2**20) -> str:
+        '''
+        blake2b of the file content
+        '''
+        file_hash = hashlib.blake2b(digest_size=16)
+        with open(file_path,'rb') as file_reader:
+            for chunk in iter(lambda: file_reader.read(chunk_size), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def get_config_hash(self, config) -> str:
+        '''
+        hash of a config (dict, list, values) independent of the order of dict keys. Values which aren't json types are hashed by str().
+        '''
+        config_str:str = json.dumps(config,sort_keys=True,default=str)
+        return hashlib.blake2b(config_str.encode(),digest_size=16).hexdigest()
+
     def yaml_save(self,save_path:str, data:Union[dict,list]) -> None:
         assert(os.path.splitext(save_path)[1] == ".yaml") , "file extension should be '.yaml'"
 
@@ -0,0 +1,172 @@
+from typing import List, Optional
+
+import os
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+class UtilManifest:
+    '''
+    Persisted listing of a preprocessed subset dir, so training start up doesn't list every dataset dir.
+    {root_path}/{data_name}/{subset}_manifest.pkl : {
+        'version': int,
+        'subset_mtime_ns': mtime of {root_path}/{data_name}/{subset} when listed,
+        'entry_list': [
+            {'name': file or dir name in the subset dir, 'is_dir': bool, 'size': bytes (sum of files for dir),
+             'mtime_ns': mtime (latest of the dir and its files for dir),
+             'file_name_list': files of the dir ([] for file),
+             'feature_length_dict': {feature_name: feature.shape[-1]} or None if not measured}
+            , ...
+        ] (sorted by name)
+    }
+    The manifest is valid while the mtime of the subset dir is unchanged, which means no entry is added, removed or renamed.
+    Files rewritten in place inside {subset}/{name}/ are not detected. Remove the manifest (or run preprocess) after that.
+    When the subset dir is listed again, feature_length_dict of entries whose size, mtime and files are unchanged
+    is taken from the previous manifest, so only new or changed data are loaded to measure.
+    '''
+    VERSION:int = 2
+    #dirs DataSet lazy mode and MakeMetaDataSpectralFeature (UtilSpectralFeatureStore.STORE_DIR_NAME) write next to the subset dirs
+    NOT_SUBSET_DIR_LIST:list = ["memmap","spectral_feature"]
+
+    def get_manifest_path(self, data_root_path:str, subset:str) -> str:
+        return os.path.join(data_root_path,f"{subset}_manifest.pkl")
+
+    def is_ignored(self, name:str) -> bool:
+        return name.startswith(".")
+
+    def load(self, data_root_path:str, subset:str, allow_stale:bool = False) -> Optional[dict]:
+        '''
+        return None if the manifest doesn't exist, is of another version or is stale (unless allow_stale)
+        '''
+        manifest_path:str = self.get_manifest_path(data_root_path,subset)
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path,'rb') as pickle_file:
+            manifest:dict = pickle.load(pickle_file)
+        if manifest.get("version",None) != self.VERSION:
+            return None
+        subset_path:str = os.path.join(data_root_path,subset)
+        if not allow_stale and (not os.path.isdir(subset_path) or os.stat(subset_path).st_mtime_ns != manifest["subset_mtime_ns"]):
+            return None
+        return manifest
+
+    def is_unchanged(self, entry:dict, prev_entry:dict) -> bool:
+        return all(entry[key] == prev_entry[key] for key in ["is_dir","size","mtime_ns","file_name_list"])
+
+    def make(self, data_root_path:str, subset:str, with_feature_length:bool = False, max_workers:int = None) -> dict:
+        '''
+        with_feature_length: load every feature to measure its length. max_workers > 1 loads them in processes.
+        '''
+        subset_path:str = os.path.join(data_root_path,subset)
+        #stat before listing, so entries added while listing make the manifest stale
+        subset_mtime_ns:int = os.stat(subset_path).st_mtime_ns
+        entry_list:list = list()
+        with os.scandir(subset_path) as dir_entry_iterator:
+            for dir_entry in dir_entry_iterator:
+                if self.is_ignored(dir_entry.name):
+                    continue
+                entry:dict = {"name": dir_entry.name, "is_dir": dir_entry.is_dir(), "size": 0, "mtime_ns": dir_entry.stat().st_mtime_ns, "file_name_list": [], "feature_length_dict": None}
+                if entry["is_dir"]:
+                    with os.scandir(dir_entry.path) as file_entry_iterator:
+                        for file_entry in file_entry_iterator:
+                            if file_entry.is_file():
+                                entry["file_name_list"].append(file_entry.name)
+                                entry["size"] += file_entry.stat().st_size
+                                entry["mtime_ns"] = max(entry["mtime_ns"],file_entry.stat().st_mtime_ns)
+                    entry["file_name_list"].sort()
+                else:
+                    entry["size"] = dir_entry.stat().st_size
+                entry_list.append(entry)
+        entry_list.sort(key=lambda entry: entry["name"])
+
+        prev_manifest:dict = self.load(data_root_path,subset,allow_stale=True)
+        prev_entry_dict:dict = {entry["name"]: entry for entry in prev_manifest["entry_list"]} if prev_manifest is not None else dict()
+        for entry in entry_list:
+            prev_entry:dict = prev_entry_dict.get(entry["name"],None)
+            if prev_entry is not None and self.is_unchanged(entry,prev_entry):
+                entry["feature_length_dict"] = prev_entry["feature_length_dict"]
+
+        if with_feature_length:
+            measure_entry_list:list = [entry for entry in entry_list if entry["feature_length_dict"] is None]
+            print(f"measure feature length of {len(measure_entry_list)} / {len(entry_list)} data in {subset_path}")
+            entry_path_list:list = [os.path.join(subset_path,entry["name"]) for entry in measure_entry_list]
+            if max_workers is not None and max_workers > 1:
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    feature_length_dict_list:list = list(pool.map(self.get_feature_length_dict,entry_path_list,chunksize=64))
+            else:
+                feature_length_dict_list = [self.get_feature_length_dict(entry_path) for entry_path in entry_path_list]
+            for entry, feature_length_dict in zip(measure_entry_list,feature_length_dict_list):
+                entry["feature_length_dict"] = feature_length_dict
+
+        manifest:dict = {"version": self.VERSION, "subset_mtime_ns": subset_mtime_ns, "entry_list": entry_list}
+        self.save(data_root_path,subset,manifest)
+        return manifest
+
+    def save(self, data_root_path:str, subset:str, manifest:dict) -> None:
+        manifest_path:str = self.get_manifest_path(data_root_path,subset)
+        temp_path:str = f"{manifest_path}.tmp{os.getpid()}"
+        with open(temp_path,'wb') as file_writer:
+            pickle.dump(manifest,file_writer)
+        os.replace(temp_path,manifest_path)
+
+    def get(self, data_root_path:str, subset:str) -> dict:
+        '''
+        load the manifest, or list the subset dir again (without feature length) if it is missing or stale
+        '''
+        manifest:dict = self.load(data_root_path,subset)
+        if manifest is None:
+            print(f"make manifest of {os.path.join(data_root_path,subset)}")
+            manifest = self.make(data_root_path,subset)
+        return manifest
+
+    def get_name_list(self, data_root_path:str, subset:str) -> List[str]:
+        '''
+        sorted names in the subset dir, replaces os.listdir
+        '''
+        if not os.path.isdir(os.path.join(data_root_path,subset)):
+            return list()
+        return [entry["name"] for entry in self.get(data_root_path,subset)["entry_list"]]
+
+    def get_path_list(self, data_root_path:str, subset:str) -> List[str]:
+        return [f"{data_root_path}/{subset}/{name}" for name in self.get_name_list(data_root_path,subset)]
+
+    def get_entry_dict(self, data_root_path:str, subset:str) -> dict:
+        '''
+        {name: entry}
+        '''
+        if not os.path.isdir(os.path.join(data_root_path,subset)):
+            return dict()
+        return {entry["name"]: entry for entry in self.get(data_root_path,subset)["entry_list"]}
+
+    def get_feature_length_dict(self, entry_path:str) -> dict:
+        feature_length_dict:dict = dict()
+        if os.path.isdir(entry_path):
+            for file_name in sorted(os.listdir(entry_path)):
+                feature_name, ext = os.path.splitext(file_name)
+                if ext in [".pkl",".npy"] and feature_name not in feature_length_dict:
+                    feature_length:int = self.get_feature_length(os.path.join(entry_path,file_name))
+                    if feature_length is not None:
+                        feature_length_dict[feature_name] = feature_length
+            return feature_length_dict
+
+        ext:str = os.path.splitext(entry_path)[1]
+        if ext == ".npy":
+            feature_length_dict[os.path.splitext(os.path.basename(entry_path))[0]] = self.get_feature_length(entry_path)
+        elif ext == ".pkl":
+            with open(entry_path,'rb') as pickle_file:
+                data = pickle.load(pickle_file)
+            if isinstance(data,dict):
+                for key in data:
+                    if hasattr(data[key],"shape") and len(data[key].shape) > 0:
+                        feature_length_dict[key] = int(data[key].shape[-1])
+            elif hasattr(data,"shape") and len(data.shape) > 0:
+                feature_length_dict[os.path.splitext(os.path.basename(entry_path))[0]] = int(data.shape[-1])
+        return feature_length_dict
+
+    def get_feature_length(self, file_path:str) -> Optional[int]:
+        if os.path.splitext(file_path)[1] == ".npy":
+            shape:tuple = np.load(file_path,mmap_mode='r').shape
+        else:
+            with open(file_path,'rb') as pickle_file:
+                shape = getattr(pickle.load(pickle_file),"shape",())
+        return int(shape[-1]) if len(shape) > 0 else None
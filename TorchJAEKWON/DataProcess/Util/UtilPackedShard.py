@@ -0,0 +1,209 @@
+from typing import List, Union
+from numpy import ndarray
+
+import os
+import pickle
+import numpy as np
+
+class UtilPackedShard:
+    '''
+    Pack many features into a few large shard files.
+    {shard_dir_path}/
+        shard_00000.bin, shard_00001.bin, ... : raw bytes of features, C-contiguous
+        index.npy : structured array, one row per (example, feature)
+        index_table.pkl : {"shard_file_name_list", "name_list", "feature_name_list", "dtype_list", "example_row_begin"}
+    Any (example, feature) pair is read with one pread.
+    '''
+    MAX_NDIM:int = 4
+    ALIGN_BYTES:int = 64
+    PICKLE_DTYPE:str = "pickle"
+    INDEX_DTYPE = np.dtype([
+        ("name_index", np.int64),
+        ("feature_index", np.int32),
+        ("dtype_index", np.int32),
+        ("shard_index", np.int32),
+        ("ndim", np.int32),
+        ("shape", np.int64, (MAX_NDIM,)),
+        ("offset", np.int64),
+        ("nbytes", np.int64),
+    ])
+
+    def __init__(self, shard_dir_path:str) -> None:
+        self.shard_dir_path:str = shard_dir_path
+        self.index:ndarray = None
+        self.index_table:dict = None
+        self.fd_dict:dict = dict()
+        self.fd_pid:int = None
+
+    '''
+    ==============================================================
+    write
+    ==============================================================
+    '''
+
+    def open_writer(self, shard_size_bytes:int = 2**30) -> None:
+        os.makedirs(self.shard_dir_path,exist_ok=True)
+        self.shard_size_bytes:int = shard_size_bytes
+        self.index_row_list:list = list()
+        self.index_table = {"shard_file_name_list":[], "name_list":[], "feature_name_list":[], "dtype_list":[], "example_row_begin":[]}
+        self.feature_index_dict:dict = dict()
+        self.dtype_index_dict:dict = dict()
+        self.shard_writer = None
+        self.shard_offset:int = 0
+        self.open_new_shard()
+
+    def open_new_shard(self) -> None:
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+        shard_file_name:str = f"shard_{str(len(self.index_table['shard_file_name_list'])).zfill(5)}.bin"
+        self.index_table["shard_file_name_list"].append(shard_file_name)
+        self.shard_writer = open(os.path.join(self.shard_dir_path,shard_file_name),'wb')
+        self.shard_offset = 0
+
+    def get_table_index(self, table_index_dict:dict, table_name:str, value:str) -> int:
+        if value not in table_index_dict:
+            table_index_dict[value] = len(self.index_table[table_name])
+            self.index_table[table_name].append(value)
+        return table_index_dict[value]
+
+    def write_example(self, name:str, feature_dict:dict) -> None:
+        name_index:int = len(self.index_table["name_list"])
+        self.index_table["name_list"].append(name)
+        self.index_table["example_row_begin"].append(len(self.index_row_list))
+
+        for feature_name in feature_dict:
+            feature = feature_dict[feature_name]
+            if isinstance(feature,ndarray) and feature.ndim <= self.MAX_NDIM and feature.dtype != object:
+                feature = np.ascontiguousarray(feature)
+                dtype_name:str = feature.dtype.str
+                shape:tuple = feature.shape
+                feature_bytes = memoryview(feature).cast('B') if feature.nbytes > 0 else b''
+            else:
+                dtype_name:str = self.PICKLE_DTYPE
+                feature_bytes = pickle.dumps(feature)
+                shape:tuple = (len(feature_bytes),)
+
+            nbytes:int = len(feature_bytes)
+            if self.shard_offset > 0 and self.shard_offset + nbytes > self.shard_size_bytes:
+                self.open_new_shard()
+
+            padding:int = (-self.shard_offset) % self.ALIGN_BYTES
+            self.shard_writer.write(b'\0' * padding)
+            self.shard_offset += padding
+
+            row = np.zeros((),dtype=self.INDEX_DTYPE)
+            row["name_index"] = name_index
+            row["feature_index"] = self.get_table_index(self.feature_index_dict,"feature_name_list",feature_name)
+            row["dtype_index"] = self.get_table_index(self.dtype_index_dict,"dtype_list",dtype_name)
+            row["shard_index"] = len(self.index_table["shard_file_name_list"]) - 1
+            row["ndim"] = len(shape)
+            row["shape"][:len(shape)] = shape
+            row["offset"] = self.shard_offset
+            row["nbytes"] = nbytes
+            self.index_row_list.append(row)
+
+            self.shard_writer.write(feature_bytes)
+            self.shard_offset += nbytes
+
+    def close_writer(self) -> None:
+        self.shard_writer.close()
+        self.shard_writer = None
+        self.index_table["example_row_begin"].append(len(self.index_row_list))
+        self.index_table["example_row_begin"] = np.array(self.index_table["example_row_begin"],dtype=np.int64)
+        np.save(os.path.join(self.shard_dir_path,"index.npy"),np.array(self.index_row_list,dtype=self.INDEX_DTYPE))
+        with open(os.path.join(self.shard_dir_path,"index_table.pkl"),'wb') as file_writer:
+            pickle.dump(self.index_table,file_writer)
+
+    '''
+    ==============================================================
+    read
+    ==============================================================
+    '''
+
+    def load_index(self) -> None:
+        if self.index is not None:
+            return
+        self.index = np.load(os.path.join(self.shard_dir_path,"index.npy"),mmap_mode='r')
+        with open(os.path.join(self.shard_dir_path,"index_table.pkl"),'rb') as pickle_file:
+            self.index_table = pickle.load(pickle_file)
+        self.feature_index_dict = {feature_name: i for i,feature_name in enumerate(self.index_table["feature_name_list"])}
+
+    def get_example_num(self) -> int:
+        self.load_index()
+        return len(self.index_table["name_list"])
+
+    def get_name(self, example_index:int) -> str:
+        self.load_index()
+        return self.index_table["name_list"][example_index]
+
+    def get_row(self, example_index:int, feature_name:str):
+        self.load_index()
+        feature_index:int = self.feature_index_dict[feature_name]
+        row_begin:int = self.index_table["example_row_begin"][example_index]
+        row_end:int = self.index_table["example_row_begin"][example_index + 1]
+        for row_index in range(row_begin,row_end):
+            if self.index[row_index]["feature_index"] == feature_index:
+                return self.index[row_index]
+        raise KeyError(f"{feature_name} is not in {self.get_name(example_index)}")
+
+    def get_feature_name_list(self, example_index:int) -> List[str]:
+        self.load_index()
+        row_begin:int = self.index_table["example_row_begin"][example_index]
+        row_end:int = self.index_table["example_row_begin"][example_index + 1]
+        return [self.index_table["feature_name_list"][feature_index] for feature_index in self.index["feature_index"][row_begin:row_end]]
+
+    def get_fd(self, shard_index:int) -> int:
+        if self.fd_pid != os.getpid():
+            #file descriptors are opened once per process (DataLoader worker)
+            self.fd_dict = dict()
+            self.fd_pid = os.getpid()
+        if shard_index not in self.fd_dict:
+            self.fd_dict[shard_index] = os.open(os.path.join(self.shard_dir_path,self.index_table["shard_file_name_list"][shard_index]),os.O_RDONLY)
+        return self.fd_dict[shard_index]
+
+    def pread_into(self, fd:int, buffer:ndarray, offset:int) -> None:
+        buffer_view = memoryview(buffer).cast('B')
+        read_bytes:int = 0
+        while read_bytes < len(buffer_view):
+            read_num:int = os.preadv(fd,[buffer_view[read_bytes:]],offset + read_bytes)
+            assert read_num > 0, f"unexpected end of shard file (offset {offset})"
+            read_bytes += read_num
+
+    def get_example_index_dict(self) -> dict:
+        self.load_index()
+        return {name: i for i,name in enumerate(self.index_table["name_list"])}
+
+    def read_feature(self, example_index:int, feature_name:str, begin_sample:int = None, end_sample:int = None) -> Union[ndarray,object]:
+        '''
+        if begin_sample/end_sample is given, only [..., begin_sample:end_sample] of the feature is read from disk
+        (one pread per row of the last axis)
+        '''
+        row = self.get_row(example_index,feature_name)
+        fd:int = self.get_fd(int(row["shard_index"]))
+        dtype_name:str = self.index_table["dtype_list"][row["dtype_index"]]
+        if dtype_name == self.PICKLE_DTYPE:
+            return pickle.loads(os.pread(fd,int(row["nbytes"]),int(row["offset"])))
+
+        shape:tuple = tuple(int(size) for size in row["shape"][:row["ndim"]])
+        dtype = np.dtype(dtype_name)
+        if begin_sample is None and end_sample is None:
+            feature:ndarray = np.empty(shape,dtype=dtype)
+            if feature.nbytes > 0:
+                self.pread_into(fd,feature,int(row["offset"]))
+            return feature
+
+        length:int = shape[-1]
+        begin_sample, end_sample, _ = slice(begin_sample,end_sample).indices(length)
+        end_sample = max(begin_sample,end_sample)
+        feature:ndarray = np.empty(shape[:-1] + (end_sample - begin_sample,),dtype=dtype)
+        if feature.size == 0:
+            return feature
+        feature_rows:ndarray = feature.reshape(-1,end_sample - begin_sample)
+        for row_index in range(len(feature_rows)):
+            self.pread_into(fd,feature_rows[row_index],int(row["offset"]) + (row_index * length + begin_sample) * dtype.itemsize)
+        return feature
+
+    def read_example(self, example_index:int, feature_name_list:list = None) -> dict:
+        if feature_name_list is None:
+            feature_name_list = self.get_feature_name_list(example_index)
+        return {feature_name: self.read_feature(example_index,feature_name) for feature_name in feature_name_list}
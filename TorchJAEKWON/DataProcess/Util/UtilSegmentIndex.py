@@ -0,0 +1,116 @@
+from numpy import ndarray
+
+import os
+import pickle
+import numpy as np
+
+class UtilSegmentIndex:
+    '''
+    Columnar segment index written by MakeMetaDataSegmentIndexByFeatureType and read by SegmentSampler.
+    {index_dir_path}/
+        path_table.npy : (path_num,) str, interned data path
+        name_table.npy : (path_num,) str, name of the data of each path
+        path_data_name_index.npy : (path_num,) int32, index of data_name_table of each path
+        data_name_table.npy : (data_name_num,) str
+        {feature_type}_path_index.npy : (segment_num,) int32
+        {feature_type}_begin_sample.npy : (segment_num,) int64
+        {feature_type}_end_sample.npy : (segment_num,) int64
+    Every file is loaded with mmap, so loading cost and per worker memory don't grow with the number of segments.
+    '''
+    TABLE_NAME_LIST:list = ["path_table","name_table","path_data_name_index","data_name_table"]
+    COLUMN_NAME_LIST:list = ["path_index","begin_sample","end_sample"]
+
+    def save(self, index_dir_path:str, index_dict:dict) -> None:
+        '''
+        index_dict: {
+            "path_table", "name_table", "path_data_name_index", "data_name_table",
+            "feature_dict": {feature_type: {"path_index", "begin_sample", "end_sample"}}
+        }
+        '''
+        os.makedirs(index_dir_path,exist_ok=True)
+        np.save(os.path.join(index_dir_path,"path_table.npy"),np.array(index_dict["path_table"],dtype=str))
+        np.save(os.path.join(index_dir_path,"name_table.npy"),np.array(index_dict["name_table"],dtype=str))
+        np.save(os.path.join(index_dir_path,"path_data_name_index.npy"),np.array(index_dict["path_data_name_index"],dtype=np.int32))
+        np.save(os.path.join(index_dir_path,"data_name_table.npy"),np.array(index_dict["data_name_table"],dtype=str))
+        for feature_type in index_dict["feature_dict"]:
+            column_dict:dict = index_dict["feature_dict"][feature_type]
+            np.save(os.path.join(index_dir_path,f"{feature_type}_path_index.npy"),np.asarray(column_dict["path_index"],dtype=np.int32))
+            np.save(os.path.join(index_dir_path,f"{feature_type}_begin_sample.npy"),np.asarray(column_dict["begin_sample"],dtype=np.int64))
+            np.save(os.path.join(index_dir_path,f"{feature_type}_end_sample.npy"),np.asarray(column_dict["end_sample"],dtype=np.int64))
+
+    def get_columnar_index_path(self, index_dir_path:str, subset:str = None) -> str:
+        if subset is not None and os.path.isdir(os.path.join(index_dir_path,subset)):
+            return os.path.join(index_dir_path,subset)
+        return index_dir_path
+
+    def load(self, index_path:str, feature_type_list:list, subset:str = None) -> dict:
+        '''
+        index_path: columnar index dir ({index_path}/{subset} is used if exists) or legacy pickled list-of-dicts index.
+        For {stem}.pkl, the columnar index MakeMetaDataSegmentIndexByFeatureType writes next to it ({stem}/{subset})
+        is read instead unless the pickle is newer, so configs pointing at the old pickle don't train on a stale index.
+        '''
+        if not os.path.isdir(index_path):
+            columnar_index_path:str = self.get_columnar_index_path(os.path.splitext(index_path)[0],subset)
+            columnar_table_path:str = os.path.join(columnar_index_path,"path_table.npy")
+            if os.path.isfile(columnar_table_path) and (not os.path.isfile(index_path) or os.path.getmtime(columnar_table_path) >= os.path.getmtime(index_path)):
+                print(f"read the columnar segment index {columnar_index_path} instead of {index_path}")
+                index_path = columnar_index_path
+            else:
+                with open(index_path,'rb') as pickle_file:
+                    return self.from_list_of_dict(pickle.load(pickle_file))
+
+        index_path = self.get_columnar_index_path(index_path,subset)
+        index_dict:dict = {table_name: np.load(os.path.join(index_path,f"{table_name}.npy"),mmap_mode='r') for table_name in self.TABLE_NAME_LIST}
+        index_dict["feature_dict"] = dict()
+        for feature_type in feature_type_list:
+            index_dict["feature_dict"][feature_type] = {column_name: np.load(os.path.join(index_path,f"{feature_type}_{column_name}.npy"),mmap_mode='r') for column_name in self.COLUMN_NAME_LIST}
+        return index_dict
+
+    def from_list_of_dict(self, segment_index_dict:dict) -> dict:
+        '''
+        convert legacy {feature_type: [{'name', 'data_path', 'feature_type', 'begin_sample', 'end_sample'}, ...]}
+        '''
+        path_index_dict:dict = dict()
+        data_name_index_dict:dict = dict()
+        index_dict:dict = {table_name: [] for table_name in self.TABLE_NAME_LIST}
+        index_dict["feature_dict"] = dict()
+        for feature_type in segment_index_dict:
+            path_index_list:list = list()
+            for segment_meta in segment_index_dict[feature_type]:
+                data_path:str = segment_meta["data_path"]
+                if data_path not in path_index_dict:
+                    path_index_dict[data_path] = len(index_dict["path_table"])
+                    index_dict["path_table"].append(data_path)
+                    index_dict["name_table"].append(segment_meta.get("name",""))
+                    #data_path: {root_path}/{data_name}/{subset}/{name}/{feature_type}.pkl
+                    path_split:list = data_path.replace(os.sep,"/").split("/")
+                    data_name:str = path_split[-4] if len(path_split) >= 4 else ""
+                    if data_name not in data_name_index_dict:
+                        data_name_index_dict[data_name] = len(index_dict["data_name_table"])
+                        index_dict["data_name_table"].append(data_name)
+                    index_dict["path_data_name_index"].append(data_name_index_dict[data_name])
+                path_index_list.append(path_index_dict[data_path])
+            index_dict["feature_dict"][feature_type] = {
+                "path_index": np.array(path_index_list,dtype=np.int32),
+                "begin_sample": np.array([segment_meta["begin_sample"] for segment_meta in segment_index_dict[feature_type]],dtype=np.int64),
+                "end_sample": np.array([segment_meta["end_sample"] for segment_meta in segment_index_dict[feature_type]],dtype=np.int64)
+            }
+        index_dict["path_table"] = np.array(index_dict["path_table"],dtype=str)
+        index_dict["name_table"] = np.array(index_dict["name_table"],dtype=str)
+        index_dict["path_data_name_index"] = np.array(index_dict["path_data_name_index"],dtype=np.int32)
+        index_dict["data_name_table"] = np.array(index_dict["data_name_table"],dtype=str)
+        return index_dict
+
+    def get_segment_num(self, index_dict:dict, feature_type:str) -> int:
+        return len(index_dict["feature_dict"][feature_type]["begin_sample"])
+
+    def get_segment_meta(self, index_dict:dict, feature_type:str, segment_index:int) -> dict:
+        column_dict:dict = index_dict["feature_dict"][feature_type]
+        path_index:int = column_dict["path_index"][segment_index]
+        return {
+            "name": str(index_dict["name_table"][path_index]),
+            "data_path": str(index_dict["path_table"][path_index]),
+            "feature_type": feature_type,
+            "begin_sample": int(column_dict["begin_sample"][segment_index]),
+            "end_sample": int(column_dict["end_sample"][segment_index])
+        }
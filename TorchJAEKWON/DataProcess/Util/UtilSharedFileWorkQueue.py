@@ -0,0 +1,212 @@
+from typing import Callable, List, Optional
+
+import os
+import time
+import uuid
+import pickle
+import socket
+import threading
+
+class UtilSharedFileWorkQueue:
+    '''
+    Work queue on a directory shared by several hosts (NFS, Lustre, ...). It only uses exclusive file creation and rename.
+    {queue_dir}/
+        task_list.pkl : list of tasks, written once by the first node (init.lock)
+        lease/{task_id}.{generation}.lease : the task is being run by a node. The lease of the highest generation is the valid one.
+            The owner touches it every lease_seconds / 3. A lease not touched for lease_seconds (the node crashed) is taken over
+            by creating the next generation exclusively, so only one of the nodes which saw the expired lease gets the task.
+        done/{task_id}.pkl : result of the task
+        finalize.lock : the node which runs the step after all tasks are done
+        finished : written by the finalizing node. A node joining a finished queue has nothing to do.
+    One queue dir is one run. Preprocessor uses {distributed_queue_dir}/{data_name}/{run id} so a changed data list or config is a new run.
+    '''
+
+    def __init__(self, queue_dir:str, lease_seconds:float = 300, poll_seconds:float = 1.0, node_id:str = None) -> None:
+        self.queue_dir:str = queue_dir
+        self.lease_seconds:float = lease_seconds
+        self.poll_seconds:float = poll_seconds
+        self.node_id:str = node_id or f"{socket.gethostname()}_{os.getpid()}"
+        self.task_list:list = None
+        #{task_id: lease path}
+        self.held_lease_path_dict:dict = dict()
+        self.lock = threading.Lock()
+        self.heartbeat_thread:threading.Thread = None
+        self.stop_event = threading.Event()
+        for dir_name in ["lease","done"]:
+            os.makedirs(os.path.join(self.queue_dir,dir_name),exist_ok=True)
+
+    def get_path(self, *name) -> str:
+        return os.path.join(self.queue_dir,*name)
+
+    def create_exclusive(self, path:str, data:bytes = b'') -> bool:
+        try:
+            fd:int = os.open(path,os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd,'wb') as file_writer:
+            file_writer.write(data)
+        return True
+
+    def write_atomic(self, path:str, data:bytes) -> None:
+        temp_path:str = f"{path}.tmp.{self.node_id}.{uuid.uuid4().hex}"
+        with open(temp_path,'wb') as file_writer:
+            file_writer.write(data)
+            file_writer.flush()
+            os.fsync(file_writer.fileno())
+        os.replace(temp_path,path)
+
+    '''
+    ==============================================================
+    task
+    ==============================================================
+    '''
+
+    def is_finished(self) -> bool:
+        return os.path.isfile(self.get_path("finished"))
+
+    def init_task_list(self, make_task_list:Callable[[],list]) -> Optional[list]:
+        '''
+        make_task_list is called only by the first node. The other nodes wait for its task list.
+        return None if the queue is already finished, e.g. a node joined after the others did all the work.
+        '''
+        if self.is_finished():
+            return None
+        if self.create_exclusive(self.get_path("init.lock"),self.node_id.encode()):
+            self.write_atomic(self.get_path("task_list.pkl"),pickle.dumps(make_task_list()))
+        while not os.path.isfile(self.get_path("task_list.pkl")):
+            time.sleep(self.poll_seconds)
+        with open(self.get_path("task_list.pkl"),'rb') as pickle_file:
+            self.task_list = pickle.load(pickle_file)
+        return self.task_list
+
+    def get_task_num(self) -> int:
+        return len(self.task_list)
+
+    def get_done_task_id_set(self) -> set:
+        return {int(file_name.split(".")[0]) for file_name in os.listdir(self.get_path("done")) if file_name.endswith(".pkl")}
+
+    def is_all_done(self) -> bool:
+        return len(self.get_done_task_id_set()) >= self.get_task_num()
+
+    def get_lease_path(self, task_id:int, generation:int) -> str:
+        return self.get_path("lease",f"{task_id}.{generation}.lease")
+
+    def get_lease_generation_dict(self) -> dict:
+        '''
+        {task_id: highest generation of its leases} of the leased tasks
+        '''
+        generation_dict:dict = dict()
+        for file_name in os.listdir(self.get_path("lease")):
+            if not file_name.endswith(".lease"):
+                continue
+            task_id, generation = [int(value) for value in file_name.split(".")[:2]]
+            generation_dict[task_id] = max(generation,generation_dict.get(task_id,generation))
+        return generation_dict
+
+    def try_lease(self, task_id:int, generation:Optional[int]) -> bool:
+        '''
+        generation: highest lease generation of the task seen by get_lease_generation_dict, None if not leased
+        '''
+        if generation is not None:
+            try:
+                expired:bool = time.time() - os.stat(self.get_lease_path(task_id,generation)).st_mtime > self.lease_seconds
+            except FileNotFoundError:
+                #released or taken over meanwhile, look again at the next claim
+                return False
+            if not expired:
+                return False
+        new_generation:int = 0 if generation is None else generation + 1
+        #exclusive creation: of the nodes which saw the same lease, only one gets the next generation
+        lease_path:str = self.get_lease_path(task_id,new_generation)
+        if not self.create_exclusive(lease_path,self.node_id.encode()):
+            return False
+        if generation is not None:
+            print(f"take over the expired lease of task {task_id}")
+            for old_generation in range(generation + 1):
+                try:
+                    os.remove(self.get_lease_path(task_id,old_generation))
+                except FileNotFoundError:
+                    pass
+        with self.lock:
+            self.held_lease_path_dict[task_id] = lease_path
+        return True
+
+    def claim(self) -> Optional[int]:
+        '''
+        return task id leased to this node, None if every task is done or leased by live nodes
+        '''
+        done_task_id_set:set = self.get_done_task_id_set()
+        lease_generation_dict:dict = self.get_lease_generation_dict()
+        for task_id in range(self.get_task_num()):
+            if task_id in done_task_id_set or task_id in self.held_lease_path_dict:
+                continue
+            if self.try_lease(task_id,lease_generation_dict.get(task_id,None)):
+                if os.path.isfile(self.get_path("done",f"{task_id}.pkl")):
+                    #done between listing and leasing
+                    self.release(task_id)
+                    continue
+                self.start_heartbeat()
+                return task_id
+        return None
+
+    def release(self, task_id:int) -> None:
+        with self.lock:
+            lease_path:Optional[str] = self.held_lease_path_dict.pop(task_id,None)
+        if lease_path is None:
+            return
+        try:
+            os.remove(lease_path)
+        except FileNotFoundError:
+            pass
+
+    def complete(self, task_id:int, result) -> None:
+        self.write_atomic(self.get_path("done",f"{task_id}.pkl"),pickle.dumps(result))
+        self.release(task_id)
+
+    def get_result(self, task_id:int):
+        with open(self.get_path("done",f"{task_id}.pkl"),'rb') as pickle_file:
+            return pickle.load(pickle_file)
+
+    '''
+    ==============================================================
+    heartbeat, barrier
+    ==============================================================
+    '''
+
+    def start_heartbeat(self) -> None:
+        if self.heartbeat_thread is not None and self.heartbeat_thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop,daemon=True)
+        self.heartbeat_thread.start()
+
+    def heartbeat_loop(self) -> None:
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            with self.lock:
+                held_lease_path_list:list = list(self.held_lease_path_dict.values())
+            for lease_path in held_lease_path_list:
+                try:
+                    os.utime(lease_path)
+                except FileNotFoundError:
+                    pass
+
+    def stop_heartbeat(self) -> None:
+        self.stop_event.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+
+    def wait_all_done(self) -> None:
+        '''
+        completion barrier: returns when every task is done by any node
+        '''
+        while not self.is_all_done():
+            time.sleep(self.poll_seconds)
+
+    def try_finalize(self) -> bool:
+        '''
+        True on exactly one node, which should run the step after the barrier and then call finish()
+        '''
+        return self.create_exclusive(self.get_path("finalize.lock"),self.node_id.encode())
+
+    def finish(self) -> None:
+        self.write_atomic(self.get_path("finished"),self.node_id.encode())
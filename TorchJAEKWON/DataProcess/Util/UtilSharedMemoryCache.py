@@ -0,0 +1,372 @@
+from typing import Optional
+from numpy import ndarray
+
+import os
+import atexit
+import pickle
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+class UtilSharedMemoryCache:
+    '''
+    Byte-budgeted LRU cache in shared memory.
+    Create it in the main process (e.g. in Dataset.__init__) so every DataLoader worker hits the same cache.
+    Entries are found by key hash in an open addressing table of entry indexes (linear probing, backward shift on removal),
+    so get() only looks at a few slots while holding the lock.
+    The LRU order is a doubly linked list of the entries and the free arena ranges are kept as a gap list ordered by offset,
+    so put() finds space with one vectorized first-fit over the gaps and evicts from the tail of the list without rescanning the table.
+    Values are stored by kind:
+        KIND_ARRAY: ndarray stored raw, so a range of the last axis can be copied out without decoding the whole value.
+        KIND_ARRAY_DICT: dict of ndarray (e.g. DataSet data) stored raw behind a FIELD_DTYPE header, read without unpickling.
+            Values of the dict which are not ndarray are pickled together in one field.
+        KIND_PICKLE: other values are pickled.
+    '''
+    MAX_NDIM:int = 4
+    ALIGN_BYTES:int = 64
+    KIND_PICKLE:int = 0
+    KIND_ARRAY:int = 1
+    KIND_ARRAY_DICT:int = 2
+    ENTRY_DTYPE = np.dtype([
+        ("valid", np.int8),
+        ("kind", np.int8),
+        ("ndim", np.int8),
+        ("dtype", "S8"),
+        ("shape", np.int64, (MAX_NDIM,)),
+        ("key_hash", np.int64),
+        ("offset", np.int64),
+        ("nbytes", np.int64),
+        #LRU list (most recent first). lru_next chains the free entries
+        ("lru_prev", np.int32),
+        ("lru_next", np.int32),
+    ])
+    #index of the header values (int64)
+    LRU_HEAD:int = 0
+    LRU_TAIL:int = 1
+    FREE_ENTRY_HEAD:int = 2
+    GAP_NUM:int = 3
+    HEADER_NUM:int = 4
+    #header of KIND_ARRAY_DICT. offset is from the beginning of the entry
+    FIELD_DTYPE = np.dtype([
+        ("name", "S64"),
+        ("dtype", "S8"),
+        ("ndim", np.int8),
+        ("shape", np.int64, (MAX_NDIM,)),
+        ("offset", np.int64),
+        ("nbytes", np.int64),
+    ])
+    PICKLED_FIELD_NAME:bytes = b"\0pickled"
+
+    def __init__(self, byte_budget:int, max_entry_num:int = 65536) -> None:
+        self.byte_budget:int = int(byte_budget)
+        self.max_entry_num:int = max_entry_num
+        #at most half of the slots are used, so probes stay short
+        self.slot_num:int = max_entry_num * 2
+        #allocated ranges are aligned, so there are at most max_entry_num + 1 gaps
+        self.max_gap_num:int = max_entry_num + 1
+        self.arena_shm = shared_memory.SharedMemory(create=True,size=max(self.byte_budget,1))
+        self.table_shm = shared_memory.SharedMemory(create=True,size=self.get_table_nbytes())
+        self.lock = multiprocessing.Lock()
+        self.owner_pid:int = os.getpid()
+        self.set_array_view()
+        self.entry_table[:] = np.zeros(self.max_entry_num,dtype=self.ENTRY_DTYPE)
+        self.entry_table["lru_next"] = np.arange(1,self.max_entry_num + 1,dtype=np.int32)
+        self.entry_table["lru_next"][-1] = -1
+        self.slot_array[:] = -1
+        self.header[:] = [-1, -1, 0, 1]
+        self.gap_begin_array[0] = 0
+        self.gap_end_array[0] = self.byte_budget
+        atexit.register(self.close)
+
+    def get_table_nbytes(self) -> int:
+        #entries, slots, gap begins, gap ends, header
+        return self.ENTRY_DTYPE.itemsize * self.max_entry_num + 4 * self.slot_num + 8 * 2 * self.max_gap_num + 8 * self.HEADER_NUM
+
+    def set_array_view(self) -> None:
+        self.arena:ndarray = np.ndarray((max(self.byte_budget,1),),dtype=np.uint8,buffer=self.arena_shm.buf)
+        offset:int = 0
+        self.entry_table:ndarray = np.ndarray((self.max_entry_num,),dtype=self.ENTRY_DTYPE,buffer=self.table_shm.buf,offset=offset)
+        offset += self.ENTRY_DTYPE.itemsize * self.max_entry_num
+        self.slot_array:ndarray = np.ndarray((self.slot_num,),dtype=np.int32,buffer=self.table_shm.buf,offset=offset)
+        offset += 4 * self.slot_num
+        self.gap_begin_array:ndarray = np.ndarray((self.max_gap_num,),dtype=np.int64,buffer=self.table_shm.buf,offset=offset)
+        offset += 8 * self.max_gap_num
+        self.gap_end_array:ndarray = np.ndarray((self.max_gap_num,),dtype=np.int64,buffer=self.table_shm.buf,offset=offset)
+        offset += 8 * self.max_gap_num
+        self.header:ndarray = np.ndarray((self.HEADER_NUM,),dtype=np.int64,buffer=self.table_shm.buf,offset=offset)
+
+    def __getstate__(self) -> dict:
+        #used when DataLoader workers are spawned instead of forked
+        state:dict = {key: value for key, value in self.__dict__.items() if key not in ["arena_shm","table_shm","arena","entry_table","slot_array","gap_begin_array","gap_end_array","header"]}
+        state["arena_shm_name"] = self.arena_shm.name
+        state["table_shm_name"] = self.table_shm.name
+        return state
+
+    def __setstate__(self, state:dict) -> None:
+        arena_shm_name:str = state.pop("arena_shm_name")
+        table_shm_name:str = state.pop("table_shm_name")
+        self.__dict__.update(state)
+        #spawned workers share the resource tracker of the main process, which unlinks the memory in close()
+        self.arena_shm = shared_memory.SharedMemory(name=arena_shm_name)
+        self.table_shm = shared_memory.SharedMemory(name=table_shm_name)
+        self.set_array_view()
+
+    def close(self) -> None:
+        if os.getpid() != self.owner_pid or self.arena_shm is None:
+            return
+        self.arena = self.entry_table = self.slot_array = self.gap_begin_array = self.gap_end_array = self.header = None
+        for shm in [self.arena_shm,self.table_shm]:
+            shm.close()
+            shm.unlink()
+        self.arena_shm = self.table_shm = None
+
+    def get_key_hash(self, key:str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(),digest_size=8).digest(),"little",signed=True)
+
+    '''
+    ==============================================================
+    hash table. must be called with the lock held.
+    ==============================================================
+    '''
+
+    def get_home_slot(self, key_hash:int) -> int:
+        return key_hash % self.slot_num
+
+    def find_slot(self, key_hash:int) -> int:
+        slot:int = self.get_home_slot(key_hash)
+        while self.slot_array[slot] >= 0:
+            if self.entry_table["key_hash"][self.slot_array[slot]] == key_hash:
+                return slot
+            slot = (slot + 1) % self.slot_num
+        return -1
+
+    def insert_slot(self, key_hash:int, entry_index:int) -> None:
+        slot:int = self.get_home_slot(key_hash)
+        while self.slot_array[slot] >= 0:
+            slot = (slot + 1) % self.slot_num
+        self.slot_array[slot] = entry_index
+
+    def remove_slot(self, slot:int) -> None:
+        '''
+        backward shift: entries after the removed slot are moved back, so probes never need tombstones
+        '''
+        self.slot_array[slot] = -1
+        next_slot:int = (slot + 1) % self.slot_num
+        while self.slot_array[next_slot] >= 0:
+            home_slot:int = self.get_home_slot(int(self.entry_table["key_hash"][self.slot_array[next_slot]]))
+            #move if the empty slot is on the probe path of the entry (from its home to where it is)
+            if (next_slot - home_slot) % self.slot_num >= (next_slot - slot) % self.slot_num:
+                self.slot_array[slot] = self.slot_array[next_slot]
+                self.slot_array[next_slot] = -1
+                slot = next_slot
+            next_slot = (next_slot + 1) % self.slot_num
+
+    def lru_unlink(self, entry_index:int) -> None:
+        prev_index:int = int(self.entry_table["lru_prev"][entry_index])
+        next_index:int = int(self.entry_table["lru_next"][entry_index])
+        if prev_index >= 0:
+            self.entry_table["lru_next"][prev_index] = next_index
+        else:
+            self.header[self.LRU_HEAD] = next_index
+        if next_index >= 0:
+            self.entry_table["lru_prev"][next_index] = prev_index
+        else:
+            self.header[self.LRU_TAIL] = prev_index
+
+    def lru_push_front(self, entry_index:int) -> None:
+        head_index:int = int(self.header[self.LRU_HEAD])
+        self.entry_table["lru_prev"][entry_index] = -1
+        self.entry_table["lru_next"][entry_index] = head_index
+        if head_index >= 0:
+            self.entry_table["lru_prev"][head_index] = entry_index
+        else:
+            self.header[self.LRU_TAIL] = entry_index
+        self.header[self.LRU_HEAD] = entry_index
+
+    def touch(self, entry_index:int) -> None:
+        if self.header[self.LRU_HEAD] != entry_index:
+            self.lru_unlink(entry_index)
+            self.lru_push_front(entry_index)
+
+    def remove_gap(self, gap_index:int) -> None:
+        gap_num:int = int(self.header[self.GAP_NUM])
+        self.gap_begin_array[gap_index:gap_num - 1] = self.gap_begin_array[gap_index + 1:gap_num]
+        self.gap_end_array[gap_index:gap_num - 1] = self.gap_end_array[gap_index + 1:gap_num]
+        self.header[self.GAP_NUM] = gap_num - 1
+
+    def free_range(self, begin:int, end:int) -> int:
+        '''
+        return index of the gap which now contains [begin, end), merged with the neighbouring gaps
+        '''
+        gap_num:int = int(self.header[self.GAP_NUM])
+        gap_index:int = int(np.searchsorted(self.gap_begin_array[:gap_num],begin))
+        merge_prev:bool = gap_index > 0 and self.gap_end_array[gap_index - 1] == begin
+        merge_next:bool = gap_index < gap_num and self.gap_begin_array[gap_index] == end
+        if merge_prev and merge_next:
+            self.gap_end_array[gap_index - 1] = self.gap_end_array[gap_index]
+            self.remove_gap(gap_index)
+            return gap_index - 1
+        if merge_prev:
+            self.gap_end_array[gap_index - 1] = end
+            return gap_index - 1
+        if merge_next:
+            self.gap_begin_array[gap_index] = begin
+            return gap_index
+        self.gap_begin_array[gap_index + 1:gap_num + 1] = self.gap_begin_array[gap_index:gap_num]
+        self.gap_end_array[gap_index + 1:gap_num + 1] = self.gap_end_array[gap_index:gap_num]
+        self.gap_begin_array[gap_index] = begin
+        self.gap_end_array[gap_index] = end
+        self.header[self.GAP_NUM] = gap_num + 1
+        return gap_index
+
+    def take_from_gap(self, gap_index:int, nbytes:int) -> int:
+        offset:int = int(self.gap_begin_array[gap_index])
+        self.gap_begin_array[gap_index] = min(self.get_aligned(offset + nbytes),int(self.gap_end_array[gap_index]))
+        if self.gap_begin_array[gap_index] == self.gap_end_array[gap_index]:
+            self.remove_gap(gap_index)
+        return offset
+
+    def evict_lru(self) -> int:
+        '''
+        remove the least recently used entry. return index of the gap its range went to
+        '''
+        entry_index:int = int(self.header[self.LRU_TAIL])
+        entry = self.entry_table[entry_index]
+        self.remove_slot(self.find_slot(int(entry["key_hash"])))
+        self.lru_unlink(entry_index)
+        begin:int = int(entry["offset"])
+        gap_index:int = self.free_range(begin,min(self.get_aligned(begin + int(entry["nbytes"])),self.byte_budget))
+        entry["valid"] = 0
+        entry["lru_next"] = self.header[self.FREE_ENTRY_HEAD]
+        self.header[self.FREE_ENTRY_HEAD] = entry_index
+        return gap_index
+
+    '''
+    ==============================================================
+    get, put
+    ==============================================================
+    '''
+
+    def get(self, key:str, begin_sample:int = None, end_sample:int = None) -> Optional[object]:
+        '''
+        return None if key is not cached.
+        begin_sample/end_sample: copy only [..., begin_sample:end_sample] of a cached ndarray
+        '''
+        key_hash:int = self.get_key_hash(key)
+        with self.lock:
+            slot:int = self.find_slot(key_hash)
+            if slot < 0:
+                return None
+            entry_index:int = int(self.slot_array[slot])
+            self.touch(entry_index)
+            row = self.entry_table[entry_index].copy()
+            data:ndarray = self.arena[row["offset"]:row["offset"] + row["nbytes"]]
+            if row["kind"] == self.KIND_ARRAY:
+                value:ndarray = data.view(np.dtype(row["dtype"].decode())).reshape(tuple(row["shape"][:row["ndim"]]))
+                return np.array(value[...,begin_sample:end_sample] if (begin_sample is not None or end_sample is not None) else value)
+            if row["kind"] == self.KIND_ARRAY_DICT:
+                return self.read_array_dict(data)
+            data_bytes:bytes = data.tobytes()
+        return pickle.loads(data_bytes)
+
+    def put(self, key:str, value:object) -> None:
+        kind:int = self.KIND_PICKLE
+        if self.is_raw_array(value):
+            kind = self.KIND_ARRAY
+            data:ndarray = np.ascontiguousarray(value).reshape(-1).view(np.uint8)
+        elif isinstance(value,dict) and all(isinstance(name,str) and len(name.encode()) <= self.FIELD_DTYPE["name"].itemsize for name in value):
+            kind = self.KIND_ARRAY_DICT
+            data = self.make_array_dict_data(value)
+        else:
+            data = np.frombuffer(pickle.dumps(value,protocol=pickle.HIGHEST_PROTOCOL),dtype=np.uint8)
+        if len(data) > self.byte_budget or len(data) == 0:
+            return
+
+        key_hash:int = self.get_key_hash(key)
+        with self.lock:
+            if self.find_slot(key_hash) >= 0:
+                return
+            while self.header[self.FREE_ENTRY_HEAD] < 0:
+                self.evict_lru()
+            offset:int = self.allocate(len(data))
+            entry_index:int = int(self.header[self.FREE_ENTRY_HEAD])
+            self.header[self.FREE_ENTRY_HEAD] = self.entry_table["lru_next"][entry_index]
+            self.arena[offset:offset + len(data)] = data
+            row = np.zeros((),dtype=self.ENTRY_DTYPE)
+            row["valid"] = 1
+            row["kind"] = kind
+            if kind == self.KIND_ARRAY:
+                row["ndim"] = value.ndim
+                row["dtype"] = value.dtype.str.encode()
+                row["shape"][:value.ndim] = value.shape
+            row["key_hash"] = key_hash
+            row["offset"] = offset
+            row["nbytes"] = len(data)
+            self.entry_table[entry_index] = row
+            self.insert_slot(key_hash,entry_index)
+            self.lru_push_front(entry_index)
+
+    def is_raw_array(self, value:object) -> bool:
+        return isinstance(value,ndarray) and value.dtype != object and value.ndim <= self.MAX_NDIM and len(value.dtype.str) <= 8
+
+    def get_aligned(self, nbytes:int) -> int:
+        return -(-nbytes // self.ALIGN_BYTES) * self.ALIGN_BYTES
+
+    def make_array_dict_data(self, value_dict:dict) -> ndarray:
+        array_name_list:list = [name for name in value_dict if self.is_raw_array(value_dict[name])]
+        non_array_dict:dict = {name: value_dict[name] for name in value_dict if name not in array_name_list}
+        field_num:int = len(array_name_list) + (1 if len(non_array_dict) > 0 else 0)
+        field_array:ndarray = np.zeros(field_num,dtype=self.FIELD_DTYPE)
+        data_offset:int = self.get_aligned(8 + field_array.nbytes)
+        byte_list:list = list()
+        for field_index, name in enumerate(array_name_list):
+            value:ndarray = value_dict[name]
+            field_array[field_index]["name"] = name.encode()
+            field_array[field_index]["dtype"] = value.dtype.str.encode()
+            field_array[field_index]["ndim"] = value.ndim
+            field_array[field_index]["shape"][:value.ndim] = value.shape
+            byte_list.append(np.ascontiguousarray(value).reshape(-1).view(np.uint8))
+        if len(non_array_dict) > 0:
+            field_array[-1]["name"] = self.PICKLED_FIELD_NAME
+            byte_list.append(np.frombuffer(pickle.dumps(non_array_dict,protocol=pickle.HIGHEST_PROTOCOL),dtype=np.uint8))
+        for field_index, value_bytes in enumerate(byte_list):
+            field_array[field_index]["offset"] = data_offset
+            field_array[field_index]["nbytes"] = len(value_bytes)
+            data_offset = self.get_aligned(data_offset + len(value_bytes))
+
+        data:ndarray = np.zeros(data_offset,dtype=np.uint8)
+        data[:8] = np.array([field_num],dtype=np.int64).view(np.uint8)
+        data[8:8 + field_array.nbytes] = field_array.view(np.uint8)
+        for field, value_bytes in zip(field_array,byte_list):
+            data[field["offset"]:field["offset"] + field["nbytes"]] = value_bytes
+        return data
+
+    def read_array_dict(self, data:ndarray) -> dict:
+        '''
+        copies the arrays out of the arena. must be called with the lock held.
+        '''
+        field_num:int = int(data[:8].view(np.int64)[0])
+        field_array:ndarray = data[8:8 + field_num * self.FIELD_DTYPE.itemsize].view(self.FIELD_DTYPE)
+        value_dict:dict = dict()
+        for field in field_array:
+            field_data:ndarray = data[field["offset"]:field["offset"] + field["nbytes"]]
+            if field["name"] == self.PICKLED_FIELD_NAME:
+                value_dict.update(pickle.loads(field_data.tobytes()))
+            else:
+                value_dict[field["name"].decode()] = np.array(field_data.view(np.dtype(field["dtype"].decode())).reshape(tuple(field["shape"][:field["ndim"]])))
+        return value_dict
+
+    def allocate(self, nbytes:int) -> int:
+        '''
+        first-fit over the gaps, then evicting least recently used entries until the gap they free fits nbytes.
+        must be called with the lock held.
+        '''
+        gap_num:int = int(self.header[self.GAP_NUM])
+        fit_gap_array:ndarray = np.flatnonzero(self.gap_end_array[:gap_num] - self.gap_begin_array[:gap_num] >= nbytes)
+        if len(fit_gap_array) > 0:
+            return self.take_from_gap(int(fit_gap_array[0]),nbytes)
+        while True:
+            gap_index:int = self.evict_lru()
+            if self.gap_end_array[gap_index] - self.gap_begin_array[gap_index] >= nbytes:
+                return self.take_from_gap(gap_index,nbytes)
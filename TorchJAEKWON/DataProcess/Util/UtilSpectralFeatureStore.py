@@ -0,0 +1,58 @@
+from typing import Optional
+
+import os
+
+from HParams import HParams
+from TorchJAEKWON.DataProcess.Util.UtilData import UtilData
+
+class UtilSpectralFeatureStore:
+    '''
+    Spectral features (STFT magnitude, mel) precomputed from preprocessed audio by MakeMetaDataSpectralFeature.
+    {root_path}/{data_name}/{STORE_DIR_NAME}/{config_hash}/{subset}/{name}.pkl : {f'{feature_name}_{feature_type}': ndarray}
+    config_hash is UtilData.get_config_hash of the preprocess values the features depend on (CONFIG_KEY_LIST),
+    so features of another stft / mel config are never read, and changing the config just makes a new store.
+    STORE_DIR_NAME is fixed and listed in UtilManifest.NOT_SUBSET_DIR_LIST, so it isn't taken for a subset of the dataset.
+    '''
+    CONFIG_KEY_LIST:list = ["sr","nfft","hopsize","mel_size","fmin","fmax"]
+    FEATURE_TYPE_LIST:list = ["mag","mel"]
+    STORE_DIR_NAME:str = "spectral_feature"
+
+    def __init__(self) -> None:
+        self.h_params = HParams()
+        self.util_data = UtilData()
+        self.config_dict:dict = {key: getattr(self.h_params.preprocess,key,None) for key in self.CONFIG_KEY_LIST}
+        self.config_hash:str = self.util_data.get_config_hash(self.config_dict)
+
+    def get_feature_name(self, feature_name:str, feature_type:str) -> str:
+        assert feature_type in self.FEATURE_TYPE_LIST, f"feature_type should be one of {self.FEATURE_TYPE_LIST}"
+        return f"{feature_name}_{feature_type}"
+
+    def get_store_path(self, data_root_path:str) -> str:
+        return os.path.join(data_root_path,self.STORE_DIR_NAME,self.config_hash)
+
+    def get_feature_path(self, data_path:str) -> str:
+        #data path: {root_path}/{data_name}/{subset}/{file_name}
+        subset_path, file_name = os.path.split(os.path.normpath(data_path))
+        data_root_path, subset = os.path.split(subset_path)
+        return os.path.join(self.get_store_path(data_root_path),subset,f"{os.path.splitext(file_name)[0]}.pkl")
+
+    def save_config(self, data_root_path:str) -> None:
+        os.makedirs(self.get_store_path(data_root_path),exist_ok=True)
+        self.util_data.yaml_save(os.path.join(self.get_store_path(data_root_path),"config.yaml"),self.config_dict)
+
+    def save(self, data_path:str, feature_dict:dict) -> None:
+        feature_path:str = self.get_feature_path(data_path)
+        os.makedirs(os.path.dirname(feature_path),exist_ok=True)
+        #write to temporary file and rename, so a killed job doesn't leave a broken store
+        temp_path:str = f"{os.path.splitext(feature_path)[0]}_tmp{os.getpid()}.pkl"
+        self.util_data.pickle_save(temp_path,feature_dict)
+        os.replace(temp_path,feature_path)
+
+    def load(self, data_path:str) -> Optional[dict]:
+        '''
+        return None if the features of data_path are not stored for the current config
+        '''
+        feature_path:str = self.get_feature_path(data_path)
+        if not os.path.isfile(feature_path):
+            return None
+        return self.util_data.pickle_load(feature_path)
@@ -0,0 +1,122 @@
+from typing import Iterator, Tuple
+
+import io
+import os
+import pickle
+import tarfile
+import numpy as np
+
+class UtilTarShard:
+    '''
+    Examples written sequentially into tar archives, for streaming reads (DataSetStreamingShard).
+    {shard_dir_path}/
+        shard_00000.tar, shard_00001.tar, ... : members '{example_number}.{feature_name}.npy' (ndarray) or '.pkl' (others),
+            members of an example are contiguous. '/' in example names is replaced, the name is kept in '{example_number}.__name__.pkl'.
+        shard_index.pkl : {"shard_file_name_list", "example_num_list"}
+    Same writer interface as UtilPackedShard (open_writer, write_example, close_writer, get_example_num).
+    '''
+    NAME_MEMBER:str = "__name__"
+
+    def __init__(self, shard_dir_path:str) -> None:
+        self.shard_dir_path:str = shard_dir_path
+        self.shard_index:dict = None
+
+    '''
+    ==============================================================
+    write
+    ==============================================================
+    '''
+
+    def open_writer(self, shard_size_bytes:int = 2**30) -> None:
+        os.makedirs(self.shard_dir_path,exist_ok=True)
+        self.shard_size_bytes:int = shard_size_bytes
+        self.shard_index = {"shard_file_name_list":[], "example_num_list":[]}
+        self.shard_writer:tarfile.TarFile = None
+        self.shard_file = None
+        self.example_number:int = 0
+        self.open_new_shard()
+
+    def open_new_shard(self) -> None:
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+            self.shard_file.close()
+        shard_file_name:str = f"shard_{str(len(self.shard_index['shard_file_name_list'])).zfill(5)}.tar"
+        self.shard_index["shard_file_name_list"].append(shard_file_name)
+        self.shard_index["example_num_list"].append(0)
+        self.shard_file = open(os.path.join(self.shard_dir_path,shard_file_name),'wb')
+        self.shard_writer = tarfile.open(fileobj=self.shard_file,mode='w|')
+
+    def add_member(self, member_name:str, member_bytes:bytes) -> None:
+        tar_info = tarfile.TarInfo(member_name)
+        tar_info.size = len(member_bytes)
+        self.shard_writer.addfile(tar_info,io.BytesIO(member_bytes))
+
+    def write_example(self, name:str, feature_dict:dict) -> None:
+        if self.shard_index["example_num_list"][-1] > 0 and self.shard_file.tell() >= self.shard_size_bytes:
+            self.open_new_shard()
+        example_key:str = str(self.example_number).zfill(10)
+        self.add_member(f"{example_key}.{self.NAME_MEMBER}.pkl",pickle.dumps(name))
+        for feature_name in feature_dict:
+            feature = feature_dict[feature_name]
+            if isinstance(feature,np.ndarray) and feature.dtype != object:
+                npy_bytes = io.BytesIO()
+                np.save(npy_bytes,feature)
+                self.add_member(f"{example_key}.{feature_name}.npy",npy_bytes.getvalue())
+            else:
+                self.add_member(f"{example_key}.{feature_name}.pkl",pickle.dumps(feature))
+        self.shard_index["example_num_list"][-1] += 1
+        self.example_number += 1
+
+    def close_writer(self) -> None:
+        self.shard_writer.close()
+        self.shard_file.close()
+        self.shard_writer = None
+        with open(os.path.join(self.shard_dir_path,"shard_index.pkl"),'wb') as file_writer:
+            pickle.dump(self.shard_index,file_writer)
+
+    '''
+    ==============================================================
+    read
+    ==============================================================
+    '''
+
+    def load_index(self) -> dict:
+        if self.shard_index is None:
+            with open(os.path.join(self.shard_dir_path,"shard_index.pkl"),'rb') as pickle_file:
+                self.shard_index = pickle.load(pickle_file)
+        return self.shard_index
+
+    def get_example_num(self) -> int:
+        return int(sum(self.load_index()["example_num_list"]))
+
+    def get_shard_num(self) -> int:
+        return len(self.load_index()["shard_file_name_list"])
+
+    def read_shard(self, shard_index:int, feature_name_list:list = None, buffer_size:int = 2**24) -> Iterator[Tuple[str,dict]]:
+        '''
+        yield (name, feature_dict) in the written order. The shard is read front to back with large reads.
+        '''
+        shard_path:str = os.path.join(self.shard_dir_path,self.load_index()["shard_file_name_list"][shard_index])
+        example_key:str = None
+        name:str = None
+        feature_dict:dict = dict()
+        with open(shard_path,'rb',buffering=buffer_size) as shard_file, tarfile.open(fileobj=shard_file,mode='r|') as shard_reader:
+            for tar_info in shard_reader:
+                if not tar_info.isfile():
+                    continue
+                member_example_key, member_name = tar_info.name.split(".",1)
+                feature_name, ext = member_name.rsplit(".",1)
+                if member_example_key != example_key:
+                    if example_key is not None:
+                        yield name, feature_dict
+                    example_key, name, feature_dict = member_example_key, None, dict()
+                if feature_name != self.NAME_MEMBER and feature_name_list is not None and feature_name not in feature_name_list:
+                    continue
+                member_bytes:bytes = shard_reader.extractfile(tar_info).read()
+                value = np.load(io.BytesIO(member_bytes)) if ext == "npy" else pickle.loads(member_bytes)
+                if feature_name == self.NAME_MEMBER:
+                    name = value
+                else:
+                    feature_dict[feature_name] = value
+        if example_key is not None:
+            yield name, feature_dict
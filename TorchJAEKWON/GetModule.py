@@ -11,6 +11,8 @@ class GetModule:
         self.root_path_dict["pytorch_dataLoader"] = "./Data/PytorchDataLoader"
         self.root_path_dict["pytorch_dataset"] = "./Data/PytorchDataset"
         self.root_path_dict["batch_sampler"] = "./Data/PytorchDataLoader/BatchSampler"
+        self.root_path_dict["prefetcher"] = "./Data/PytorchDataLoader/Prefetcher"
+        self.root_path_dict["collate_fn"] = "./Data/PytorchDataLoader/Collate"
         self.root_path_dict["process"] = "./DataProcess/Process"
         self.root_path_dict["log_writer"] = "./Train/LogWriter"
         self.root_path_dict["trainer"] = "./Train/Trainer"
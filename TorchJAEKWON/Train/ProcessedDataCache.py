@@ -0,0 +1,63 @@
+from typing import Iterator
+
+import os
+import torch
+
+class ProcessedDataCache(object):
+    """Keeps processed batches of a deterministic data loader (e.g. validation) to replay them every epoch.
+    cache_type 'memory': batches are kept on cpu and moved to device when replayed.
+    cache_type 'disk': batches are saved to {cache_dir}/{index}.pt and loaded to device when replayed.
+    The cache is complete only after one whole pass. It is discarded if the pass is interrupted.
+    """
+
+    def __init__(self, cache_type:str, device, cache_dir:str = None):
+        assert cache_type in ["memory","disk"], f"cache type should be 'memory' or 'disk', not {cache_type}"
+        assert cache_type == "memory" or cache_dir is not None, "cache_dir is needed for disk cache"
+        self.cache_type:str = cache_type
+        self.device = device
+        self.cache_dir:str = cache_dir
+        self.reset()
+
+    def reset(self):
+        self.is_complete:bool = False
+        self.data_list:list = list()
+        self.data_num:int = 0
+        if self.cache_type == "disk":
+            os.makedirs(self.cache_dir,exist_ok=True)
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(".pt"):
+                    os.remove(os.path.join(self.cache_dir,file_name))
+
+    def to(self, data, device, non_blocking:bool = False):
+        if isinstance(data, torch.Tensor):
+            return data.to(device, non_blocking=non_blocking)
+        if isinstance(data, dict):
+            return {key: self.to(data[key], device, non_blocking) for key in data}
+        if isinstance(data, (list, tuple)):
+            return type(data)(self.to(value, device, non_blocking) for value in data)
+        return data
+
+    def append(self, data):
+        if self.is_complete:
+            return
+        if self.cache_type == "memory":
+            self.data_list.append(self.to(data, "cpu"))
+        else:
+            torch.save(self.to(data, "cpu"), os.path.join(self.cache_dir,f"{str(self.data_num).zfill(8)}.pt"))
+        self.data_num += 1
+
+    def finish(self, complete:bool = True):
+        if complete:
+            self.is_complete = True
+        else:
+            self.reset()
+
+    def __len__(self):
+        return self.data_num
+
+    def __iter__(self) -> Iterator:
+        for index in range(self.data_num):
+            if self.cache_type == "memory":
+                yield self.to(self.data_list[index], self.device, non_blocking=True)
+            else:
+                yield torch.load(os.path.join(self.cache_dir,f"{str(index).zfill(8)}.pt"), map_location=self.device, weights_only=False)
@@ -1,9 +1,11 @@
 from typing import Dict
 
 import os
+import time
 from abc import ABC, abstractmethod
 from enum import Enum,unique
 import random
+from functools import partial
 import numpy as np
 import torch
 import torch.nn as nn
@@ -15,6 +17,7 @@ from TorchJAEKWON.Data.PytorchDataLoader.PytorchDataLoader import PytorchDataLoa
 from TorchJAEKWON.Train.LogWriter.LogWriter import LogWriter
 from TorchJAEKWON.Train.Optimizer.OptimizerControl import OptimizerControl
 from TorchJAEKWON.Train.AverageMeter import AverageMeter
+from TorchJAEKWON.Train.ProcessedDataCache import ProcessedDataCache
 from TorchJAEKWON.Train.Loss.LossControl.LossControl import LossControl
 
 @unique
@@ -48,9 +51,18 @@ class Trainer(ABC):
 
         self.global_step:int = 0
         self.local_step:int = 0
+        self.resume_local_step:int = 0
+
+        self.checkpoint_every_step:int = getattr(self.h_params.train,"checkpoint_every_step",None)
+        self.checkpoint_every_seconds:float = getattr(self.h_params.train,"checkpoint_every_seconds",None)
+        self.last_checkpoint_time:float = time.time()
 
         self.log_writer:LogWriter = None
 
+        #'memory' or 'disk': processed validation batches (see data_to_processed_data) of the first epoch are replayed every epoch. made in init_train
+        self.valid_data_cache_type:str = getattr(self.h_params.train,"valid_data_cache",None)
+        self.valid_data_cache:ProcessedDataCache = None
+
     '''
     ==============================================================
     abstract method start
@@ -75,6 +87,14 @@ class Trainer(ABC):
         """
         raise NotImplementedError
 
+    def data_to_processed_data(self,data,train_state:TrainState):
+        """
+        process a batch of the data loader before run_step (e.g. to device, stft, mel spectrogram).
+        It should be deterministic for validation, so the result can be cached by h_params.train.valid_data_cache.
+        default: data as it is. Override it to move the processing out of run_step, otherwise valid_data_cache only caches the loaded batches.
+        """
+        return data
+
     def save_best_model(self,prev_best_metric, current_metric):
         """
         compare what is the best metric
@@ -137,6 +157,23 @@ class Trainer(ABC):
         np.random.seed(self.seed)
         random.seed(self.seed)
 
+    def get_rng_state_dict(self) -> dict:
+        numpy_rng_state = np.random.get_state()
+        return {
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'numpy': (numpy_rng_state[0], torch.from_numpy(numpy_rng_state[1].astype(np.int64)), *numpy_rng_state[2:]),
+            'random': random.getstate()
+        }
+    
+    def set_rng_state_dict(self, rng_state_dict:dict) -> None:
+        torch.set_rng_state(rng_state_dict['torch'])
+        if torch.cuda.is_available() and rng_state_dict['cuda'] is not None:
+            torch.cuda.set_rng_state_all(rng_state_dict['cuda'])
+        numpy_rng_state = rng_state_dict['numpy']
+        np.random.set_state((numpy_rng_state[0], np.asarray(numpy_rng_state[1],dtype=np.uint32), *numpy_rng_state[2:]))
+        random.setstate(rng_state_dict['random'])
+
     def init_train(self, dataset_dict=None):
         self.model:nn.Module = self.get_module.get_model(self.h_params.model.class_name)
         self.optimizer_control = self.get_module.get_module("optimizer",self.h_params.train.optimizer_control_config['class_name'],{"model":self.model},arg_unpack=True)
@@ -157,6 +194,13 @@ class Trainer(ABC):
             module_name=self.h_params.train.log_writer_class_name,
             module_arg={"model":self.model})
 
+        if self.valid_data_cache_type is not None:
+            if type(self).data_to_processed_data is Trainer.data_to_processed_data:
+                print("Warning: valid_data_cache is set but data_to_processed_data is not overridden, so only the loaded batches are cached.")
+            #default in the log dir of the run, since reset() removes every cached batch of the dir
+            valid_data_cache_dir:str = getattr(self.h_params.train,"valid_data_cache_dir",None) or os.path.join(self.log_writer.log_path["root"],"valid_data_cache")
+            self.valid_data_cache = ProcessedDataCache(self.valid_data_cache_type,self.h_params.resource.device,valid_data_cache_dir)
+
         self.set_data_loader(dataset_dict)
     
     def set_data_loader(self,dataset_dict=None):
@@ -171,6 +215,17 @@ class Trainer(ABC):
         self.train_data_loader = data_loader_dict["train"]
         self.valid_data_loader = data_loader_dict["valid"]
         self.test_data_loader = None
+
+        for data_loader, train_state in [(self.train_data_loader,TrainState.TRAIN),(self.valid_data_loader,TrainState.VALIDATE)]:
+            if hasattr(data_loader,"set_batch_process_fn"):
+                data_loader.set_batch_process_fn(partial(self.process_batch_on_prefetch,train_state=train_state))
+
+    def process_batch_on_prefetch(self, data, train_state:TrainState):
+        '''
+        Called on the prefetch thread with the batch already on the device when the data loader has a prefetcher.
+        Override to move cheap per-batch preprocessing (e.g. feature extraction) off the training loop.
+        '''
+        return data
     
     def fit(self):
         for _ in range(self.current_epoch, self.total_epoch):
@@ -186,6 +241,8 @@ class Trainer(ABC):
     
             #Train
             self.log_writer.print_and_log('train_start',self.global_step)
+            if hasattr(getattr(self.train_data_loader,"dataset",None),"set_epoch"):
+                self.train_data_loader.dataset.set_epoch(self.current_epoch)
             self.run_epoch(self.train_data_loader,TrainState.TRAIN, metric_range = "step")
             
             #Valid
@@ -214,12 +271,22 @@ class Trainer(ABC):
         else:
             self.model.eval()
 
+        if hasattr(getattr(dataloader,"batch_sampler",None),"start_epoch"):
+            dataloader.batch_sampler.start_epoch()
         dataset_size = len(dataloader)
 
         if metric_range == "epoch":
             metric = self.metric_init()
 
-        for step,data in enumerate(dataloader):
+        #when resumed from a mid-epoch checkpoint, the rest of the epoch is trained. A sampler with state_dict continues from the saved position.
+        start_step:int = self.resume_local_step if train_state == TrainState.TRAIN else 0
+        self.resume_local_step = 0
+
+        data_cache:ProcessedDataCache = self.valid_data_cache if train_state == TrainState.VALIDATE else None
+        use_cached_data:bool = data_cache is not None and data_cache.is_complete
+        processed_step_num:int = 0
+
+        for step,data in enumerate(data_cache if use_cached_data else dataloader,start=start_step):
 
             if metric_range == "step":
                 metric = self.metric_init()
@@ -228,6 +295,11 @@ class Trainer(ABC):
                 break
 
             self.local_step = step
+            if not use_cached_data:
+                data = self.data_to_processed_data(data,train_state)
+                if data_cache is not None:
+                    data_cache.append(data)
+            processed_step_num += 1
             loss,metric = self.run_step(data,metric,train_state)
         
             if train_state == TrainState.TRAIN:
@@ -241,16 +313,36 @@ class Trainer(ABC):
                 self.global_step += 1
 
                 self.optimizer_control.lr_scheduler_step(interval_type="step")
+
+                if self.is_mid_epoch_checkpoint_time() and step + 1 < dataset_size:
+                    self.save_checkpoint(local_step=step + 1, consumed_batch_num=step + 1 - start_step)
+                    self.save_checkpoint("train_checkpoint_backup.pth", local_step=step + 1, consumed_batch_num=step + 1 - start_step)
         
+        if data_cache is not None and not use_cached_data:
+            data_cache.finish(complete = processed_step_num == dataset_size)
+
         if train_state == TrainState.VALIDATE or train_state == TrainState.TEST:
             self.log_metric(metrics=metric,data_size=dataset_size,train_state=train_state)
 
         if train_state == TrainState.TRAIN:
-            self.save_checkpoint()
-            self.save_checkpoint("train_checkpoint_backup.pth")
+            self.save_checkpoint(local_step=dataset_size, consumed_batch_num=max(dataset_size - start_step,0))
+            self.save_checkpoint("train_checkpoint_backup.pth", local_step=dataset_size, consumed_batch_num=max(dataset_size - start_step,0))
 
         return metric
     
+    def is_mid_epoch_checkpoint_time(self) -> bool:
+        if self.checkpoint_every_step is not None and self.global_step % self.checkpoint_every_step == 0:
+            return True
+        if self.checkpoint_every_seconds is not None and time.time() - self.last_checkpoint_time >= self.checkpoint_every_seconds:
+            return True
+        return False
+    
+    def get_train_batch_sampler(self):
+        batch_sampler = getattr(self.train_data_loader,"batch_sampler",None)
+        if batch_sampler is not None and hasattr(batch_sampler,"state_dict") and hasattr(batch_sampler,"load_state_dict"):
+            return batch_sampler
+        return None
+    
     def metric_init(self):
         loss_name_list = self.loss_control.get_loss_function_name_list()
         initialized_metric = dict()
@@ -269,20 +361,31 @@ class Trainer(ABC):
         best_model_load = torch.load(path)
         self.model.load_state_dict(best_model_load)
     
-    def save_checkpoint(self,save_name:str = 'train_checkpoint.pth'):
+    def save_checkpoint(self,save_name:str = 'train_checkpoint.pth', local_step:int = 0, consumed_batch_num:int = None):
+        """
+        local_step: number of train steps of current epoch already done. Training resumes from this step.
+        consumed_batch_num: number of batches consumed from the current train data loader iterator,
+            used to get the sampler position of the last trained batch.
+        """
         train_state = {
             'epoch': self.current_epoch,
             'step': self.global_step,
+            'local_step': local_step,
             'seed': self.seed,
             'models': self.model.state_dict() if not self.h_params.resource.multi_gpu else self.model.module.state_dict(),
             'optimizers': self.optimizer_control.optimizer_state_dict(),
             'lr_scheduler': self.optimizer_control.lr_scheduler_state_dict(),
             'best_metric': self.best_valid_metric,
             'best_model_epoch' :  self.best_valid_epoch,
+            'rng_state': self.get_rng_state_dict(),
         }
+        batch_sampler = self.get_train_batch_sampler()
+        if batch_sampler is not None:
+            train_state['train_batch_sampler'] = batch_sampler.state_dict(consumed_batch_num) if consumed_batch_num is not None else batch_sampler.state_dict()
         path = os.path.join(self.log_writer.log_path["root"],save_name)
         self.log_writer.print_and_log(save_name,self.global_step)
         torch.save(train_state,path)
+        self.last_checkpoint_time = time.time()
 
     def load_train(self,filename:str):
         cpt = torch.load(filename)
@@ -290,8 +393,14 @@ class Trainer(ABC):
         self.set_seeds(self.h_params.train.seed_strict)
         self.current_epoch = cpt['epoch']
         self.global_step = cpt['step']
+        self.resume_local_step = cpt.get('local_step',0)
         self.model.load_state_dict(cpt['models'])
         self.optimizer_control.optimizer_load_state_dict(cpt['optimizers'])
         self.optimizer_control.lr_scheduler_load_state_dict(cpt['lr_scheduler'])
         self.best_valid_result = cpt['best_metric']
-        self.best_valid_epoch = cpt['best_model_epoch']
\ No newline at end of file
+        self.best_valid_epoch = cpt['best_model_epoch']
+        if 'rng_state' in cpt:
+            self.set_rng_state_dict(cpt['rng_state'])
+        batch_sampler = self.get_train_batch_sampler()
+        if 'train_batch_sampler' in cpt and batch_sampler is not None:
+            batch_sampler.load_state_dict(cpt['train_batch_sampler'])
@@ -51,7 +51,7 @@ class Mode:
     config_parent_path:str = ""
     config_path:str = f"./Config/{config_parent_path}/{config_name}.yaml"
 
-    app:str = {0:"preprocess", 1:"make_meta_data", 2:"train", 3:"inference", 4:"evaluate"}[0]
+    app:str = {0:"preprocess", 1:"make_meta_data", 2:"train", 3:"inference", 4:"evaluate", 5:"tune_data_loader"}[0]
 
     train:str = ["start","resume"][0]
     resume_path:str = f"./Train/Log/{config_name}"
@@ -80,6 +80,18 @@ class Data:
 class PreProcess:
     multi_processing:bool = True
     max_workers:int = None
+    make_manifest:bool = True
+    storage_dtype_dict = dict()
+    manifest_feature_length:bool = True
+    chunksize:int = None
+    largest_first:bool = True
+    retry_num:int = 1
+    only_failed:bool = False
+    progress_interval_seconds:float = 10
+    incremental:bool = False
+    distributed_queue_dir:str = None
+    distributed_lease_seconds:float = 300
+    distributed_run_id:str = None
 
 @dataclass
 class Process:
@@ -93,6 +105,8 @@ class MakeMetaData:
 class PytorchData:
     class_root_dir:str = "./Data/PytorchDataset"
     dataloader = dict()
+    tuned_config_path:str = None
+    tune_config = dict()
 
 @dataclass
 class Model:
@@ -113,6 +127,10 @@ class Train:
     epoch:int = 3000
     save_model_after_epoch:int = 200
     save_model_every_epoch:int = 100
+    checkpoint_every_step:int = None
+    checkpoint_every_seconds:float = None
+    valid_data_cache:str = [None,"memory","disk"][0]
+    valid_data_cache_dir:str = None
 
 @dataclass
 class Inference():
@@ -3,6 +3,7 @@ from TorchJAEKWON.GetModule import GetModule
 from TorchJAEKWON.DataProcess.Preprocess.Preprocessor import Preprocessor
 from TorchJAEKWON.DataProcess.MakeMetaData.MakeMetaData import MakeMetaData
 from TorchJAEKWON.Train.Trainer.Trainer import Trainer
+from TorchJAEKWON.Data.PytorchDataLoader.PytorchDataLoaderTuner import PytorchDataLoaderTuner
 from TorchJAEKWON.Inference.Inferencer.Inferencer import Inferencer
 from TorchJAEKWON.Evaluater.Evaluater import Evaluater
 
@@ -34,6 +35,9 @@ class Controller():
 
         if self.h_params.mode.app == "evaluate":
             self.evaluate()
+
+        if self.h_params.mode.app == "tune_data_loader":
+            self.tune_data_loader()
         
         print("Finish app.")
 
@@ -67,6 +71,10 @@ class Controller():
         inferencer:Inferencer = self.get_module.get_module("inferencer", self.h_params.inference.class_name,arg_unpack=True)
         inferencer.inference()
 
+    def tune_data_loader(self) -> None:
+        data_loader_tuner:PytorchDataLoaderTuner = PytorchDataLoaderTuner()
+        data_loader_tuner.tune()
+
     def evaluate(self):
         evaluater:Evaluater = self.get_module.get_module("evaluater", self.h_params.evaluate.class_name, module_arg=self.h_params,arg_unpack=False)
         evaluater.process()